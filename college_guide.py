@@ -1,15 +1,13 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import pydeck as pdk
-import yaml
 import os, sys, math
 import college_guide_shared as cgs
 pd.options.mode.chained_assignment = None
 
 st.set_page_config(layout="wide") # Set the page layout to wide
 
-#cgs.load_data()
+## load the data and the indexes in the background, while the landing page is shown
+cgs.start_warmup()
 
 st.subheader(f"Welcome to the {cgs.app_name}!")
 st.markdown(f"#### What is the ***{cgs.app_name}***?")
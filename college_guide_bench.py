@@ -0,0 +1,222 @@
+import argparse
+import gzip
+import json
+import os, sys, time, shutil, platform, tempfile
+import numpy as np
+import pandas as pd
+import college_guide_shared as cgs
+
+## This script benchmarks the hot paths of the college_guide app on synthetic data of various sizes
+## Usage: python college_guide_bench.py [--sizes 2000 20000] [--years 27] [--output bench.json]
+
+## create a synthetic wide-formatted file with num_rows colleges, resampled from the real wide-formatted file
+## (the columns match what cgs.parse_data() expects; ids are renumbered and the values jittered)
+def generate_wide(fname, num_rows, rng):
+    df_src = pd.read_csv(cgs.widef, sep="\t")
+    df = df_src.iloc[rng.integers(0, len(df_src), num_rows)].reset_index(drop=True)
+    df['id'] = np.arange(num_rows) + 100000
+    df['name'] = [f"{x} #{i}" for i, x in enumerate(df['name'])]
+    for colname in df.columns:
+        if colname in ('location.lat', 'location.lon'):
+            df[colname] = df[colname] + rng.normal(0, 0.2, num_rows)
+        elif df[colname].dtype == float:
+            df[colname] = df[colname] * rng.lognormal(0, 0.05, num_rows)
+    df.to_csv(fname, sep="\t", index=False)
+    return df['id'].to_numpy()
+
+## create a synthetic gzip'd tall-formatted file for the given ids, with a fraction (density) of
+## (id, metric, year) present, including a metric outside of cgs.lts that the loader drops
+def generate_tall(fname, ids, num_years, density, rng, block_size=2000):
+    metrics = np.array(list(cgs.lts.keys()) + ['UNUSED_METRIC'])
+    years = np.arange(2023 - num_years, 2023)
+    with gzip.open(fname, 'wt', compresslevel=1) as fh:
+        for start in range(0, len(ids), block_size):
+            inst, metric, year = np.meshgrid(ids[start:start+block_size], np.arange(len(metrics)), years, indexing='ij')
+            keep = rng.random(inst.size) < density
+            df = pd.DataFrame({
+                'INSTID': inst.ravel()[keep],
+                'COLUMN': metrics[metric.ravel()[keep]],
+                'YEAR': year.ravel()[keep],
+                'VALUE': np.round(rng.random(keep.sum()) * 1000, 4),
+            })
+            df.to_csv(fh, sep="\t", index=False, header=(start == 0))
+
+## run func repeatedly and summarize the wall time in milliseconds
+def time_case(results, size, case, func, repeat):
+    timings = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(i)
+        timings.append((time.perf_counter() - start) * 1000)
+    result = {
+        'size': size,
+        'case': case,
+        'repeat': repeat,
+        'min_ms': min(timings),
+        'median_ms': float(np.median(timings)),
+        'mean_ms': float(np.mean(timings)),
+        'max_ms': max(timings),
+    }
+    results.append(result)
+    print(f"{size:>8} {case:<28} median {result['median_ms']:10.3f} ms   min {result['min_ms']:10.3f} ms", file=sys.stderr)
+
+## benchmark the load, filter, lookup and chart-data paths on one generated data set
+def run_benchmarks(results, size, workdir, args):
+    rng = np.random.default_rng(args.seed)
+    size_dir = os.path.join(workdir, str(size))
+    os.makedirs(size_dir, exist_ok=True)
+    widef = os.path.join(size_dir, "wide.tsv")
+    tallf = os.path.join(size_dir, "tall.tsv.gz")
+    ids = generate_wide(widef, size, rng)
+    generate_tall(tallf, ids, args.years, args.density, rng)
+
+    ## point the loader at the synthetic files and a private snapshot directory
+    orig = (cgs.widef, cgs.tallf, cgs.snapshot_dir)
+    cgs.widef, cgs.tallf, cgs.snapshot_dir = widef, tallf, os.path.join(size_dir, "snapshot")
+    try:
+        frames = {}
+        time_case(results, size, 'load.parse_data', lambda i: frames.update(parsed=cgs.parse_data()), 1)
+        fingerprint = cgs.get_source_fingerprint()
+        time_case(results, size, 'load.write_snapshot', lambda i: cgs.write_snapshot(frames['parsed'], fingerprint), 1)
+        time_case(results, size, 'load.read_snapshot', lambda i: frames.update(loaded=cgs.load_prepared_data()), args.repeat_slow)
+    finally:
+        cgs.widef, cgs.tallf, cgs.snapshot_dir = orig
+    df_wide, df_tall = frames['loaded']
+
+    ## derived structures
+    derived = {}
+    range_columns = tuple(cgs.slider_dict[key][0] for key in cgs.slider_dict)
+    cat_columns = ('region', 'type', 'barrons', 'state')
+    time_case(results, size, 'build.tall_index', lambda i: derived.update(tall_index=cgs.build_tall_index(df_tall)), 1)
+    time_case(results, size, 'build.filter_engine', lambda i: derived.update(engine=cgs.FilterEngine(df_wide, cat_columns, range_columns)), 1)
+    time_case(results, size, 'build.search_index', lambda i: derived.update(search=cgs.SearchIndex(df_wide)), 1)
+    time_case(results, size, 'build.metric_cube', lambda i: derived.update(cube=cgs.MetricCube(df_wide, df_tall)), 1)
+    time_case(results, size, 'build.similarity_index', lambda i: derived.update(similar=cgs.SimilarityIndex(df_wide)), 1)
+    time_case(results, size, 'build.map_data', lambda i: derived.update(map_data=cgs.build_map_data(df_wide)), 1)
+
+    ## update_filter(): recompute a single slider mask, or all widget masks, then AND them and select the rows
+    engine = derived['engine']
+    uniq_vals = {x: sorted(df_wide[x].dropna().unique()) for x in cat_columns}
+    def get_slider_mask(key, i):
+        colname, minval, maxval = cgs.slider_dict[key]
+        lo = minval + (maxval - minval) * (i % 10) / 40
+        hi = maxval - (maxval - minval) * (i % 7) / 40
+        if minval == 0 and maxval == 100:
+            lo, hi = lo/100, hi/100
+        return engine.get_range_mask(colname, lo, hi)
+    masks = {x: engine.get_value_mask(x, uniq_vals[x][:max(1, len(uniq_vals[x]) - 1)]) for x in cat_columns}
+    masks.update({key: get_slider_mask(key, 0) for key in cgs.slider_dict})
+    slider_keys = list(cgs.slider_dict)
+    def filter_one_widget(i):
+        masks[slider_keys[i % len(slider_keys)]] = get_slider_mask(slider_keys[i % len(slider_keys)], i)
+        return df_wide[engine.combine_masks(masks.values())]
+    def filter_all_widgets(i):
+        for x in cat_columns:
+            masks[x] = engine.get_value_mask(x, uniq_vals[x][:max(1, len(uniq_vals[x]) - 1 - i % 2)])
+        for key in slider_keys:
+            masks[key] = get_slider_mask(key, i)
+        return df_wide[engine.combine_masks(masks.values())]
+    time_case(results, size, 'filter.one_widget', filter_one_widget, args.repeat)
+    time_case(results, size, 'filter.all_widgets', filter_all_widgets, args.repeat)
+
+    ## update_college() / update_multi_college(): tall lookups for random colleges
+    tall_index = derived['tall_index']
+    sample_ids = rng.choice(df_wide['id'].to_numpy(), size=(args.repeat, 5))
+    time_case(results, size, 'lookup.college', lambda i: cgs.get_tall_rows(df_tall, tall_index, sample_ids[i, 0]), args.repeat)
+    time_case(results, size, 'lookup.multi_college', lambda i: cgs.get_tall_rows(df_tall, tall_index, sample_ids[i].tolist()), args.repeat)
+
+    ## chart-data preparation of the View and Compare pages (from the metric cube, with and without
+    ## the peer-group medians, whose first use computes the medians of every group), and the map frame of the Filter page
+    cube = derived['cube']
+    sample_positions = rng.integers(0, len(df_wide), size=(args.repeat, 5))
+    def prepare_view_charts(i, peer_group=None):
+        return [cgs.get_view_chart_frame(cube, sample_positions[i, 0], colnames, peer_group) for colnames in cgs.view_chart_groups.values()]
+    def prepare_compare_chart(i, peer_group=None):
+        positions = sample_positions[i]
+        return cgs.get_compare_chart_frame(cube, positions, 'SAT_AVG', [derived['search'].get_label(x) for x in positions], peer_group)
+    positions = np.flatnonzero(engine.combine_masks(masks.values()))
+    time_case(results, size, 'chart.view', prepare_view_charts, args.repeat)
+    time_case(results, size, 'chart.compare', prepare_compare_chart, args.repeat)
+    time_case(results, size, 'build.peer_medians', lambda i: cube.get_group_medians('tier_name'), 1)
+    time_case(results, size, 'chart.view_peer', lambda i: prepare_view_charts(i, 'tier_name'), args.repeat)
+    time_case(results, size, 'chart.compare_peer', lambda i: prepare_compare_chart(i, 'tier_name'), args.repeat)
+    ## repeat views of a college, served from the view cache
+    view_cache = cgs.ResultCache(max_entries=None, max_bytes=cgs.view_cache_bytes)
+    time_case(results, size, 'chart.view_cached', lambda i: view_cache.get(('charts', sample_positions[0, 0], 'tier_name'),
+                                                                        lambda: prepare_view_charts(0, 'tier_name')), args.repeat)
+    time_case(results, size, 'chart.map_frame', lambda i: cgs.get_map_frame(positions, 'public', derived['map_data']), args.repeat)
+    map_index = cgs.MapIndex(df_wide)
+    map_view = map_index.get_view()
+    time_case(results, size, 'chart.map_layer', lambda i: map_index.get_layer_frame(positions, 'public', map_view, derived['map_data']), args.repeat)
+
+    ## group statistics of the Filter page: presorting the groups, then the quantiles of a selection by region and by state
+    group_stats = cgs.GroupStats(df_wide)
+    selection = engine.combine_masks(masks.values())
+    time_case(results, size, 'build.group_stats', lambda i: [group_stats.get_sorted_groups(x, y) for x in ('region', 'state') for y in cgs.group_stats_metrics], 1)
+    time_case(results, size, 'stats.region', lambda i: group_stats.get_stats(selection, 'region', cgs.group_stats_metrics), args.repeat)
+    time_case(results, size, 'stats.state', lambda i: group_stats.get_stats(selection, 'state', cgs.group_stats_metrics), args.repeat)
+
+    ## headless queries: many declarative filter specs, one at a time or in one batch
+    query_engine = cgs.QueryEngine(df_wide, df_tall, tall_index)
+    regions = list(df_wide['region'].cat.categories)
+    def get_spec(j):
+        spec = {'region': regions[:1 + j % len(regions)]}
+        for key in slider_keys[:1 + j % 3]:
+            colname, minval, maxval = cgs.slider_dict[key]
+            scale = 100 if minval == 0 and maxval == 100 else 1
+            spec[colname] = [(minval + (maxval - minval) * (j % 10) / 40) / scale, None]
+        return spec
+    specs = [get_spec(j) for j in range(args.num_specs)]
+    time_case(results, size, f'query.loop_{args.num_specs}', lambda i: [query_engine.query(spec) for spec in specs], args.repeat_slow)
+    time_case(results, size, f'query.batch_{args.num_specs}', lambda i: query_engine.query_batch(specs), args.repeat_slow)
+
+    ## "similar colleges" of the View page, with the default and with random weights
+    weights = rng.random((args.repeat, len(derived['similar'].features))) * 3
+    time_case(results, size, 'similar.query', lambda i: derived['similar'].get_similar(sample_positions[i, 0]), args.repeat)
+    time_case(results, size, 'similar.query_weighted', lambda i: derived['similar'].get_similar(sample_positions[i, 0], weights[i]), args.repeat)
+
+    ## type-ahead search
+    queries = ["mit", "univ of cal", "boston", "texas a&m", "comunity colege", "st johns"]
+    time_case(results, size, 'search.query', lambda i: derived['search'].search(queries[i % len(queries)]), args.repeat)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Benchmarks for the {cgs.app_name}")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[2000, 20000], help='numbers of institutions to generate')
+    parser.add_argument('--years', type=int, default=27, help='number of years in the tall-formatted data')
+    parser.add_argument('--density', type=float, default=0.6, help='fraction of (institution, metric, year) present in the tall data')
+    parser.add_argument('--repeat', type=int, default=50, help='number of repetitions of the fast cases')
+    parser.add_argument('--repeat-slow', type=int, default=3, help='number of repetitions of the slow cases')
+    parser.add_argument('--num-specs', type=int, default=1000, help='number of filter specs of the query cases')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the data generator')
+    parser.add_argument('--workdir', default=None, help='directory for the generated data (default: a temporary directory)')
+    parser.add_argument('--output', default=None, help='JSON file to write the results to (default: stdout)')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="college_guide_bench_")
+    results = []
+    try:
+        for size in args.sizes:
+            run_benchmarks(results, size, workdir, args)
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'years': args.years,
+            'density': args.density,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    else:
+        with open(args.output, 'w') as fh:
+            json.dump(report, fh, indent=2)
@@ -0,0 +1,83 @@
+import argparse
+import college_guide_shared as cgs
+
+## This script contains the build steps of the college_guide app
+## Usage: python college_guide_build.py snapshot [--force] [--store DIR] [--budget MB] [--warn-only]
+##        python college_guide_build.py memory [--top N] [--budget MB] [--warn-only]
+##        python college_guide_build.py catalog [--force]
+##        python college_guide_build.py refresh [--wide DELTA_WIDE.tsv] [--tall DELTA_TALL.tsv.gz] [--store DIR]
+
+## parse the source files once and store the processed frames as a binary snapshot
+def build_snapshot(args):
+    if args.store is not None:
+        cgs.snapshot_dir = args.store
+    fingerprint = cgs.get_source_fingerprint()
+    df_wide, df_tall = cgs.load_prepared_data(rebuild=args.force)
+    print(f"Snapshot {cgs.snapshot_dir}/{fingerprint}: df_wide {df_wide.shape}, df_tall {df_tall.shape}")
+    print(f"Load stages ({cgs.load_workers} threads): " + ", ".join(f"{x} {t:.2f}s" for x, t in cgs.load_timings.items()))
+    check_budget(cgs.get_memory_report({'df_wide': df_wide, 'df_tall': df_tall}), args)
+
+## fail the build step if the loaded frames exceed the memory budget (unless --warn-only)
+def check_budget(report, args):
+    try:
+        return cgs.check_memory_budget(report, args.budget, args.warn_only or None)
+    except MemoryError as e:
+        raise SystemExit(f"ERROR: {e}")
+
+## merge the delta files of a new release into the published data, and publish a new data version
+def refresh(args):
+    if args.wide is None and args.tall is None:
+        raise SystemExit("refresh: at least one of --wide and --tall is required")
+    if args.store is not None:
+        cgs.snapshot_dir = args.store
+    info = cgs.refresh_data(args.wide, args.tall)
+    print(f"Published data version {info['version']} (previous {info['previous']}): "
+          f"{info['wide_updated']} colleges updated, {info['wide_added']} added, {info['tall_added']} tall rows added")
+
+## print the memory used by each frame and its largest columns
+def report_memory(args):
+    df_wide, df_tall = cgs.load_prepared_data()
+    report = cgs.get_memory_report({'df_wide': df_wide, 'df_tall': df_tall})
+    for name in report:
+        print(f"{name}: {report[name]['total'] / 1e6:.2f} MB")
+        columns = sorted(report[name]['columns'].items(), key=lambda x: x[1], reverse=True)
+        for colname, nbytes in columns[:args.top]:
+            print(f"    {colname}: {nbytes / 1e6:.3f} MB")
+    print(f"total: {sum(x['total'] for x in report.values()) / 1e6:.2f} MB")
+    check_budget(report, args)
+
+## compile the data dictionary (data.yaml) into the field catalog
+def build_catalog(args):
+    catalog = cgs.FieldCatalog(cgs.load_catalog_data(rebuild=args.force))
+    num_numeric = sum(1 for x in catalog.fields if catalog.is_numeric(x))
+    print(f"Field catalog {cgs.catalog_file} (dictionary version {catalog.version}): {len(catalog.fields)} fields, {num_numeric} numeric, {len(catalog.by_source)} sources")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Build steps for the {cgs.app_name}")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    parser_snapshot = subparsers.add_parser('snapshot', help='build the binary snapshot of the processed data')
+    parser_snapshot.add_argument('--force', action='store_true', help='rebuild even if the snapshot is up to date')
+    parser_snapshot.add_argument('--store', default=None, help='directory to publish the snapshot to (default: $COLLEGE_GUIDE_DATA_STORE or .snapshot)')
+    parser_snapshot.add_argument('--budget', type=float, default=None, help='memory budget in MB to check against (default: $COLLEGE_GUIDE_MEMORY_BUDGET_MB)')
+    parser_snapshot.add_argument('--warn-only', action='store_true', help='only warn when the data exceeds the memory budget')
+    parser_snapshot.set_defaults(func=build_snapshot)
+
+    parser_memory = subparsers.add_parser('memory', help='report the memory used by the loaded frames')
+    parser_memory.add_argument('--top', type=int, default=10, help='number of largest columns to show per frame')
+    parser_memory.add_argument('--budget', type=float, default=None, help='memory budget in MB to check against (default: $COLLEGE_GUIDE_MEMORY_BUDGET_MB)')
+    parser_memory.add_argument('--warn-only', action='store_true', help='only warn when the data exceeds the memory budget')
+    parser_memory.set_defaults(func=report_memory)
+
+    parser_refresh = subparsers.add_parser('refresh', help='merge the delta files of a new release into the published data')
+    parser_refresh.add_argument('--wide', default=None, help='wide-formatted TSV file with the new or changed colleges')
+    parser_refresh.add_argument('--tall', default=None, help='tall-formatted TSV file (optionally gzipped) with the new rows')
+    parser_refresh.add_argument('--store', default=None, help='directory the data is published to (default: $COLLEGE_GUIDE_DATA_STORE or .snapshot)')
+    parser_refresh.set_defaults(func=refresh)
+
+    parser_catalog = subparsers.add_parser('catalog', help='compile the data dictionary into the field catalog')
+    parser_catalog.add_argument('--force', action='store_true', help='recompile even if the catalog is up to date')
+    parser_catalog.set_defaults(func=build_catalog)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,20 @@
+import argparse
+import sys
+import college_guide_shared as cgs
+
+## This script starts the college_guide app with the data warm-up running as soon as the server process starts
+## Usage: python college_guide_serve.py [--ready-port PORT] [streamlit run options, e.g. --server.port 8501]
+##   GET http://localhost:PORT/ready answers 200 once the data and the indexes are loaded (503 before),
+##   e.g. for the readiness probe of a container
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=f"Serve the {cgs.app_name}")
+    parser.add_argument('--ready-port', type=int, default=None, help='port of the readiness endpoint (default: $COLLEGE_GUIDE_READY_PORT, 0 to disable)')
+    args, streamlit_args = parser.parse_known_args()
+
+    ## the warm-up thread fills the same process-wide caches that the pages use
+    cgs.start_warmup(args.ready_port)
+
+    from streamlit.web import cli as stcli
+    sys.argv = ['streamlit', 'run', 'college_guide.py'] + streamlit_args
+    sys.exit(stcli.main())
@@ -1,8 +1,11 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import yaml
-import os, sys, math
+import os, sys, shutil, time
+import hashlib, json, pickle, re
+import threading, concurrent.futures
+import bisect, collections, functools, importlib, logging, warnings
+import html, string
 
 ## This code contains shared functions and variables in the college_guide app
 ## Usage: import college_guide_shared as cgs
@@ -36,6 +39,8 @@ color_maps = {
         'West':[255, 255, 100, 140],
     },
 }
+## color of the values missing from the color maps
+color_missing = [160, 160, 160, 140]
 color_map_desc = {
     'barrons': "Color by Barron's Selectivity Index",
     'iclevel': "Color by Degree Type",
@@ -146,43 +151,1710 @@ cats = {
 oths = {
     'id': 'Institution ID',
     'name': 'Name of the school',
+    'school__name': 'Name of the school in College Scorecard',
     'school__city': 'City of the school',
     'school__state': 'State of the school',
     'lon': 'Longitude',
     'lat': 'Latitude',
 }
 
-# Load all data together
-@st.cache_data
-def load_data():
-    widef = "College_Scorecard_Mobility_Latest_NonEmpty.20230524.tsv"
-    tallf = "MERGED_1996_2022_ALL_NONEMPTY_TALL.SELECTED_SATCM.tsv.gz"
+## name, min, max values for each metric for the sliders of the Filter page (keys are the widget keys)
+slider_dict = {
+    'a0_slider_sat_avg': ['admissions__sat_scores__average__overall', 400, 1600],
+    'a1_slider_act_mid': ['admissions__act_scores__midpoint__cumulative', 1, 36],
+    'a2_slider_admit_rate': ['admissions__admission_rate__overall', 0, 100],
+    'b0_slider_white': ['student__demographics__race_ethnicity__white', 0, 100],
+    'b1_slider_black': ['student__demographics__race_ethnicity__black', 0, 100],
+    'b2_slider_hispanic': ['student__demographics__race_ethnicity__hispanic', 0, 100],
+    'b3_slider_asian': ['student__demographics__race_ethnicity__asian', 0, 100],
+    'b4_slider_nra': ['student__demographics__race_ethnicity__non_resident_alien', 0, 100],
+
+    'c0_slider_tuition_in_state' : ['cost__tuition__in_state', 0, 100000],
+    'c1_slider_tuition_out_of_state' : ['cost__tuition__out_of_state', 0, 100000],
+    'c2_slider_pell_grant_state' : ['aid__pell_grant_rate', 0, 100],
+    'd0_slider_earning_10yrs' : ['earnings__10_yrs_after_entry__median', 0, 200000],
+    'd1_slider_par_median' : ['par_median', 0, 200000],
+    'e0_slider_female' : ['female', 0, 100],
+    'e1_slider_k_married' : ['k_married', 0, 100],
+    'e2_student_size' : ['student__size', 0, 20000],
+}
+## columns of the checkbox groups / multiselect and of the sliders of the Filter page
+filter_cat_columns = ('region', 'type', 'barrons', 'state')
+filter_range_columns = tuple(slider_dict[key][0] for key in slider_dict)
+## columns whose values are offered by the widgets of the Filter page
+filter_option_columns = ['tier_name', 'barrons', 'type', 'state', 'region']
+
+## sorted values of each option column (missing values, e.g. of colleges added by a partial refresh, are not options)
+def get_filter_options(df_wide):
+    return {key: sorted(df_wide[key].dropna().unique()) for key in filter_option_columns}
+
+## metrics shown in each chart of the View page
+view_chart_groups = {
+    "SAT Scores": ['SATCM25','SATCM75','SATCMMID'],
+    "ACT Scores": ['ACTCM25','ACTCM75','ACTCMMID'],
+    "Tuition and Fees": ['TUITIONFEE_IN','TUITIONFEE_OUT','TUITFTE'],
+    "Degree Distribution": ['PCIP01','PCIP04','PCIP11','PCIP13','PCIP14','PCIP26','PCIP27','PCIP45','PCIP50','PCIP51','PCIP52'],
+    "Demographic Distribution": ['UGDS_WHITE','UGDS_BLACK','UGDS_HISP','UGDS_ASIAN','UGDS_AIAN','UGDS_NHPI','UGDS_2MOR','UGDS_NRA','UGDS_UNKN'],
+    "Median Income": ['MD_EARN_WNE_P10','MD_EARN_WNE_P8','MD_EARN_WNE_P6'],
+}
+
+## compact dtypes of the wide-formatted data (columns not listed keep the pandas defaults)
+wide_dtypes = {'id': 'int32', 'lon': 'float32', 'lat': 'float32', 'school__state': 'category'}
+wide_dtypes.update({x: 'category' for x in cats})
+wide_dtypes.update({x: 'float32' for x in qts})
+## compact dtypes of the tall-formatted data
+tall_dtypes = {'INSTID': 'int32', 'COLUMN': 'category', 'YEAR': 'int16', 'VALUE': 'float32'}
+
+## per-process memory budget (in MB) for the loaded frames; 0 disables the check
+## (loading fails when the frames exceed it, unless COLLEGE_GUIDE_MEMORY_BUDGET_WARN_ONLY=1, which only warns)
+memory_budget_mb = float(os.environ.get("COLLEGE_GUIDE_MEMORY_BUDGET_MB", 0))
+memory_budget_warn_only = os.environ.get("COLLEGE_GUIDE_MEMORY_BUDGET_WARN_ONLY", "0") == "1"
+
+## tooltip fields (and their titles) of the scatter chart of the Filter page
+filter_chart_tooltips = {
+    'name': 'College Name',
+    'admissions__sat_scores__average__overall': 'Average SAT',
+    'tier_name': 'College Tier',
+    'admissions__admission_rate__overall': 'Acceptance Rate',
+    'school__tuition_revenue_per_fte': 'Tuition Revenue per Student',
+    'earnings__10_yrs_after_entry__median': 'Median Earnings 10 years after Entry',
+}
+## above this number of colleges, the background layer of the Filter chart shows 2D bins instead of points
+chart_density_threshold = int(os.environ.get("COLLEGE_GUIDE_CHART_DENSITY_THRESHOLD", 5000))
+chart_density_bins = 50 ## number of bins along each axis
+
+## source files for the wide- and tall-formatted data
+widef = "College_Scorecard_Mobility_Latest_NonEmpty.20230524.tsv"
+tallf = "MERGED_1996_2022_ALL_NONEMPTY_TALL.SELECTED_SATCM.tsv.gz"
+## College Scorecard data dictionary, and the compiled field catalog (rebuilt whenever the dictionary changes)
+dictf = "data.yaml"
+catalog_file = ".field_catalog.pickle"
+## types of the data dictionary that are loaded as numeric fields
+catalog_numeric_types = ('float', 'integer', 'long')
+## numeric fields that hold identifiers or codes of categories rather than measures, which are not loaded as numeric fields
+## (so not offered as range criteria): ids and FIPS codes, classifications, flags, and fields whose description lists codes
+catalog_code_name_re = re.compile(r"(^|\.)(id|unit_id|region_id|state_fips|ownership|locale|degree_urbanization|carnegie_\w+|religious_affiliation|test_requirements)$")
+catalog_code_line_re = re.compile(r"^\s*-?\d+\s+\S", re.MULTILINE)
+## bump this whenever compile_field_catalog() changes, so that older catalogs are compiled again
+catalog_version = 2
 
+## metrics and years kept from the tall-formatted data (None keeps all years)
+tall_metrics = list(lts.keys())
+tall_years = None
+## first year kept for the metrics starting with each prefix
+tall_year_rules = {'UGDS_': 2011}
+## number of rows parsed at a time from the tall-formatted data
+tall_chunksize = 500000
+
+## binary snapshots of the processed data are stored under snapshot_dir/<fingerprint>/
+## in data-store mode, COLLEGE_GUIDE_DATA_STORE points to a shared directory (e.g. /dev/shm/college_guide),
+## so that all server processes on the host memory-map the same read-only column buffers
+snapshot_dir = os.environ.get("COLLEGE_GUIDE_DATA_STORE", ".snapshot")
+## bump this whenever parse_data() or the snapshot format changes, so that older snapshots are not reused
+snapshot_version = 9
+snapshot_frames = ['df_wide', 'df_tall']
+
+## hash the contents of the source files (and the snapshot version and tall selection) into a short key
+## (memoized on the size and modification time of the files, as the app checks it periodically)
+source_fingerprints = {}
+def get_source_fingerprint(files = None):
+    if files is None:
+        files = (widef, tallf, dictf)
+    key = tuple((f, os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in files)
+    if key not in source_fingerprints:
+        source_fingerprints[key] = hash_source_files(files)
+    return source_fingerprints[key]
+
+def hash_source_files(files):
+    h = hashlib.sha256(f"snapshot_v{snapshot_version}".encode())
+    h.update(repr((tall_metrics, tall_years, tall_year_rules)).encode())
+    for f in files:
+        h.update(os.path.basename(f).encode())
+        with open(f, 'rb') as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b''):
+                h.update(chunk)
+    return h.hexdigest()[:16]
+
+## number of threads of the load pipelines (the stages mostly run in pandas, numpy and zlib code that releases the GIL,
+## and the threads share the frames they build, where a process pool would have to copy them back)
+load_workers = int(os.environ.get("COLLEGE_GUIDE_LOAD_WORKERS", "0")) or min(8, os.cpu_count() or 1)
+## timings (in seconds) of the stages of the last load in this process
+load_timings = {}
+
+## run a pipeline of stages on a thread pool: each stage is (name, func, deps), and func is called with the results
+## of its deps as soon as they are done, so independent stages run concurrently; on_stage(name, seconds) is called
+## as each stage finishes; returns the results and the timings (in seconds) of the stages
+def run_pipeline(stages, max_workers=None, on_stage=None):
+    funcs = {name: func for name, func, deps in stages}
+    deps = {name: list(stage_deps) for name, func, stage_deps in stages}
+    results, timings = {}, {}
+    def run_stage(name):
+        start = time.perf_counter()
+        result = funcs[name](*[results[x] for x in deps[name]])
+        return result, time.perf_counter() - start
+    with concurrent.futures.ThreadPoolExecutor(max_workers or load_workers, thread_name_prefix="college_guide_load") as executor:
+        waiting, pending = list(funcs), {}
+        try:
+            while waiting or pending:
+                for name in [x for x in waiting if all(y in results for y in deps[x])]:
+                    waiting.remove(name)
+                    pending[executor.submit(run_stage, name)] = name
+                if not pending:
+                    raise ValueError(f"stages with unknown or circular dependencies: {waiting}")
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    results[name], timings[name] = future.result()
+                    if on_stage is not None:
+                        on_stage(name, timings[name])
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    return results, timings
+
+## parse the source TSV files and process them into df_wide, df_tall
+## (the wide and tall files are parsed concurrently)
+def parse_data():
+    ## remove specific colleges that have misleading data
+    # ids_to_remove = [183026] ## currently only Southeran New Hampshire University
+    # df_wide = df_wide[~df_wide['id'].isin(ids_to_remove)]
+    # df_tall = df_tall[~df_tall['INSTID'].isin(ids_to_remove)]
+    stages = [
+        ('parse_wide', lambda: parse_wide_data(widef), []),
+        ## load tall-formatted data
+        ('parse_tall', lambda: read_tall_data(tallf, tall_metrics, tall_years, tall_year_rules), []),
+        ## sort by (INSTID, COLUMN, YEAR) so that each institution (and metric) is a contiguous block
+        ('sort_tall', lambda df_tall: df_tall.sort_values(['INSTID', 'COLUMN', 'YEAR'], kind='stable').reset_index(drop=True),
+         ['parse_tall']),
+    ]
+    results, timings = run_pipeline(stages)
+    load_timings.update(timings)
+    return results['parse_wide'], results['sort_tall']
+
+## parse a wide-formatted TSV file (the full file, or the rows of a yearly delta) into the columns of df_wide
+## (with partial=True, e.g. for a delta, the columns missing from the file are skipped, but id is required)
+def parse_wide_data(fname, partial=False):
+    catalog = FieldCatalog(load_catalog_data())
     ## load wide-formatted data
-    df_wide = pd.read_csv(widef, sep="\t")
+    df_wide = pd.read_csv(fname, sep="\t", na_values=catalog.null_values)
     ## rename columns in the wide-formatted data
     df_wide = df_wide.rename({"location.lat": "lat", "location.lon": "lon"}, axis=1)
     ## rename columns to avoid problems with altair
     df_wide.columns = [x.replace(".", "__") for x in df_wide.columns]
     ## subset columns of interest
     colnames = list(oths.keys()) + list(cats.keys()) + list(qts.keys())
+    if partial:
+        if 'id' not in df_wide.columns:
+            raise ValueError(f"{fname}: the wide-formatted file has no id column")
+        colnames = [x for x in colnames if x in df_wide.columns]
+    ## and all the other numeric fields of the data dictionary
+    catalog_colnames = [x for x in df_wide.columns if x not in colnames and catalog.is_numeric(x)]
+    df_wide[catalog_colnames] = df_wide[catalog_colnames].apply(pd.to_numeric, errors='coerce')
 
-    df_wide = df_wide[colnames]
-    ## remove specific colleges that have misleading data
-    # ids_to_remove = [183026] ## currently only Southeran New Hampshire University
-    # df_wide = df_wide[~df_wide['id'].isin(ids_to_remove)]
+    dtypes = dict(wide_dtypes, **{x: 'float32' for x in catalog_colnames})
+    return df_wide[colnames + catalog_colnames].astype({x: dtypes[x] for x in colnames + catalog_colnames if x in dtypes})
+
+## stream the tall-formatted data in chunks, keeping only the given metrics and years
+## (other metrics are parsed as missing categories and dropped chunk by chunk, so they are never materialized)
+def read_tall_data(fname, metrics, years=None, year_rules=None, chunksize=None):
+    metrics = sorted(set(metrics))
+    dtypes = dict(tall_dtypes, COLUMN=pd.CategoricalDtype(metrics))
+    ## first year kept for each metric, indexed by category code
+    first_years = np.array([max([year for prefix, year in (year_rules or {}).items() if x.startswith(prefix)], default=-1)
+                            for x in metrics])
+    chunks = []
+    with pd.read_csv(fname, sep="\t", usecols=list(dtypes), dtype=dtypes,
+                     chunksize=chunksize or tall_chunksize) as reader:
+        for chunk in reader:
+            codes = chunk['COLUMN'].cat.codes.to_numpy()
+            year = chunk['YEAR'].to_numpy()
+            keep = (codes >= 0) & (year >= first_years[codes])
+            if years is not None:
+                keep &= np.isin(year, list(years))
+            chunks.append(chunk[keep])
+    return pd.concat(chunks, ignore_index=True)
+
+## write each frame as one .npy file per column (codes for categoricals) plus a manifest.json
+## (object columns such as names are small and are stored in the manifest itself)
+def write_column_store(frames, path):
+    manifest = {}
+    for name, df in frames.items():
+        os.makedirs(os.path.join(path, name), exist_ok=True)
+        columns = []
+        for i, colname in enumerate(df.columns):
+            col = df[colname]
+            fname = os.path.join(path, name, f"{i}.npy")
+            if isinstance(col.dtype, pd.CategoricalDtype):
+                np.save(fname, col.cat.codes.to_numpy())
+                columns.append({'name': colname, 'kind': 'category', 'categories': col.cat.categories.tolist()})
+            elif col.dtype == object:
+                columns.append({'name': colname, 'kind': 'object', 'values': [None if pd.isna(x) else x for x in col]})
+            else:
+                np.save(fname, col.to_numpy())
+                columns.append({'name': colname, 'kind': 'array'})
+        manifest[name] = {'num_rows': len(df), 'columns': columns}
+    with open(os.path.join(path, "manifest.json"), 'w') as fh:
+        json.dump(manifest, fh)
+
+## attach the frames of a column store; the column buffers are read-only memory maps,
+## so the pages of the files are shared by every process that attaches to the same store
+def read_column_store(path):
+    with open(os.path.join(path, "manifest.json")) as fh:
+        manifest = json.load(fh)
+    frames = {}
+    for name in manifest:
+        data = {}
+        for i, col in enumerate(manifest[name]['columns']):
+            fname = os.path.join(path, name, f"{i}.npy")
+            if col['kind'] == 'category':
+                data[col['name']] = pd.Categorical.from_codes(np.asarray(np.load(fname, mmap_mode='r')), categories=col['categories'])
+            elif col['kind'] == 'object':
+                data[col['name']] = np.array([np.nan if x is None else x for x in col['values']], dtype=object)
+            else:
+                data[col['name']] = np.asarray(np.load(fname, mmap_mode='r'))
+        frames[name] = pd.DataFrame(data, copy=False)
+    return frames
+
+## read the snapshot matching the fingerprint (memory-mapped), or None if unavailable
+def read_snapshot(fingerprint):
+    path = os.path.join(snapshot_dir, fingerprint)
+    if not os.path.isdir(path):
+        return None
+    try:
+        frames = read_column_store(path)
+        return tuple(frames[name] for name in snapshot_frames)
+    except Exception as e:
+        print(f"WARNING: ignoring unreadable snapshot {path}: {e}", file=sys.stderr)
+        return None
+
+## names of the snapshots (16 hex digits of a fingerprint); only those are ever removed from snapshot_dir,
+## which may be a shared directory such as /dev/shm
+snapshot_name_re = re.compile(r"[0-9a-f]{16}")
+
+## write the frames as a column store snapshot and drop stale snapshots, except those in keep
+## (processes still attached to a dropped snapshot keep their mappings until they exit)
+def write_snapshot(frames, fingerprint, keep=()):
+    path = os.path.join(snapshot_dir, fingerprint)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    try:
+        write_column_store(dict(zip(snapshot_frames, frames)), tmp_path)
+        write_metric_cube(MetricCube(*frames), tmp_path)
+        ## another process may have published the same snapshot in the meantime
+        if os.path.isdir(path):
+            shutil.rmtree(tmp_path)
+        else:
+            os.rename(tmp_path, path)
+        for entry in os.listdir(snapshot_dir):
+            if entry != fingerprint and entry not in keep and snapshot_name_re.fullmatch(entry):
+                shutil.rmtree(os.path.join(snapshot_dir, entry), ignore_errors=True)
+    except OSError as e:
+        ## the snapshot is only an optimization (e.g. the directory may be read-only)
+        print(f"WARNING: could not write snapshot {path}: {e}", file=sys.stderr)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+## the data version is the fingerprint of the snapshot being served: the snapshot of the source files,
+## or the latest incremental refresh on top of it, published in snapshot_dir/current.json (see refresh_data())
+data_version_file = "current.json"
+data_version_ttl = 10 ## seconds between two checks of the published version by the app
+## number of recently published versions whose snapshots a refresh keeps (with the snapshot of the source files),
+## since the processes that have not checked the published version yet still serve them
+data_version_keep = int(os.environ.get("COLLEGE_GUIDE_KEEP_VERSIONS", "3"))
+
+## the published versions built on top of the given source fingerprint, oldest first (the last one is served)
+def read_published_versions(base):
+    try:
+        with open(os.path.join(snapshot_dir, data_version_file)) as fh:
+            current = json.load(fh)
+        if current['base'] == base:
+            return list(current.get('history', [current['version']]))
+    except (OSError, ValueError, KeyError):
+        pass
+    return []
+
+## the published data version, if it was built on top of the current source files (else the source fingerprint)
+def read_data_version():
+    base = get_source_fingerprint()
+    published = read_published_versions(base)
+    if published and os.path.isdir(os.path.join(snapshot_dir, published[-1])):
+        return published[-1]
+    return base
+
+## atomically point the app to a data version (the recently published versions are kept in its history)
+def publish_data_version(version, base):
+    history = [x for x in read_published_versions(base) if x != version] + [version]
+    path = os.path.join(snapshot_dir, data_version_file)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w') as fh:
+        json.dump({'version': version, 'base': base, 'published': time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                   'history': history[-data_version_keep:]}, fh)
+    os.replace(tmp_path, path)
+
+## load the processed frames from the snapshot of the given (by default the published) data version,
+## parsing the TSV files only when the sources changed
+def load_prepared_data(rebuild=False, version=None):
+    fingerprint = get_source_fingerprint()
+    if version is None:
+        version = fingerprint if rebuild else read_data_version()
+    load_timings.clear()
+    start = time.perf_counter()
+    frames = None if rebuild else read_snapshot(version)
+    if frames is None and version != fingerprint:
+        print(f"WARNING: data version {version} is unavailable, loading the source files instead", file=sys.stderr)
+        frames = read_snapshot(fingerprint)
+    if frames is None:
+        frames = parse_data()
+        start = time.perf_counter()
+        write_snapshot(frames, fingerprint)
+        ## attach to the written snapshot, so that the parsed copy can be freed
+        frames = read_snapshot(fingerprint) or frames
+        load_timings['write_snapshot'] = time.perf_counter() - start
+    else:
+        load_timings['read_snapshot'] = time.perf_counter() - start
+    return frames
+
+## the published data version, checked at most every data_version_ttl seconds;
+## the pages read it once per run and pass it to the loaders below, so that a run never mixes two versions
+@st.cache_data(ttl=data_version_ttl, show_spinner=False)
+def get_data_version():
+    return read_data_version()
+
+# Load all data together
+## the frames are read-only and shared by all sessions (st.cache_resource does not copy them per call);
+## the loaders are keyed by the data version, so a newly published version is loaded next to the current one
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_data(version):
+    df_wide, df_tall = load_prepared_data(version=version)
+
+    check_memory_budget(get_memory_report({'df_wide': df_wide, 'df_tall': df_tall}))
+    return df_wide, df_tall
+
+## merge a yearly delta into the prepared frames: the rows of delta_wide replace the rows of df_wide with the
+## same id (columns missing from the delta keep their values, and are missing for the new colleges) and new
+## colleges are appended, so the positions of the existing colleges do not change; the rows of delta_tall are
+## added to df_tall, replacing the same (INSTID, COLUMN, YEAR), and the result is sorted like parse_data() does
+def merge_data(df_wide, df_tall, delta_wide=None, delta_tall=None):
+    if delta_wide is not None and len(delta_wide) > 0:
+        delta_wide = delta_wide.drop_duplicates('id', keep='last')
+        dtypes = df_wide.dtypes.to_dict()
+        ids = df_wide['id'].to_numpy()
+        order = np.argsort(ids, kind='stable')
+        found = np.minimum(np.searchsorted(ids[order], delta_wide['id'].to_numpy()), len(ids) - 1)
+        is_update = ids[order][found] == delta_wide['id'].to_numpy()
+        ## target row of each delta row: the row of the same id, or a new row at the end
+        positions = np.where(is_update, order[found], len(ids) + np.cumsum(~is_update) - 1)
+        ## categoricals are merged as plain values, and get the union of their categories back from astype()
+        df_wide = df_wide.astype({x: object for x in df_wide.columns if isinstance(dtypes[x], pd.CategoricalDtype)})
+        df_wide = df_wide.reindex(np.arange(len(ids) + int((~is_update).sum())))
+        for colname in [x for x in delta_wide.columns if x in df_wide.columns]:
+            values = df_wide[colname].to_numpy(copy=True)
+            values[positions] = delta_wide[colname].to_numpy()
+            df_wide[colname] = values
+        df_wide = df_wide.astype({x: 'category' if isinstance(dtypes[x], pd.CategoricalDtype) else dtypes[x] for x in dtypes})
+    if delta_tall is not None and len(delta_tall) > 0:
+        df_tall = pd.concat([df_tall, delta_tall.astype(df_tall.dtypes.to_dict())], ignore_index=True)
+        df_tall = df_tall.drop_duplicates(['INSTID', 'COLUMN', 'YEAR'], keep='last')
+        df_tall = df_tall.sort_values(['INSTID', 'COLUMN', 'YEAR'], kind='stable').reset_index(drop=True)
+    return df_wide, df_tall
+
+## merge the delta files of a new release into the published data, and publish the result as a new data version
+## (the full history is not parsed again; running processes switch to the new version on their next check,
+##  and the snapshots of the source files and of the last data_version_keep versions are kept for the processes
+##  that still serve them)
+def refresh_data(delta_widef=None, delta_tallf=None):
+    base = get_source_fingerprint()
+    current = read_data_version()
+    df_wide, df_tall = load_prepared_data(version=current)
+    h = hashlib.sha256(current.encode())
+    for f in (delta_widef, delta_tallf):
+        if f is not None:
+            with open(f, 'rb') as fh:
+                for chunk in iter(lambda: fh.read(1 << 20), b''):
+                    h.update(chunk)
+    version = h.hexdigest()[:16]
+    delta_wide = parse_wide_data(delta_widef, partial=True) if delta_widef is not None else None
+    delta_tall = read_tall_data(delta_tallf, tall_metrics, tall_years, tall_year_rules) if delta_tallf is not None else None
+    frames = merge_data(df_wide, df_tall, delta_wide, delta_tall)
+    published = read_published_versions(base)
+    keep = [base, current] + published[len(published) - (data_version_keep - 1):]
+    write_snapshot(frames, version, keep=keep)
+    if read_snapshot(version) is None:
+        raise OSError(f"could not publish data version {version} to {snapshot_dir}")
+    publish_data_version(version, base)
+    return {
+        'previous': current,
+        'version': version,
+        'wide_updated': 0 if delta_wide is None else int(delta_wide['id'].drop_duplicates().isin(df_wide['id']).sum()),
+        'wide_added': len(frames[0]) - len(df_wide),
+        'tall_added': len(frames[1]) - len(df_tall),
+    }
+
+## report the bytes used by each frame and by each of its columns (including the index)
+def get_memory_report(frames):
+    report = {}
+    for name, df in frames.items():
+        usage = df.memory_usage(index=True, deep=True)
+        report[name] = {
+            'total': int(usage.sum()),
+            'columns': {colname: int(nbytes) for colname, nbytes in usage.items()},
+        }
+    return report
+
+## raise MemoryError if the frames in the memory report exceed the budget (with warn_only, print a warning instead);
+## returns the total in MB
+def check_memory_budget(report, budget_mb=None, warn_only=None):
+    if budget_mb is None:
+        budget_mb = memory_budget_mb
+    if warn_only is None:
+        warn_only = memory_budget_warn_only
+    total_mb = sum(x['total'] for x in report.values()) / 1e6
+    if budget_mb > 0 and total_mb > budget_mb:
+        details = ", ".join(f"{name} {x['total'] / 1e6:.1f} MB" for name, x in report.items())
+        message = f"loaded data uses {total_mb:.1f} MB, over the budget of {budget_mb:.1f} MB ({details})"
+        if not warn_only:
+            raise MemoryError(message)
+        print(f"WARNING: {message}", file=sys.stderr)
+    return total_mb
+
+## convert the compact dtypes back to plain python values before sending a frame to the frontend
+## (float32 values are rounded to their shortest representation, e.g. 0.716 instead of 0.7160000205)
+def to_display_frame(df):
+    df = df.copy()
+    for colname in df.columns:
+        if isinstance(df[colname].dtype, pd.CategoricalDtype):
+            df[colname] = df[colname].astype(object)
+        elif df[colname].dtype == np.float32:
+            df[colname] = df[colname].to_numpy().astype(str).astype(float)
+    return df
+
+## build the [start, end) offsets of each institution and each (institution, metric) in the sorted df_tall,
+## as sorted key arrays with their start and end arrays, looked up with np.searchsorted
+## (the keys of the (institution, metric) blocks are instid * number of metrics + metric code)
+def build_tall_index(df_tall):
+    ids = df_tall['INSTID'].to_numpy()
+    cols = df_tall['COLUMN'].cat.codes.to_numpy()
+    categories = list(df_tall['COLUMN'].cat.categories)
+    n = len(ids)
+    inst_change = np.ones(n, dtype=bool)
+    inst_change[1:] = ids[1:] != ids[:-1]
+    metric_change = inst_change.copy()
+    metric_change[1:] |= cols[1:] != cols[:-1]
+
+    def get_offsets(change, keys):
+        starts = np.flatnonzero(change)
+        ends = np.append(starts[1:], n)
+        order = np.argsort(keys[starts], kind='stable')
+        return keys[starts][order], starts[order], ends[order]
+
+    return {
+        'categories': categories,
+        'inst': get_offsets(inst_change, ids.astype(np.int64)),
+        'metric': get_offsets(metric_change, ids.astype(np.int64) * len(categories) + cols),
+    }
+
+## [start, end) offsets of the given keys in a tall index (unknown keys are skipped)
+def get_tall_offsets(offsets, keys):
+    sorted_keys, starts, ends = offsets
+    keys = np.asarray(keys, dtype=np.int64)
+    if len(sorted_keys) == 0 or len(keys) == 0:
+        return starts[:0], ends[:0]
+    found = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    found = found[sorted_keys[found] == keys]
+    return starts[found], ends[found]
+
+## get the rows of df_tall for the given institution id(s), optionally restricted to the given metrics
+## (tall_index is the build_tall_index() of that same df_tall)
+def get_tall_rows(df_tall, tall_index, instids, columns=None):
+    instids = np.atleast_1d(np.asarray(instids, dtype=np.int64))
+    if columns is None:
+        starts, ends = get_tall_offsets(tall_index['inst'], instids)
+    else:
+        codes = {x: i for i, x in enumerate(tall_index['categories'])}
+        codes = np.array([codes[x] for x in columns if x in codes], dtype=np.int64)
+        keys = (instids[:, None] * len(tall_index['categories']) + codes[None, :]).ravel()
+        starts, ends = get_tall_offsets(tall_index['metric'], keys)
+    if len(starts) == 1:
+        return df_tall.iloc[starts[0]:ends[0]]
+    positions = [np.arange(start, end) for start, end in zip(starts, ends)]
+    return df_tall.iloc[np.concatenate(positions) if positions else []]
+
+## round the bounds of a range filter to the precision of the column, so that the values equal to a bound match
+## (e.g. 0.29 stored as float32 is 0.28999999, below the float64 bound 0.29)
+def cast_bounds(dtype, *bounds):
+    if isinstance(dtype, np.dtype) and dtype.kind == 'f':
+        return tuple(float(dtype.type(x)) for x in bounds)
+    return bounds
+
+## define FilterEngine class to evaluate the Filter page widgets with precomputed masks
+class FilterEngine:
+    def __init__(self, df, cat_columns, range_columns):
+        self.df = df
+        self.num_rows = len(df)
+        ## one boolean mask per distinct value of each categorical column
+        self.value_masks = {}
+        for colname in cat_columns:
+            codes, uniques = pd.factorize(df[colname])
+            self.value_masks[colname] = {value: codes == i for i, value in enumerate(uniques)}
+        ## sorted non-missing values and their row positions for each range column
+        ## (other columns, e.g. the data dictionary fields, are indexed on first use)
+        self.sorted_values = {}
+        for colname in range_columns:
+            self.get_sorted_values(colname)
+
+    def get_sorted_values(self, colname):
+        if colname not in self.sorted_values:
+            values = self.df[colname].to_numpy(dtype=float)
+            order = np.argsort(values, kind='stable')
+            order = order[~np.isnan(values[order])]
+            self.sorted_values[colname] = (values[order], order)
+        return self.sorted_values[colname]
+
+    ## rows whose value in colname is one of the selected values
+    def get_value_mask(self, colname, selected):
+        mask = np.zeros(self.num_rows, dtype=bool)
+        value_masks = self.value_masks[colname]
+        for value in selected:
+            if value in value_masks:
+                mask |= value_masks[value]
+        return mask
+
+    ## rows whose value in colname is within [minval, maxval] (missing values are excluded)
+    def get_range_mask(self, colname, minval, maxval):
+        values, order = self.get_sorted_values(colname)
+        minval, maxval = cast_bounds(self.df[colname].dtype, minval, maxval)
+        start = np.searchsorted(values, minval, side='left')
+        end = np.searchsorted(values, maxval, side='right')
+        mask = np.zeros(self.num_rows, dtype=bool)
+        mask[order[start:end]] = True
+        return mask
+
+    ## AND the given masks together (None means the widget does not filter anything)
+    ## (the masks may also be packed with pack_mask(), as kept in the session state)
+    def combine_masks(self, masks):
+        combined = np.ones(self.num_rows, dtype=bool)
+        for mask in masks:
+            if mask is not None:
+                combined &= unpack_mask(mask, self.num_rows)
+        return combined
+
+## pack a boolean mask over the rows of df_wide into bits (8 rows per byte) to keep it in the session state
+def pack_mask(mask):
+    return None if mask is None else np.packbits(mask)
+
+def unpack_mask(mask, num_rows):
+    if mask.dtype == bool:
+        return mask
+    return np.unpackbits(mask, count=num_rows).view(bool)
+
+## the filter engine is read-only, so a single copy is shared across sessions
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_filter_engine(version, cat_columns, range_columns):
+    df_wide = load_data(version)[0]
+    return FilterEngine(df_wide, cat_columns, range_columns)
+
+## number and bytes of the results (selections and prepared payloads) of the Filter page kept across sessions
+## (the map, chart and table payloads of a selection differ widely in size, so the bytes bound the memory)
+filter_cache_entries = 128
+filter_cache_bytes = int(os.environ.get("COLLEGE_GUIDE_FILTER_CACHE_MB", "128")) << 20
+
+## define ResultCache class to share the results of identical requests across sessions
+## (bounded by the number of entries and/or their bytes, the least recently used entries are evicted first)
+class ResultCache:
+    def __init__(self, max_entries=filter_cache_entries, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.entry_bytes = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    ## the cached result of key, or the result of compute() (which is then cached)
+    def get(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        value = compute()
+        size = get_session_bytes(value) if self.max_bytes is not None else 0
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entry_bytes[key]
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            self.entry_bytes[key] = size
+            self.bytes += size
+            while len(self.entries) > 1 and self.is_full():
+                old_key, old_value = self.entries.popitem(last=False)
+                self.bytes -= self.entry_bytes.pop(old_key)
+        return value
+
+    def is_full(self):
+        return ((self.max_entries is not None and len(self.entries) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes))
+
+    def get_stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses}
+
+## the results depend on the data, so each data version has its own cache
+@st.cache_resource(max_entries=2)
+def load_filter_cache(version):
+    return ResultCache(max_entries=filter_cache_entries, max_bytes=filter_cache_bytes)
+
+## a filter spec maps each column of df_wide to a condition:
+##   a list of accepted values for categorical columns, e.g. {'region': ['South', 'West']}
+##   a [min, max] range for numeric columns (None for an open end), e.g. {'admissions__sat_scores__average__overall': [1200, None]}
+## rows missing a value in a constrained column never match, and an empty spec matches every row
+query_block_bytes = 1 << 26 ## size of the (specs x rows) mask evaluated at once in query_batch()
+
+## define QueryEngine class to evaluate filter specs and look up colleges without a Streamlit session
+## (usage: engine = QueryEngine(*load_prepared_data()); ids = engine.query_batch(specs))
+class QueryEngine:
+    def __init__(self, df_wide, df_tall=None, tall_index=None):
+        self.df_wide = df_wide
+        self.df_tall = df_tall
+        self.tall_index = tall_index
+        self.num_rows = len(df_wide)
+        self.ids = df_wide['id'].to_numpy()
+        self.id_order = np.argsort(self.ids, kind='stable')
+        ## column arrays, extracted on first use: category codes (shifted so that missing values are 0) or float values
+        self.codes = {}
+        self.values = {}
+
+    def get_codes(self, colname):
+        if colname not in self.codes:
+            col = self.df_wide[colname]
+            if not isinstance(col.dtype, pd.CategoricalDtype):
+                col = col.astype('category')
+            self.codes[colname] = (col.cat.codes.to_numpy().astype(np.int32) + 1, list(col.cat.categories))
+        return self.codes[colname]
+
+    def get_values(self, colname):
+        if colname not in self.values:
+            self.values[colname] = self.df_wide[colname].to_numpy(dtype=float)
+        return self.values[colname]
+
+    ## validate a spec and split it into value conditions and range conditions
+    def compile_spec(self, spec):
+        value_conds, range_conds = {}, {}
+        for colname, cond in spec.items():
+            if colname not in self.df_wide.columns:
+                raise ValueError(f"unknown filter column: {colname}")
+            if pd.api.types.is_numeric_dtype(self.df_wide[colname].dtype):
+                if not isinstance(cond, (list, tuple, np.ndarray)) or len(cond) != 2:
+                    raise ValueError(f"the condition on {colname} must be a [min, max] range")
+                lo, hi = cond
+                range_conds[colname] = cast_bounds(self.df_wide[colname].dtype, -np.inf if lo is None else float(lo), np.inf if hi is None else float(hi))
+            else:
+                if isinstance(cond, str):
+                    cond = [cond]
+                value_conds[colname] = set(cond)
+        return value_conds, range_conds
+
+    ## evaluate the specs together, one column at a time over all the specs constraining it,
+    ## and return a boolean (specs x rows) mask
+    def get_batch_mask(self, compiled):
+        mask = np.ones((len(compiled), self.num_rows), dtype=bool)
+        value_columns = {x for value_conds, range_conds in compiled for x in value_conds}
+        range_columns = {x for value_conds, range_conds in compiled for x in range_conds}
+        for colname in value_columns:
+            spec_idx = [i for i, (value_conds, range_conds) in enumerate(compiled) if colname in value_conds]
+            codes, categories = self.get_codes(colname)
+            ## lookup table of the accepted codes of each spec; identical conditions are evaluated once
+            table = np.zeros((len(spec_idx), len(categories) + 1), dtype=bool)
+            for i, j in enumerate(spec_idx):
+                table[i, 1:] = [x in compiled[j][0][colname] for x in categories]
+            table, inverse = np.unique(table, axis=0, return_inverse=True)
+            mask[spec_idx] &= table[:, codes][inverse.ravel()]
+        for colname in range_columns:
+            spec_idx = [i for i, (value_conds, range_conds) in enumerate(compiled) if colname in range_conds]
+            values = self.get_values(colname)
+            bounds, inverse = np.unique(np.array([compiled[j][1][colname] for j in spec_idx]), axis=0, return_inverse=True)
+            cond = (values >= bounds[:, 0:1]) & (values <= bounds[:, 1:2])
+            mask[spec_idx] &= cond[inverse.ravel()]
+        return mask
+
+    ## ids of the colleges matching each spec, evaluated in blocks of specs to bound the memory used
+    def query_batch(self, specs):
+        compiled = [self.compile_spec(spec) for spec in specs]
+        block_size = max(1, query_block_bytes // max(1, self.num_rows))
+        results = []
+        for start in range(0, len(compiled), block_size):
+            mask = self.get_batch_mask(compiled[start:start + block_size])
+            results.extend(self.ids[np.flatnonzero(row)] for row in mask)
+        return results
+
+    ## ids of the colleges matching a single spec
+    def query(self, spec):
+        return self.query_batch([spec])[0]
+
+    ## row positions in df_wide of the given ids (-1 for unknown ids)
+    def get_positions(self, ids):
+        ids = np.atleast_1d(np.asarray(ids))
+        sorted_ids = self.ids[self.id_order]
+        found = np.minimum(np.searchsorted(sorted_ids, ids), len(sorted_ids) - 1)
+        return np.where(sorted_ids[found] == ids, self.id_order[found], -1)
+
+    ## rows of df_wide for the given ids (unknown ids are skipped), optionally restricted to the given columns
+    def get_colleges(self, ids, columns=None):
+        positions = self.get_positions(ids)
+        df = self.df_wide.iloc[positions[positions >= 0]]
+        return df if columns is None else df[columns]
+
+    ## rows of df_tall for the given ids, optionally restricted to the given metrics
+    def get_tall(self, ids, columns=None):
+        if self.tall_index is None:
+            self.tall_index = build_tall_index(self.df_tall)
+        return get_tall_rows(self.df_tall, self.tall_index, ids, columns)
+
+## the query engine of the app shares the loaded data (its tall index is built on first use);
+## the View and Compare pages look up their selected colleges by id with it
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_query_engine(version):
+    df_wide, df_tall = load_data(version)
+    return QueryEngine(df_wide, df_tall)
+
+## define PercentileService class to compute percentiles of df_wide columns on demand
+## (percentiles match df.rank(pct=True) * 100, i.e. ties get the average rank and missing values are NaN)
+class PercentileService:
+    def __init__(self, df):
+        self.df = df
+        self.sorted_values = {} ## sorted non-missing values, built only for the columns that are used
+
+    def get_sorted_values(self, colname):
+        if colname not in self.sorted_values:
+            values = self.df[colname].to_numpy(dtype=float)
+            self.sorted_values[colname] = np.sort(values[~np.isnan(values)])
+        return self.sorted_values[colname]
+
+    ## percentile(s) of the given value(s) among the values of colname
+    def get_percentile(self, colname, values):
+        sorted_values = self.get_sorted_values(colname)
+        values = np.asarray(values, dtype=float)
+        lo = np.searchsorted(sorted_values, values, side='left')
+        hi = np.searchsorted(sorted_values, values, side='right')
+        pct = (lo + hi + 1) / 2 / len(sorted_values) * 100
+        return np.where(np.isnan(values), np.nan, pct)
+
+    ## percentiles of many rows (positions in df) and columns in one vectorized call
+    def get_percentiles(self, rows, colnames):
+        return pd.DataFrame({colname: self.get_percentile(colname, self.df[colname].to_numpy(dtype=float)[rows])
+                             for colname in colnames},
+                            index=self.df.index[rows])
+
+## the percentile service is shared across sessions
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_percentiles(version):
+    df_wide = load_data(version)[0]
+    return PercentileService(df_wide)
+
+## columns shown in the tooltip of the college map, and the tooltip of a college (formatted once per data version)
+map_tooltip_columns = ['name', 'school__city', 'school__state', 'barrons', 'public', 'iclevel', 'student__size',
+                       'admissions__sat_scores__average__overall', 'admissions__act_scores__midpoint__cumulative',
+                       'admissions__admission_rate__overall', 'cost__tuition__in_state', 'cost__tuition__out_of_state']
+map_tooltip_html = ('<b>Name:</b> {name} ({school__city}, {school__state})<br/><b>Barrons Selectivity:</b> {barrons}<br/>'
+                    '<b>Type:</b> {public}, {iclevel} <br/><b>Student Size:</b> {student__size}<br/>'
+                    '<b>SAT / ACT:</b> {admissions__sat_scores__average__overall} / {admissions__act_scores__midpoint__cumulative}<br/>'
+                    '<b>Acceptance Rate:</b> {admissions__admission_rate__overall}<br/>'
+                    '<b>In/Out-State Tuitions: </b> ${cost__tuition__in_state} / ${cost__tuition__out_of_state}')
+map_cluster_tooltip_html = '<b>{count:,} colleges</b><br/><b>Mostly:</b> {dominant}<br/><b>Total Student Size:</b> {enrollment:,.0f}'
+
+## the map shows the selected colleges in view as points, and as clusters of a grid of about map_cluster_cell_px
+## pixels only when more than map_point_limit colleges are in view (below map_cluster_max_zoom); the level of detail
+## is set by the number of visible colleges, so that the whole country shows points unless it holds too many to draw
+map_initial_view = {'latitude': 37.76, 'longitude': -100.4, 'zoom': 3.5}
+map_viewport_px = (1600, 500)   ## upper bound of the map size in pixels, for the viewport culling
+map_fit_px = (800, 400)         ## size in pixels that the colleges of a state are fitted in
+map_cluster_cell_px = 40
+map_point_limit = int(os.environ.get("COLLEGE_GUIDE_MAP_POINT_LIMIT", "5000"))
+map_cluster_max_zoom = 7
+
+## uint8 RGBA palette of a color scheme, indexed by category code (the last row is used for missing codes, i.e. -1)
+def build_color_palette(categories, color_key):
+    colors = [color_maps[color_key].get(x, color_missing) for x in categories] + [color_missing]
+    return np.array(colors, dtype=np.uint8)
+
+## RGBA color of every row of df_wide for each color scheme
+def build_row_colors(df_wide):
+    row_colors = {}
+    for color_key in color_maps:
+        values = pd.Categorical(df_wide[color_key])
+        row_colors[color_key] = build_color_palette(values.categories, color_key)[values.codes]
+    return row_colors
+
+## format a value of a tooltip (missing values are blank, whole numbers have no decimals)
+def format_tooltip_value(x):
+    if pd.isna(x):
+        return ""
+    if isinstance(x, float) and x.is_integer():
+        return str(int(x))
+    return html.escape(str(x))
+
+## the projected map frame (position, radius and tooltip) and the row colors of each scheme
+def build_map_data(df_wide):
+    df_tooltip = to_display_frame(df_wide[map_tooltip_columns])
+    df_map = to_display_frame(df_wide[['lon', 'lat']])
+    df_map['radius'] = np.sqrt(df_wide['student__size'].astype(float)) * 125
+    ## the template is filled column by column rather than row by row
+    tooltip = pd.Series("", index=df_map.index, dtype=object)
+    for literal, field, spec, conversion in string.Formatter().parse(map_tooltip_html):
+        tooltip = tooltip + literal
+        if field is not None:
+            ## each distinct value is formatted once (missing values have code -1, i.e. the last, blank entry)
+            codes, uniques = pd.factorize(df_tooltip[field])
+            tooltip = tooltip + np.array([format_tooltip_value(x) for x in uniques] + [""], dtype=object)[codes]
+    df_map['tooltip'] = tooltip
+    return df_map.fillna({'radius': 0}), build_row_colors(df_wide)
+
+## the map data is shared across sessions
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_map_data(version):
+    df_wide = load_data(version)[0]
+    return build_map_data(df_wide)
+
+## frame for the pydeck map with the given rows (positions in df_wide) colored by the given scheme
+def get_map_frame(positions, color_key, map_data=None):
+    if map_data is None:
+        map_data = load_map_data(get_data_version())
+    df_map, row_colors = map_data
+    rgba = row_colors[color_key][positions]
+    return df_map.iloc[positions].assign(col_r=rgba[:, 0], col_g=rgba[:, 1], col_b=rgba[:, 2], col_a=rgba[:, 3])
+
+## latitude of a web mercator y (in radians), and back
+def mercator_to_lat(y):
+    return np.degrees(2 * np.arctan(np.exp(y)) - np.pi / 2)
+
+def lat_to_mercator(lat):
+    return np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+
+## define MapIndex class to cull the map to the viewport and cluster the colleges on a grid at low zoom
+## (the grid cells of each zoom level and the color codes of each scheme are computed once per data version)
+class MapIndex:
+    def __init__(self, df_wide):
+        self.lat = df_wide['lat'].to_numpy(dtype=float)
+        self.lon = df_wide['lon'].to_numpy(dtype=float)
+        self.enrollment = np.nan_to_num(df_wide['student__size'].to_numpy(dtype=float))
+        ## the state column of the Filter page (the options of its map view), which differs from school__state for a few colleges
+        self.states = df_wide['state']
+        self.colors = {}
+        for color_key in color_maps:
+            values = pd.Categorical(df_wide[color_key])
+            codes = np.where(values.codes < 0, len(values.categories), values.codes)
+            self.colors[color_key] = (codes, build_color_palette(values.categories, color_key), list(values.categories) + ['unknown'])
+        self.cells = {}
+        self.views = {}
+
+    ## grid cell of every row at the given zoom level (about map_cluster_cell_px pixels wide)
+    def get_cells(self, zoom):
+        if zoom not in self.cells:
+            size = map_cluster_cell_px * 360 / (256 * 2 ** zoom)
+            x = np.floor((np.nan_to_num(self.lon) + 180) / size).astype(np.int64)
+            y = np.floor((np.nan_to_num(self.lat) + 90) / size).astype(np.int64)
+            self.cells[zoom] = x * (1 << 24) + y
+        return self.cells[zoom]
+
+    ## initial view of the whole map, or fitted to the colleges of a state
+    def get_view(self, state=None):
+        if state is None:
+            return map_initial_view
+        if state not in self.views:
+            rows = (self.states == state).to_numpy() & ~np.isnan(self.lat) & ~np.isnan(self.lon)
+            if not rows.any():
+                return map_initial_view
+            lat_min, lat_max = self.lat[rows].min(), self.lat[rows].max()
+            lon_min, lon_max = self.lon[rows].min(), self.lon[rows].max()
+            y_min, y_max = lat_to_mercator(lat_min), lat_to_mercator(lat_max)
+            zoom_x = np.log2(map_fit_px[0] * 360 / (256 * max(lon_max - lon_min, 0.1)))
+            zoom_y = np.log2(map_fit_px[1] * 2 * np.pi / (256 * max(y_max - y_min, 0.002)))
+            self.views[state] = {
+                'latitude': float(mercator_to_lat((y_min + y_max) / 2)),
+                'longitude': float((lon_min + lon_max) / 2),
+                'zoom': float(np.clip(np.floor(min(zoom_x, zoom_y) * 2) / 2, map_initial_view['zoom'], 10)),
+            }
+        return self.views[state]
+
+    ## the given rows (positions in df_wide) within the viewport of the view
+    def cull(self, positions, view):
+        scale = 256 * 2 ** view['zoom']
+        half_lon = map_viewport_px[0] / 2 * 360 / scale
+        half_y = map_viewport_px[1] / 2 * 2 * np.pi / scale
+        y = lat_to_mercator(view['latitude'])
+        lat_min, lat_max = mercator_to_lat(y - half_y), mercator_to_lat(y + half_y)
+        lat, lon = self.lat[positions], self.lon[positions]
+        inside = (lat >= lat_min) & (lat <= lat_max) & (lon >= view['longitude'] - half_lon) & (lon <= view['longitude'] + half_lon)
+        return positions[inside]
+
+    ## clusters of the given rows on the grid of the zoom level: centroid, count, summed enrollment and the
+    ## color of the dominant category (a cluster of a single college keeps that college's tooltip and radius)
+    def get_clusters(self, positions, zoom, color_key, map_data):
+        df_map, row_colors = map_data
+        codes, palette, categories = self.colors[color_key]
+        uniq, first, inverse, counts = np.unique(self.get_cells(zoom)[positions], return_index=True, return_inverse=True, return_counts=True)
+        inverse = inverse.ravel()
+        enrollment = np.bincount(inverse, weights=self.enrollment[positions])
+        dominant = np.bincount(inverse * len(palette) + codes[positions], minlength=len(uniq) * len(palette)).reshape(len(uniq), len(palette)).argmax(axis=1)
+        rgba = palette[dominant]
+        single = positions[first]
+        df = pd.DataFrame({
+            'lon': np.bincount(inverse, weights=self.lon[positions]) / counts,
+            'lat': np.bincount(inverse, weights=self.lat[positions]) / counts,
+            'radius': np.where(counts == 1, df_map['radius'].to_numpy()[single], np.sqrt(enrollment) * 125),
+            'tooltip': [df_map['tooltip'].iat[p] if n == 1 else map_cluster_tooltip_html.format(count=n, dominant=html.escape(str(categories[d])), enrollment=e)
+                        for p, n, d, e in zip(single, counts, dominant, enrollment)],
+        })
+        return df.assign(col_r=rgba[:, 0], col_g=rgba[:, 1], col_b=rgba[:, 2], col_a=rgba[:, 3])
+
+    ## the frame of the map layer for the selected rows in the view, and whether it holds clusters
+    def get_layer_frame(self, positions, color_key, view, map_data):
+        positions = self.cull(np.asarray(positions), view)
+        if len(positions) <= map_point_limit or view['zoom'] >= map_cluster_max_zoom:
+            return get_map_frame(positions, color_key, map_data), False
+        return self.get_clusters(positions, view['zoom'], color_key, map_data), True
+
+## the map index is read-only and shared across sessions
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_map_index(version):
+    df_wide = load_data(version)[0]
+    return MapIndex(df_wide)
+
+## columns with the names of a college, the columns with its location, and the column used to rank the matches
+search_name_columns = ['name', 'school__name']
+search_place_columns = ['school__city', 'school__state']
+search_rank_column = 'student__size'
+## number of matches shown in the college selection boxes
+search_top_k = 20
+## minimum fraction of the query trigrams that a fuzzy match must contain
+search_min_trigram_score = 0.5
+## words skipped when building the acronym of a name
+search_stopwords = {'of', 'the', 'and', 'at', 'in', 'for', 'a'}
+
+## lowercase alphanumeric words separated by single spaces (e.g. "Texas A&M" -> "texas a and m")
+def normalize_search_text(text):
+    return " ".join(re.findall(r"[a-z0-9]+", str(text).lower().replace("&", " and ")))
+
+## common aliases of a college name: its acronym (e.g. "mit") and the saint/st spelling
+def get_name_aliases(name):
+    words = normalize_search_text(name).split()
+    aliases = []
+    acronym = "".join(x[0] for x in words if x not in search_stopwords)
+    if len(acronym) >= 2:
+        aliases.append(acronym)
+    if 'saint' in words or 'st' in words:
+        aliases.append(" ".join({'saint': 'st', 'st': 'saint'}.get(x, x) for x in words))
+    return aliases
+
+def get_trigrams(text):
+    text = f"  {text} "
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+## define SearchIndex class for type-ahead search of colleges by name, alias or city/state
+## (prefix matches on any word come first, then fuzzy trigram matches; ties are ranked by enrollment)
+class SearchIndex:
+    def __init__(self, df):
+        self.labels = [f"{row[0]} ({row[1]}, {row[2]})"
+                       for row in df[['name'] + search_place_columns].itertuples(index=False)]
+        ranks = df[search_rank_column].to_numpy(dtype=float)
+        self.ranks = np.nan_to_num(ranks, nan=-1)
+        self.default_order = np.lexsort((np.arange(len(df)), -self.ranks))
+
+        keys = [] ## (suffix of a search text starting at a word, row, whether it is the start of the text)
+        postings = {}
+        for i, row in enumerate(df[search_name_columns + search_place_columns].itertuples(index=False)):
+            names = [x for x in row[:len(search_name_columns)] if isinstance(x, str)]
+            texts = {normalize_search_text(x) for x in names}
+            texts.update(alias for x in names for alias in get_name_aliases(x))
+            texts.add(normalize_search_text(" ".join(str(x) for x in row[len(search_name_columns):])))
+            trigrams = set()
+            for text in texts:
+                words = text.split()
+                for j in range(len(words)):
+                    keys.append((" ".join(words[j:]), i, j == 0))
+                trigrams |= get_trigrams(text)
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(i)
+        keys.sort()
+        self.keys = [x[0] for x in keys]
+        self.key_rows = np.array([x[1] for x in keys], dtype=np.int32)
+        self.key_is_start = np.array([x[2] for x in keys], dtype=bool)
+        self.postings = {k: np.array(v, dtype=np.int32) for k, v in postings.items()}
+
+    ## positions (in df) of the top-k matches of the query
+    def search(self, query, k=search_top_k):
+        query = normalize_search_text(query)
+        if query == "":
+            return self.default_order[:k]
+        scores = np.zeros(len(self.ranks))
+        ## fuzzy matches: fraction of the query trigrams contained in the college's texts
+        trigrams = get_trigrams(query)
+        hits = [self.postings[x] for x in trigrams if x in self.postings]
+        if hits:
+            trigram_scores = np.bincount(np.concatenate(hits), minlength=len(scores)) / len(trigrams)
+            scores = np.where(trigram_scores >= search_min_trigram_score, trigram_scores, 0)
+        ## prefix matches: 3 for the start of a name, 2 for the start of another word
+        start = bisect.bisect_left(self.keys, query)
+        end = bisect.bisect_left(self.keys, query + "\uffff")
+        np.maximum.at(scores, self.key_rows[start:end], np.where(self.key_is_start[start:end], 3.0, 2.0))
+        matches = np.flatnonzero(scores)
+        order = np.lexsort((matches, -self.ranks[matches], -scores[matches]))
+        return matches[order[:k]]
+
+    def get_label(self, position):
+        return self.labels[position]
+
+## the search index is shared across sessions
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_search_index(version):
+    df_wide = load_data(version)[0]
+    return SearchIndex(df_wide)
+
+## define MetricCube class to hold the tall-formatted metrics as a dense (institution x metric x year) array
+## (institutions are in the order of df_wide, and missing values are NaN), so that any set of colleges and
+## metrics is fetched with a single fancy-index, and the peer-group medians are computed once per group column
+## (stored is the (data, years) of a cube written by write_metric_cube(), e.g. memory-mapped from the snapshot)
+class MetricCube:
+    def __init__(self, df_wide, df_tall, metrics=None, stored=None):
+        self.df_wide = df_wide
+        self.metrics = list(lts.keys()) if metrics is None else list(metrics)
+        self.metric_pos = {x: i for i, x in enumerate(self.metrics)}
+        self.group_medians = {}
+        if stored is not None:
+            self.data, self.years = stored
+        else:
+            self.build(df_tall)
+
+    def build(self, df_tall):
+        df_wide = self.df_wide
+        years = df_tall['YEAR'].to_numpy()
+        year0 = int(years.min()) if len(years) else 0
+        self.years = np.arange(year0, int(years.max()) + 1 if len(years) else 0, dtype=np.int16)
+        self.data = np.full((len(df_wide), len(self.metrics), len(self.years)), np.nan, dtype=np.float32)
+
+        ## integer lookups of the tall rows: institution id -> row of df_wide, metric -> position, year -> offset
+        ids = df_wide['id'].to_numpy()
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+        instids = df_tall['INSTID'].to_numpy()
+        found = np.minimum(np.searchsorted(sorted_ids, instids), max(len(ids) - 1, 0))
+        metric_idx = pd.Categorical(df_tall['COLUMN'], categories=self.metrics).codes
+        valid = (sorted_ids[found] == instids) & (metric_idx >= 0) if len(ids) else np.zeros(len(instids), dtype=bool)
+        self.data[order[found[valid]], metric_idx[valid], years[valid] - year0] = df_tall['VALUE'].to_numpy()[valid]
+
+    ## values of the given rows of df_wide and metrics, as a (rows x metrics x years) array
+    def fetch(self, positions, metrics):
+        return self.data[np.ix_(np.atleast_1d(positions), [self.metric_pos[x] for x in metrics])]
+
+    ## per-year medians of every group of a categorical column of df_wide, as a (groups x metrics x years) array
+    def get_group_medians(self, colname):
+        if colname not in self.group_medians:
+            col = self.df_wide[colname]
+            if not isinstance(col.dtype, pd.CategoricalDtype):
+                col = col.astype('category')
+            codes = col.cat.codes.to_numpy()
+            medians = np.full((len(col.cat.categories),) + self.data.shape[1:], np.nan, dtype=np.float32)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', RuntimeWarning) ## all-NaN (metric, year) slices
+                for i in range(len(medians)):
+                    medians[i] = np.nanmedian(self.data[codes == i], axis=0)
+            self.group_medians[colname] = (codes, list(col.cat.categories), medians)
+        return self.group_medians[colname]
+
+    ## medians of the groups (in colname) of the given rows, and the names of those groups
+    def get_peer_medians(self, colname, positions, metrics):
+        codes, categories, medians = self.get_group_medians(colname)
+        groups = [x for x in dict.fromkeys(codes[np.atleast_1d(positions)].tolist()) if x >= 0]
+        values = medians[np.ix_(groups, [self.metric_pos[x] for x in metrics])]
+        return [categories[x] for x in groups], values
+
+    ## long-format frame of a (series x metrics x years) array, without the missing values
+    def get_frame(self, values, series, metric_labels):
+        k, m, y = np.nonzero(~np.isnan(values))
+        return pd.DataFrame({
+            'SERIES': np.asarray(series, dtype=object)[k],
+            'COLUMN': np.asarray(metric_labels, dtype=object)[m],
+            'YEAR': self.years[y],
+            'VALUE': values[k, m, y],
+        })
+
+## store the cube next to the frames of a snapshot (as .npy files, so that it can be memory-mapped)
+def write_metric_cube(cube, path):
+    os.makedirs(os.path.join(path, "metric_cube"), exist_ok=True)
+    np.save(os.path.join(path, "metric_cube", "data.npy"), cube.data)
+    np.save(os.path.join(path, "metric_cube", "years.npy"), cube.years)
+    with open(os.path.join(path, "metric_cube", "metrics.json"), 'w') as fh:
+        json.dump(cube.metrics, fh)
+
+## the (data, years) of the cube stored in a snapshot, if it matches the rows of df_wide and the metrics (else None)
+def read_metric_cube(path, num_rows, metrics):
+    try:
+        with open(os.path.join(path, "metric_cube", "metrics.json")) as fh:
+            if json.load(fh) != list(metrics):
+                return None
+        data = np.load(os.path.join(path, "metric_cube", "data.npy"), mmap_mode='r')
+        years = np.load(os.path.join(path, "metric_cube", "years.npy"))
+    except (OSError, ValueError):
+        return None
+    return (data, years) if data.shape[:2] == (num_rows, len(metrics)) else None
+
+## the cube is read-only and shared across sessions; it is memory-mapped from the snapshot of the version
+## (so that the server processes of a host share it like the frames), or built if the snapshot has none
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_metric_cube(version):
+    df_wide, df_tall = load_data(version)
+    stored = read_metric_cube(os.path.join(snapshot_dir, version), len(df_wide), lts.keys())
+    cube = MetricCube(df_wide, df_tall, stored=stored)
+    check_memory_budget(dict(get_memory_report({'df_wide': df_wide, 'df_tall': df_tall}),
+                             metric_cube={'total': cube.data.nbytes, 'columns': {}}))
+    return cube
+
+## bytes of the prepared View page models (chart frames and formatted metrics) kept across sessions
+view_cache_bytes = 64 << 20
+
+## the View page models of the recently viewed colleges (per data version)
+@st.cache_resource(max_entries=2)
+def load_view_cache(version):
+    return ResultCache(max_entries=None, max_bytes=view_cache_bytes)
+
+## group columns offered as peer-group overlays on the View and Compare charts
+peer_groups = ['tier_name', 'barrons']
+
+## the given metrics of a college for a View page chart (COLUMN holds the metric descriptions),
+## optionally with the medians of its peer group (SERIES tells the college and the median apart)
+def get_view_chart_frame(cube, position, colnames, peer_group=None):
+    values = cube.fetch(position, colnames)
+    series = ['This college']
+    if peer_group is not None:
+        groups, medians = cube.get_peer_medians(peer_group, position, colnames)
+        values = np.concatenate([values, medians])
+        series += [f"Median of {cats[peer_group]}: {x}" for x in groups]
+    return cube.get_frame(values, series, [lts[x] for x in colnames])
+
+## a metric of the given colleges for the Compare page chart, optionally with the medians of their peer groups
+## (INSTID keys the series by college id, so that colleges of the same name stay apart; LABEL is their display label)
+def get_compare_chart_frame(cube, positions, metric, labels, peer_group=None):
+    positions = np.atleast_1d(positions)
+    values = cube.fetch(positions, [metric])
+    series = cube.df_wide['id'].to_numpy()[positions].astype(str).tolist()
+    labels = list(labels)
+    kinds = ['Selected college'] * len(series)
+    if peer_group is not None:
+        groups, medians = cube.get_peer_medians(peer_group, positions, [metric])
+        values = np.concatenate([values, medians])
+        series += [f"median:{x}" for x in groups]
+        labels += [f"Median: {x}" for x in groups]
+        kinds += ['Peer-group median'] * len(groups)
+    df = cube.get_frame(values, series, [metric])
+    df['LABEL'] = df['SERIES'].map(dict(zip(series, labels)))
+    df['KIND'] = df['SERIES'].map(dict(zip(series, kinds)))
+    return df.rename(columns={'SERIES': 'INSTID'})
+
+## settings of the "similar colleges" search of the View page
+similar_top_k = 10
+similar_min_overlap = 0.5 ## minimum fraction of the query's feature weights that a college must also have values for
+
+## define SimilarityIndex class to find the colleges nearest to a college over the standardized qts features
+## (the distance is the weighted root mean squared difference over the features both colleges have, so that
+##  missing values are skipped rather than imputed; the per-query weights and missing values rule out a
+##  static KD-tree, so the squared distance is expanded into three matrix-vector products over precomputed arrays)
+class SimilarityIndex:
+    def __init__(self, df, features=None):
+        self.features = list(qts.keys()) if features is None else list(features)
+        values = df[self.features].to_numpy(dtype=float)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) ## all-NaN features
+            mean = np.nanmean(values, axis=0)
+            std = np.nanstd(values, axis=0)
+        std[~(std > 0)] = 1.0
+        z = (values - mean) / std
+        present = ~np.isnan(z)
+        self.z = np.where(present, z, 0.0).astype(np.float32)  ## standardized values (0 where missing)
+        self.z2 = self.z ** 2
+        self.present = present.astype(np.float32)              ## 1 where present, 0 where missing
+
+    ## positions of the k colleges nearest to the college at position, and their distances
+    def get_similar(self, position, weights=None, k=similar_top_k, min_overlap=similar_min_overlap):
+        w = np.ones(len(self.features)) if weights is None else np.asarray(weights, dtype=float)
+        w = (w * self.present[position]).astype(np.float32)
+        if w.sum() <= 0:
+            return np.array([], dtype=int), np.array([])
+        zq = self.z[position]
+        ## sum_j w_j p_ij (z_ij - zq_j)^2, and the weight of the features the college has
+        num = self.z2 @ w - 2 * (self.z @ (w * zq)) + self.present @ (w * zq ** 2)
+        den = self.present @ w
+        valid = den >= min_overlap * w.sum()
+        valid[position] = False
+        dist = np.full(len(den), np.inf)
+        dist[valid] = np.sqrt(np.maximum(num[valid], 0) / den[valid], dtype=float)
+        k = min(k, int(valid.sum()))
+        if k == 0:
+            return np.array([], dtype=int), np.array([])
+        nearest = np.argpartition(dist, k - 1)[:k]
+        nearest = nearest[np.argsort(dist[nearest], kind='stable')]
+        return nearest, dist[nearest]
+
+## the similarity index is read-only and shared across sessions
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_similarity_index(version):
+    df_wide = load_data(version)[0]
+    return SimilarityIndex(df_wide)
+
+## performance instrumentation: timings are always collected, payload sizes only when enabled
+## (set COLLEGE_GUIDE_PERF_LOG to a file to write every sample as a JSON line,
+##  and COLLEGE_GUIDE_PERF_DEBUG=1 or open a page with ?debug=1 to show the statistics in the sidebar)
+perf_window = 1000 ## number of recent samples kept per (page, stage, metric)
+perf_payloads = os.environ.get("COLLEGE_GUIDE_PERF_PAYLOADS", "0") == "1"
+perf_debug = os.environ.get("COLLEGE_GUIDE_PERF_DEBUG", "0") == "1"
+perf_logger = logging.getLogger("college_guide.perf")
+if os.environ.get("COLLEGE_GUIDE_PERF_LOG") and not perf_logger.handlers:
+    perf_logger.addHandler(logging.FileHandler(os.environ["COLLEGE_GUIDE_PERF_LOG"]))
+    perf_logger.setLevel(logging.INFO)
+    perf_logger.propagate = False
+
+## define PerfStats class to keep rolling samples per (page, stage, metric) across sessions
+class PerfStats:
+    def __init__(self, window=perf_window):
+        self.window = window
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def record(self, page, stage, metric, value):
+        key = (page, stage, metric)
+        with self.lock:
+            if key not in self.samples:
+                self.samples[key] = collections.deque(maxlen=self.window)
+            self.samples[key].append(value)
+        if perf_logger.isEnabledFor(logging.INFO):
+            perf_logger.info(json.dumps({'ts': time.time(), 'page': page, 'stage': stage, 'metric': metric, 'value': value}))
+
+    ## count, p50, p95, p99 and max of the recent samples (optionally of a single page)
+    def get_summary(self, page=None):
+        with self.lock:
+            items = [(key, list(values)) for key, values in self.samples.items() if page is None or key[0] == page]
+        rows = []
+        for (page_name, stage, metric), values in sorted(items):
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            rows.append({'page': page_name, 'stage': stage, 'metric': metric, 'count': len(values),
+                         'p50': p50, 'p95': p95, 'p99': p99, 'max': max(values)})
+        return pd.DataFrame(rows, columns=['page', 'stage', 'metric', 'count', 'p50', 'p95', 'p99', 'max'])
+
+## the statistics are shared by all sessions of the process
+@st.cache_resource
+def get_perf_stats():
+    return PerfStats()
+
+## whether a timed callback is running in the current thread
+timed_callback_state = threading.local()
+
+## decorator to time a widget callback (the stage is the name of the callback)
+## (only the outermost callback is recorded, as its time includes the timed callbacks it calls)
+def timed_callback(page):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if getattr(timed_callback_state, 'active', False):
+                return func(*args, **kwargs)
+            timed_callback_state.active = True
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                timed_callback_state.active = False
+                get_perf_stats().record(page, "callback." + func.__name__, 'ms', (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorator
+
+## number of bytes of a frame (as Arrow IPC, like st.dataframe) or a chart (as its JSON spec) sent to the frontend
+def get_payload_size(payload):
+    if isinstance(payload, pd.DataFrame):
+        import pyarrow as pa
+        sink = pa.BufferOutputStream()
+        table = pa.Table.from_pandas(payload)
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().size
+    return len(payload.to_json().encode())
+
+## define PerfTimer class to time the render stages of a page rerun
+## (each lap() records the time since the previous lap, finish() records the whole rerun)
+class PerfTimer:
+    def __init__(self, page):
+        self.page = page
+        self.stats = get_perf_stats()
+        self.start = self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.stats.record(self.page, "render." + stage, 'ms', (now - self.last) * 1000)
+        self.last = now
+
+    ## record the serialized size of a frame or chart, if payload measurement is enabled
+    ## (the time spent measuring is excluded from the current stage)
+    def payload(self, stage, payload):
+        if perf_payloads or is_perf_debug():
+            start = time.perf_counter()
+            self.stats.record(self.page, "payload." + stage, 'bytes', get_payload_size(payload))
+            self.last += time.perf_counter() - start
+
+    ## record the bytes held in the session state by the page (and, when debugging, the bytes of a reference)
+    def session(self, values, reference=None):
+        self.stats.record(self.page, "session", 'bytes', get_session_bytes(values))
+        if reference is not None and is_perf_debug():
+            self.stats.record(self.page, "session.reference", 'bytes', reference())
+
+    def finish(self):
+        self.stats.record(self.page, 'rerun', 'ms', (time.perf_counter() - self.start) * 1000)
+        if is_perf_debug():
+            show_perf_sidebar(self.page)
+
+## approximate number of bytes held by session state values (arrays, frames, and containers of them)
+def get_session_bytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(np.sum(value.memory_usage(index=True, deep=True)))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_session_bytes(x) for x in value.values())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(get_session_bytes(x) for x in value)
+    return sys.getsizeof(value)
+
+def is_perf_debug():
+    return perf_debug or st.query_params.get("debug") == "1"
+
+## show the rolling statistics of the page in the sidebar
+def show_perf_sidebar(page):
+    ex_perf = st.sidebar.expander("Performance statistics", expanded=True)
+    ex_perf.dataframe(get_perf_stats().get_summary(page).drop(columns='page'), hide_index=True)
+    ex_perf.caption(f"Rolling statistics over the last {perf_window} samples of this server process.")
+    status = get_warmup_status()
+    ex_perf.caption(f"Warm-up: {status['state']}" + (f" in {status['seconds']:.2f}s" if status['seconds'] is not None else "")
+                    + "".join(f", {x} {t:.2f}s" for x, t in status['stages'].items()))
+    if status['load']:
+        ex_perf.caption("Load stages: " + ", ".join(f"{x} {t:.2f}s" for x, t in status['load'].items()))
+
+## project df to the given chart fields only (and optionally to the given rows),
+## so that the chart spec does not embed the other columns
+def get_chart_frame(df, fields, positions=None):
+    df = df[list(dict.fromkeys(fields))]
+    return to_display_frame(df if positions is None else df.iloc[positions])
+
+## 2D histogram of (xaxis, yaxis) over df as one row per non-empty bin (x, x2, y, y2, count)
+def build_density_bins(df, xaxis, yaxis, num_bins=chart_density_bins):
+    x = df[xaxis].to_numpy(dtype=float)
+    y = df[yaxis].to_numpy(dtype=float)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    counts, xedges, yedges = np.histogram2d(x[valid], y[valid], bins=num_bins)
+    xi, yi = np.nonzero(counts)
+    return pd.DataFrame({
+        'x': xedges[xi], 'x2': xedges[xi + 1],
+        'y': yedges[yi], 'y2': yedges[yi + 1],
+        'count': counts[xi, yi].astype(int),
+    })
+
+## the bins of each (x, y) axis pair over df_wide are computed once and shared across sessions
+@st.cache_resource(max_entries=256)
+def load_density_bins(version, xaxis, yaxis):
+    df_wide = load_data(version)[0]
+    return build_density_bins(df_wide, xaxis, yaxis)
+
+## define TableSorter class to sort any selection of df_wide rows without re-sorting
+## (the stable sort order of each column, missing values last, is computed once on first use)
+class TableSorter:
+    def __init__(self, df):
+        self.df = df
+        self.orders = {}
+
+    def get_order(self, colname):
+        if colname not in self.orders:
+            col = self.df[colname].reset_index(drop=True)
+            order = col.sort_values(kind='stable', na_position='last').index.to_numpy()
+            self.orders[colname] = (order, int(col.notna().sum()))
+        return self.orders[colname]
+
+    ## positions of the selected rows (a boolean mask over df) in sorted order
+    def get_sorted_positions(self, mask, colname, ascending=True):
+        order, num_valid = self.get_order(colname)
+        if not ascending:
+            order = np.concatenate([order[:num_valid][::-1], order[num_valid:]])
+        return order[mask[order]]
+
+## the sort orders are shared across sessions
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_table_sorter(version):
+    df_wide = load_data(version)[0]
+    return TableSorter(df_wide)
+
+## metrics shown by default in the group statistics of the Filter page, and the quantiles computed
+group_stats_metrics = ['cost__tuition__out_of_state', 'earnings__10_yrs_after_entry__median', 'admissions__sat_scores__average__overall']
+group_stats_quantiles = (0.25, 0.5, 0.75)
+
+## define GroupStats class to compute per-group counts and quantiles of any selection of df_wide rows without re-sorting
+## (the rows of each (group column, metric) are sorted once by group, then by value, missing values excluded,
+##  so that the k-th selected value of a group is found with a cumulative count of the selection)
+class GroupStats:
+    def __init__(self, df):
+        self.df = df
+        self.codes = {}
+        self.sorted_groups = {}
+
+    ## group codes of the rows (-1 if missing) and the names of the groups
+    def get_codes(self, colname):
+        if colname not in self.codes:
+            col = self.df[colname]
+            if not isinstance(col.dtype, pd.CategoricalDtype):
+                col = col.astype('category')
+            self.codes[colname] = (col.cat.codes.to_numpy(), list(col.cat.categories))
+        return self.codes[colname]
+
+    ## rows sorted by group then value, their values, and the start of each group (plus the end of the last one)
+    def get_sorted_groups(self, colname, metric):
+        key = (colname, metric)
+        if key not in self.sorted_groups:
+            codes, categories = self.get_codes(colname)
+            values = self.df[metric].to_numpy(dtype=float)
+            valid = np.flatnonzero((codes >= 0) & ~np.isnan(values))
+            order = valid[np.lexsort((values[valid], codes[valid]))]
+            starts = np.searchsorted(codes[order], np.arange(len(categories) + 1))
+            self.sorted_groups[key] = (order, values[order], starts)
+        return self.sorted_groups[key]
+
+    ## per group of colname with selected rows (a boolean mask over df): the number of selected colleges, and for each
+    ## metric the number of selected colleges reporting it and the quantiles of their values (interpolated as np.quantile)
+    def get_stats(self, mask, colname, metrics, quantiles=group_stats_quantiles):
+        codes, categories = self.get_codes(colname)
+        colleges = np.bincount(codes[mask & (codes >= 0)], minlength=len(categories))
+        groups = np.flatnonzero(colleges)
+        quantiles = np.asarray(quantiles, dtype=float)
+        columns = {'group': [], 'colleges': [], 'metric': [], 'count': [], 'stats': []}
+        for metric in metrics:
+            order, values, starts = self.get_sorted_groups(colname, metric)
+            ## selected[i] is the number of selected rows among order[:i]
+            selected = np.concatenate([[0], np.cumsum(mask[order])])
+            base = selected[starts[groups]]
+            counts = selected[starts[groups + 1]] - base
+            last = np.maximum(counts - 1, 0)[:, None]
+            ranks = last * quantiles
+            lo = np.floor(ranks).astype(np.int64)
+            hi = np.minimum(lo + 1, last)
+            stats = np.full((len(groups), len(quantiles)), np.nan)
+            if len(values):
+                ## position in order of the (rank + 1)-th selected value of each group
+                pos_lo = np.clip(np.searchsorted(selected, base[:, None] + lo + 1) - 1, 0, len(values) - 1)
+                pos_hi = np.clip(np.searchsorted(selected, base[:, None] + hi + 1) - 1, 0, len(values) - 1)
+                stats = values[pos_lo] + (values[pos_hi] - values[pos_lo]) * (ranks - lo)
+                stats[counts == 0] = np.nan
+            columns['group'].append(np.asarray(categories, dtype=object)[groups])
+            columns['colleges'].append(colleges[groups])
+            columns['metric'].append(np.full(len(groups), metric, dtype=object))
+            columns['count'].append(counts)
+            columns['stats'].append(stats)
+        stats = columns.pop('stats')
+        stats = np.concatenate(stats) if stats else np.zeros((0, len(quantiles)))
+        frame = {x: np.concatenate(v) if v else [] for x, v in columns.items()}
+        frame.update({f"p{100 * q:g}": stats[:, i] for i, q in enumerate(quantiles)})
+        return pd.DataFrame(frame)
+
+## the sorted groups are shared across sessions
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_group_stats(version):
+    df_wide = load_data(version)[0]
+    return GroupStats(df_wide)
+
+## compile the data dictionary into a compact lookup:
+## field name -> (label, type, source column), source column -> field name, the code fields and the null codes
+def compile_field_catalog(fname):
+    import yaml ## only needed when the data dictionary changed
+    with open(fname) as fh:
+        data = yaml.load(fh, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+    fields = {}
+    by_source = {}
+    codes = []
+    for name, entry in data['dictionary'].items():
+        ## the label is the first line of the description (the other lines list the codes of categorical fields)
+        label, _, code_lines = str(entry.get('description') or name).strip().partition("\n")
+        fields[name] = (label.strip(), entry.get('type'), entry.get('source'))
+        if catalog_code_name_re.search(name) or label.startswith("Flag ") or catalog_code_line_re.search(code_lines):
+            codes.append(name)
+        ## fields mapped from other files (e.g. programs) share the source names of the institution fields
+        if entry.get('source') and 'map' not in entry:
+            by_source.setdefault(entry['source'], name)
+    return {
+        'version': str(data.get('version')),
+        'null_values': [str(x) for x in data.get('null_value', [])],
+        'fields': fields,
+        'by_source': by_source,
+        'codes': codes,
+    }
+
+## hash the data dictionary (and the catalog version) into a short key
+## (memoized on the size and modification time of the file, like get_source_fingerprint())
+catalog_fingerprints = {}
+def get_catalog_fingerprint():
+    key = (dictf, os.stat(dictf).st_size, os.stat(dictf).st_mtime_ns)
+    if key not in catalog_fingerprints:
+        h = hashlib.sha256(f"catalog_v{catalog_version}".encode())
+        with open(dictf, 'rb') as fh:
+            h.update(fh.read())
+        catalog_fingerprints[key] = h.hexdigest()[:16]
+    return catalog_fingerprints[key]
+
+## load the compiled catalog, compiling the data dictionary only when it changed since the last build
+## (the catalog is read once per process and version of the data dictionary)
+loaded_catalogs = {}
+def load_catalog_data(rebuild=False):
+    fingerprint = get_catalog_fingerprint()
+    if not rebuild:
+        if fingerprint in loaded_catalogs:
+            return loaded_catalogs[fingerprint]
+        try:
+            with open(catalog_file, 'rb') as fh:
+                catalog = pickle.load(fh)
+            if catalog.get('fingerprint') == fingerprint:
+                loaded_catalogs[fingerprint] = catalog
+                return catalog
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+    catalog = compile_field_catalog(dictf)
+    catalog['fingerprint'] = fingerprint
+    tmp_file = f"{catalog_file}.tmp{os.getpid()}"
+    try:
+        with open(tmp_file, 'wb') as fh:
+            pickle.dump(catalog, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, catalog_file)
+    except OSError as e:
+        print(f"WARNING: could not write field catalog {catalog_file}: {e}", file=sys.stderr)
+    loaded_catalogs[fingerprint] = catalog
+    return catalog
+
+## define FieldCatalog class to look up the College Scorecard fields
+## (by field name, e.g. student.size, by column name in df_wide, e.g. student__size, or by source, e.g. UGDS)
+class FieldCatalog:
+    def __init__(self, catalog):
+        self.version = catalog['version']
+        self.null_values = catalog['null_values']
+        self.fields = catalog['fields']
+        self.by_source = catalog['by_source']
+        self.codes = set(catalog['codes'])
+
+    def get_field(self, name):
+        name = name.replace("__", ".")
+        if name not in self.fields:
+            name = self.by_source.get(name, name)
+        if name not in self.fields:
+            return None
+        label, type, source = self.fields[name]
+        return {'name': name, 'label': label, 'type': type, 'source': source, 'code': name in self.codes, 'null_values': self.null_values}
+
+    def get_label(self, name, default=None):
+        field = self.get_field(name)
+        return field['label'] if field else (name if default is None else default)
+
+    ## whether the field is loaded as a numeric field (a measure, not an identifier or a code)
+    def is_numeric(self, name):
+        field = self.get_field(name)
+        return field is not None and field['type'] in catalog_numeric_types and not field['code']
+
+## the field catalog is shared across sessions
+@st.cache_resource(show_spinner=False)
+def load_field_catalog():
+    return FieldCatalog(load_catalog_data())
+
+## labels of the numeric columns of df_wide: the curated qts first, then the other data dictionary fields
+@st.cache_resource(max_entries=2, show_spinner=False)
+def load_field_labels(version):
+    df_wide = load_data(version)[0]
+    catalog = load_field_catalog()
+    colnames = list(oths.keys()) + list(cats.keys()) + list(qts.keys())
+    labels = dict(qts)
+    labels.update({x: catalog.get_label(x) for x in df_wide.columns if x not in colnames})
+    return labels
+
+## startup warm-up: load the data and the derived indexes in a background thread as soon as the server starts
+## (college_guide_serve.py starts it before the server accepts connections, and the landing page starts it on
+##  the first run otherwise), so that the first request does not pay for loading; the readiness can be served
+## on a separate port for health checks (GET /ready answers 200 once warm, 503 before)
+## (the loaders it calls have no spinner: a spinner outside of a script run logs a missing ScriptRunContext warning)
+warmup_imports = ['altair', 'pydeck'] ## imported by the pages, so imported ahead of time too
+ready_port = int(os.environ.get("COLLEGE_GUIDE_READY_PORT", "0"))
+warmup_lock = threading.Lock()
+warmup_status = {'state': 'idle', 'version': None, 'stages': {}, 'load': {}, 'seconds': None, 'error': None}
+
+def get_warmup_status():
+    with warmup_lock:
+        return dict(warmup_status, stages=dict(warmup_status['stages']), load=dict(warmup_status['load']))
+
+def is_ready():
+    return warmup_status['state'] == 'ready'
 
-    ## calculate percentiles
-    df_wide_pct = df_wide.rank(pct=True) * 100
+## load everything the pages load, with the same arguments, so that the pages hit the caches
+## (the derived structures only depend on the data, so they are built concurrently once it is loaded)
+def get_warmup_stages(version):
+    return [
+        ('imports', lambda: [importlib.import_module(x) for x in warmup_imports], []),
+        ('load_data', lambda: load_data(version), []),
+        ('filter_engine', lambda data: load_filter_engine(version, filter_cat_columns, filter_range_columns), ['load_data']),
+        ('field_labels', lambda data: load_field_labels(version), ['load_data']),
+        ('map_data', lambda data: [load_map_data(version), load_map_index(version).get_cells(map_initial_view['zoom'])], ['load_data']),
+        ('table_sorter', lambda data: load_table_sorter(version), ['load_data']),
+        ('group_stats', lambda data: [load_group_stats(version).get_sorted_groups('region', x) for x in group_stats_metrics], ['load_data']),
+        ('percentiles', lambda data: load_percentiles(version), ['load_data']),
+        ('search_index', lambda data: load_search_index(version), ['load_data']),
+        ('metric_cube', lambda data: [load_metric_cube(version).get_group_medians(x) for x in peer_groups], ['load_data']),
+        ('similarity_index', lambda data: load_similarity_index(version), ['load_data']),
+        ('query_engine', lambda data: load_query_engine(version), ['load_data']),
+    ]
 
-    ## add color key
-    color_key = 'public'
-    df_wide['col'] = [color_maps[color_key][x] for x in df_wide[color_key]]
-    df_wide['radius'] = np.sqrt(df_wide['student__size']) * 125
+def run_warmup():
+    def on_stage(name, seconds):
+        with warmup_lock:
+            warmup_status['stages'][name] = seconds
+    try:
+        version = read_data_version()
+        with warmup_lock:
+            warmup_status.update(state='loading', version=version)
+        start = time.perf_counter()
+        run_pipeline(get_warmup_stages(version), on_stage=on_stage)
+        with warmup_lock:
+            warmup_status.update(state='ready', seconds=time.perf_counter() - start, load=dict(load_timings))
+    except Exception as e:
+        with warmup_lock:
+            warmup_status.update(state='failed', error=repr(e))
+        print(f"WARNING: warm-up failed: {e!r}", file=sys.stderr)
 
-    ## load tall-formatted data
-    df_tall = pd.read_csv(tallf, sep="\t", compression='gzip')
-    df_tall = df_tall[~((df_tall['COLUMN'].str.startswith('UGDS_')) & (df_tall['YEAR'] < 2011))]
-    #df_tall = df_tall[~((df_tall['COLUMN'].str.startswith('UGDS_')) & (df_tall['YEAR'] < 2011)) | df_tall['INSTID'].isin(ids_to_remove)]
+## start the warm-up thread (and the readiness server if a port is given), once per process
+def start_warmup(port=None):
+    with warmup_lock:
+        if warmup_status['state'] != 'idle':
+            return
+        warmup_status['state'] = 'starting'
+    threading.Thread(target=run_warmup, name="college_guide_warmup", daemon=True).start()
+    port = ready_port if port is None else port
+    if port:
+        start_ready_server(port)
 
-    return df_wide, df_wide_pct, df_tall
+def start_ready_server(port):
+    import http.server
+    class ReadyHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/ready', '/'):
+                self.send_error(404)
+                return
+            body = json.dumps(get_warmup_status()).encode()
+            self.send_response(200 if is_ready() else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, format, *args):
+            pass
+    try:
+        server = http.server.ThreadingHTTPServer(('', port), ReadyHandler)
+    except OSError as e:
+        ## e.g. the port is taken by another server process of the host; the warm-up goes on without it
+        print(f"WARNING: could not serve the readiness on port {port}: {e}", file=sys.stderr)
+        return None
+    threading.Thread(target=server.serve_forever, name="college_guide_ready", daemon=True).start()
+    return server
@@ -3,7 +3,6 @@ import pandas as pd
 import numpy as np
 import pydeck as pdk
 import altair as alt
-import yaml
 import os, sys, math
 import college_guide_shared as cgs
 
@@ -12,9 +11,12 @@ pd.options.mode.chained_assignment = None
 
 ## Set the default page layout to wide
 st.set_page_config(layout="wide") 
+perf_timer = cgs.PerfTimer('filter')
 
-## load data (just once)
-df_wide, df_wide_pct, df_tall = cgs.load_data()
+## load data (just once per published data version)
+data_version = cgs.get_data_version()
+df_wide, df_tall = cgs.load_data(data_version)
+perf_timer.lap('load_data')
 
 ## define CheckBoxGroup class to create multiple checkboxes
 class CheckBoxGroup:
@@ -29,56 +31,146 @@ class CheckBoxGroup:
         for i in range (len(self.values)):
             with cols[i // num_rows]:
                 self.chk.append(st.checkbox(self.values[i],
-                    value=True, on_change = update_func, key = self.prefix + '_' + str(i)))
+                    value=True, on_change = update_func, args = (self.name,), key = self.prefix + '_' + str(i)))
         st.session_state.chk_dict[self.name] = self
 
     ## this function is called inside the update_filter() function to get the selected items
     def get_selected_list(self):
-        # scan chk_tier_0, ... chk_tier_N to see which values are selected
-        chk_selected = []
-        for i in range(len(self.values)):
-            if st.session_state[self.prefix + '_' + str(i)]:
-                chk_selected.append(self.values[i])
-        return chk_selected
+        return get_chk_selected(self.name)
 
     ## function to reset everything to default (all checkboxes are selected)
     def reset(self):
         for i in range(len(self.values)):
             st.session_state[self.prefix + '_' + str(i)] = True
 
-def update_filter():
-    # scan chk_tier_0, ... chk_tier_N to see which values are selected
-    name2selected = {}
-    for name in st.session_state.chk_dict:
-        chk_box_grp = st.session_state.chk_dict[name]
-        chk_selected = chk_box_grp.get_selected_list()
-        name2selected[name] = chk_selected
+## the checkbox groups, and the keys of all filtering widgets
+chk_groups = ['region', 'type', 'barrons']
+filter_widgets = chk_groups + ['multi_states'] + sorted(cgs.slider_dict) + ['extra_field']
 
-    df = df_wide 
-    ## filter by checkboxes and multiselects first
-    df_filt =  df[ (df['region'].isin(name2selected['region'])) &
-                    (df['type'].isin(name2selected['type'])) &
-                    (df['barrons'].isin(name2selected['barrons'])) &
-                    (df['state'].isin(st.session_state.multi_states))]
+## scan chk_<name>_0, ... chk_<name>_N to see which values are selected (the checkboxes may not be created yet)
+def get_chk_selected(name):
+    values = st.session_state.uniq_vals[name]
+    return [values[i] for i in range(len(values)) if st.session_state.get('chk_' + name + '_' + str(i), True)]
 
-    ## filter by sliders    
+## compute the mask of a single filtering widget (None if it does not filter anything)
+## (all the values of a checkbox group or of the states select every college, also those without a value)
+def get_widget_mask(key):
+    if key in chk_groups:
+        selected = get_chk_selected(key)
+        if len(selected) == len(st.session_state.uniq_vals[key]):
+            return None
+        return filter_engine.get_value_mask(key, selected)
+    if key == 'multi_states':
+        states = st.session_state.get('multi_states', st.session_state.uniq_vals['state'])
+        if set(states) == set(st.session_state.uniq_vals['state']):
+            return None
+        return filter_engine.get_value_mask('state', states)
+    if key == 'extra_field':
+        return get_extra_field_mask()
+    colname, minval, maxval = slider_dict[key]
+    lo, hi = st.session_state.get(key, (minval, maxval))
+    if lo <= minval and hi >= maxval:
+        return None
+    if minval == 0 and maxval == 100:
+        lo, hi = lo/100, hi/100
+    return filter_engine.get_range_mask(colname, lo, hi)
+
+## canonical form of the widget state: a sorted tuple of (name, values) pairs for the widgets not at their defaults,
+## so that identical states share the cached results, whatever the order in which they were set
+def get_filter_spec():
+    spec = {}
+    for name in chk_groups:
+        selected = get_chk_selected(name)
+        if len(selected) < len(st.session_state.uniq_vals[name]):
+            spec[name] = tuple(selected)
+    states = st.session_state.get('multi_states', st.session_state.uniq_vals['state'])
+    if set(states) != set(st.session_state.uniq_vals['state']):
+        spec['state'] = tuple(sorted(states))
     for key in slider_dict:
         colname, minval, maxval = slider_dict[key]
-        if st.session_state[key][0] > minval or st.session_state[key][1] < maxval:
-            if minval == 0 and maxval == 100:
-                df_filt = df_filt[
-                            (df_filt[colname] >= st.session_state[key][0]/100) &
-                            (df_filt[colname] <= st.session_state[key][1]/100)
-                            ]
-            else:
-                df_filt = df_filt[
-                            (df_filt[colname] >= st.session_state[key][0]) &
-                            (df_filt[colname] <= st.session_state[key][1])
-                            ]
+        lo, hi = st.session_state.get(key, (minval, maxval))
+        if lo > minval or hi < maxval:
+            spec[key] = (lo, hi)
+    field = st.session_state.get('extra_field')
+    if field is not None:
+        spec['field'] = (field,)
+        if get_extra_field_mask() is not None:
+            spec['field_range'] = tuple(st.session_state['extra_range__' + field])
+    if st.session_state.map_color_key != filter_default_color:
+        spec['color'] = (st.session_state.map_color_key,)
+    return tuple(sorted(spec.items()))
 
+## the part of the spec that selects the colleges
+def get_criteria_spec(spec):
+    return tuple(x for x in spec if x[0] != 'color')
 
-    st.session_state.df_filt = df_filt
+## set the widget state from the query parameters of a shared link (the values that do not apply are ignored,
+## so filter_param_none, which is not a value of any column, selects none)
+def apply_filter_params(params):
+    for name in chk_groups:
+        if name in params:
+            selected = params.get_all(name)
+            for i, value in enumerate(st.session_state.uniq_vals[name]):
+                st.session_state['chk_' + name + '_' + str(i)] = value in selected
+    if 'state' in params:
+        st.session_state.multi_states = [x for x in st.session_state.uniq_vals['state'] if x in params.get_all('state')]
+    for key in slider_dict:
+        colname, minval, maxval = slider_dict[key]
+        values = get_float_params(params, key)
+        if values is not None:
+            st.session_state[key] = tuple(type(minval)(min(max(x, minval), maxval)) for x in values)
+    field = params.get('field')
+    if field in extra_fields and get_extra_field_range(field) is not None:
+        st.session_state.extra_field = field
+        minval, maxval = get_extra_field_range(field)
+        values = get_float_params(params, 'field_range')
+        if values is not None:
+            st.session_state['extra_range__' + field] = tuple(min(max(x, minval), maxval) for x in values)
+    color = params.get('color')
+    if color in cgs.color_map_desc:
+        st.session_state.map_color_key = color
+        st.session_state.map_color_desc = cgs.color_map_desc[color]
 
+## a (min, max) pair of a query parameter (None if it is not a valid range)
+def get_float_params(params, name):
+    try:
+        values = [float(x) for x in params.get_all(name)]
+    except ValueError:
+        return None
+    if len(values) != 2 or values[0] > values[1]:
+        return None
+    return tuple(values)
+
+## write the spec to the query parameters, so that the link can be shared (the other parameters are kept)
+## (an empty list of values would be dropped from the URL, so "none selected" is written as filter_param_none)
+def set_filter_params(spec):
+    spec = dict(spec)
+    for name in chk_groups + ['state'] + sorted(slider_dict) + ['field', 'field_range', 'color']:
+        if name in spec:
+            values = [str(x) for x in spec[name]] or [filter_param_none]
+            if st.query_params.get_all(name) != values:
+                st.query_params[name] = values
+        elif name in st.query_params:
+            del st.query_params[name]
+
+## AND the masks of the filtering widgets (a widget's mask is recomputed only after it changed)
+def get_selection():
+    for key in filter_widgets:
+        if key not in st.session_state.filter_masks:
+            st.session_state.filter_masks[key] = cgs.pack_mask(get_widget_mask(key))
+    return cgs.pack_mask(filter_engine.combine_masks(st.session_state.filter_masks.values()))
+
+## invalidate the mask of the changed widget (or of all widgets), and look up the selection of the new spec
+## (the masks and the selection are kept as bitmasks over the shared df_wide, not as copies of its rows,
+##  and the selection is computed only if no session has selected the same colleges recently)
+@cgs.timed_callback('filter')
+def update_filter(widget = None):
+    for key in (filter_widgets if widget is None else [widget]):
+        st.session_state.filter_masks.pop(key, None)
+    criteria = get_criteria_spec(get_filter_spec())
+    st.session_state.filter_selection = filter_cache.get(('selection', criteria), get_selection)
+
+@cgs.timed_callback('filter')
 def update_reset():
     for key in slider_dict:
         colname, minval, maxval = slider_dict[key]
@@ -86,50 +178,87 @@ def update_reset():
     for name in st.session_state.chk_dict:
         chk_box_grp = st.session_state.chk_dict[name]
         chk_box_grp.reset()
+    st.session_state.extra_field = None
     update_filter()
 
+## range of the values of a data dictionary field, for its slider (None if the field has no values)
+def get_extra_field_range(field):
+    values, order = filter_engine.get_sorted_values(field)
+    if len(values) == 0 or values[0] == values[-1]:
+        return None
+    return float(values[0]), float(values[-1])
+
+## mask of the additional criterion on a data dictionary field (None if no field is selected, or the full range is)
+def get_extra_field_mask():
+    field = st.session_state.get('extra_field')
+    if field is None or st.session_state.get('extra_range__' + field) is None:
+        return None
+    lo, hi = st.session_state['extra_range__' + field]
+    minval, maxval = get_extra_field_range(field)
+    if lo <= minval and hi >= maxval:
+        return None
+    return filter_engine.get_range_mask(field, lo, hi)
+
+@cgs.timed_callback('filter')
 def update_map_color_desc():
     for key in cgs.color_map_desc:
         if cgs.color_map_desc[key] == st.session_state.map_color_desc:
-            color_key = key 
-    st.session_state.df_filt['col'] = [cgs.color_maps[color_key][x] for x in st.session_state.df_filt[color_key]]
-
-## create a dictionary that contains name, min, max values for each metric for slider
-slider_dict = {
-    'a0_slider_sat_avg': ['admissions__sat_scores__average__overall', 400, 1600],
-    'a1_slider_act_mid': ['admissions__act_scores__midpoint__cumulative', 1, 36],
-    'a2_slider_admit_rate': ['admissions__admission_rate__overall', 0, 100],
-    'b0_slider_white': ['student__demographics__race_ethnicity__white', 0, 100],
-    'b1_slider_black': ['student__demographics__race_ethnicity__black', 0, 100],
-    'b2_slider_hispanic': ['student__demographics__race_ethnicity__hispanic', 0, 100],
-    'b3_slider_asian': ['student__demographics__race_ethnicity__asian', 0, 100],
-    'b4_slider_nra': ['student__demographics__race_ethnicity__non_resident_alien', 0, 100],
-
-    'c0_slider_tuition_in_state' : ['cost__tuition__in_state', 0, 100000],
-    'c1_slider_tuition_out_of_state' : ['cost__tuition__out_of_state', 0, 100000],
-    'c2_slider_pell_grant_state' : ['aid__pell_grant_rate', 0, 100],
-    'd0_slider_earning_10yrs' : ['earnings__10_yrs_after_entry__median', 0, 200000],
-    'd1_slider_par_median' : ['par_median', 0, 200000],
-    'e0_slider_female' : ['female', 0, 100],
-    'e1_slider_k_married' : ['k_married', 0, 100],
-    'e2_student_size' : ['student__size', 0, 20000],
-} 
+            st.session_state.map_color_key = key
+
+## name, min, max values for each metric for slider
+slider_dict = cgs.slider_dict
+filter_default_color = 'public'
+filter_param_none = '-'
+
+## labels of the numeric fields (the curated metrics, and the other fields of the data dictionary)
+field_labels = cgs.load_field_labels(data_version)
+extra_fields = [x for x in field_labels if x not in cgs.qts]
+
+## precomputed masks and sorted values for the filtering widgets (shared across sessions)
+filter_engine = cgs.load_filter_engine(data_version, cgs.filter_cat_columns, cgs.filter_range_columns)
+## selections and prepared payloads of recent filter specs (shared across sessions)
+filter_cache = cgs.load_filter_cache(data_version)
 
 if 'uniq_vals' not in st.session_state:
-    uniq_vals = {}
-    uniq_vals_keys = ['tier_name', 'barrons', 'type', 'state', 'region']
-    for key in uniq_vals_keys:
-        uniq_vals[key] = sorted(list(df_wide[key].unique()))
-    st.session_state['uniq_vals'] = uniq_vals
+    st.session_state['uniq_vals'] = cgs.get_filter_options(df_wide)
 
 ## Initialize session variables
-## create an initially filtered data and store in the session.
-if 'df_filt' not in st.session_state:
-    st.session_state['df_filt'] = df_wide #st.session_state.df_wide
-
 if 'chk_dict' not in st.session_state:
     st.session_state.chk_dict = {}
 
+if 'map_color_key' not in st.session_state:
+    st.session_state.map_color_key = filter_default_color
+
+## cached mask of each filtering widget, so that a change only recomputes that widget's mask
+if 'filter_masks' not in st.session_state:
+    st.session_state.filter_masks = {}
+
+## the selected rows of df_wide, as a bitmask (initially the colleges selected by the link, or all colleges)
+if 'filter_selection' not in st.session_state:
+    apply_filter_params(st.query_params)
+    update_filter()
+
+## when a new data version is published, evaluate the current selection again on the new data
+## (the checkboxes and states are reset if their values changed)
+if st.session_state.get('filter_data_version', data_version) != data_version:
+    uniq_vals = cgs.get_filter_options(df_wide)
+    if uniq_vals != st.session_state.uniq_vals:
+        for key in [x for x in st.session_state if x.startswith('chk_') or x == 'multi_states']:
+            del st.session_state[key]
+        st.session_state.chk_dict = {}
+        st.session_state.uniq_vals = uniq_vals
+    st.session_state.filter_masks = {}
+    update_filter()
+st.session_state.filter_data_version = data_version
+
+## the spec of the current widget state, also kept in the URL
+filter_spec = get_filter_spec()
+filter_criteria = get_criteria_spec(filter_spec)
+set_filter_params(filter_spec)
+
+## positions of the selected rows in df_wide, from which the map, chart and table are built
+filt_positions = np.flatnonzero(cgs.unpack_mask(st.session_state.filter_selection, len(df_wide)))
+
 # Title of the application
 st.title(f"{cgs.app_name} - Filter")
 
@@ -137,7 +266,7 @@ st.title(f"{cgs.app_name} - Filter")
 
 col1, col2 = st.columns([1, 1])
 with col1:
-    col1.markdown(f"#### Currently, {st.session_state.df_filt.shape[0]} colleges are selected.")
+    col1.markdown(f"#### Currently, {len(filt_positions)} colleges are selected.")
 with col2:
     expander = col2.expander("See explanation")
     expander.markdown("* Selected colleges are shown in the map below.")
@@ -145,21 +274,30 @@ with col2:
     expander.markdown("* Use the dropdown menu on the right to change the colors")
     expander.markdown("* Filtering criteria can be selected below the map")
 
-expander_map = st.expander(f"Hide/show the map of {st.session_state.df_filt.shape[0]} colleges", expanded=True)
+expander_map = st.expander(f"Hide/show the map of {len(filt_positions)} colleges", expanded=True)
+## the map is culled to the chosen view, and clustered when many colleges are in view
+map_index = cgs.load_map_index(data_version)
+col1, col2 = expander_map.columns([2, 1])
+with col1:
+    map_state = col1.selectbox('Map view', st.session_state.uniq_vals['state'], index=None, placeholder='United States (zoom in to a state)',
+                               key = 'map_state', label_visibility='collapsed')
+map_view = map_index.get_view(map_state)
+map_frame, map_clustered = filter_cache.get(('map', filter_spec, map_state),
+    lambda: map_index.get_layer_frame(filt_positions, st.session_state.map_color_key, map_view, cgs.load_map_data(data_version)))
 r = pdk.Deck(
     map_style=None,
     initial_view_state=pdk.ViewState(
-        latitude=37.76,
-        longitude=-100.4,
-        zoom=3.5,
+        latitude=map_view['latitude'],
+        longitude=map_view['longitude'],
+        zoom=map_view['zoom'],
         pitch=0,
     ),
     layers=[
         pdk.Layer(
             'ScatterplotLayer',
-            data = st.session_state.df_filt.fillna(""),
+            data = map_frame,
             get_position='[lon, lat]',
-            get_fill_color='col',
+            get_fill_color='[col_r, col_g, col_b, col_a]',
             get_line_color='[0, 0, 0]',
             get_radius='radius',
             line_width_min_pixels=100,
@@ -167,22 +305,25 @@ r = pdk.Deck(
         ),
     ],
     tooltip={
-        'html': '<b>Name:</b> {name} ({school__city}, {school__state})<br/><b>Barrons Selectivity:</b> {barrons}<br/><b>Type:</b> {public}, {iclevel} <br/><b>Student Size:</b> {student__size}<br/><b>SAT / ACT:</b> {admissions__sat_scores__average__overall} / {admissions__act_scores__midpoint__cumulative}<br/><b>Acceptance Rate:</b> {admissions__admission_rate__overall}<br/><b>In/Out-State Tuitions: </b> ${cost__tuition__in_state} / ${cost__tuition__out_of_state}',
+        'html': '{tooltip}',
         'style': {
             'color': 'white'
         }
     },
 )
-col1, col2 = expander_map.columns([2, 1])
 with col2:
     col2.selectbox('Colors', [cgs.color_map_desc[x] for x in sorted(cgs.color_maps)], 
                  key = 'map_color_desc', on_change = update_map_color_desc, 
                  label_visibility='collapsed', index=2)
+perf_timer.payload('map', r)
 expander_map.pydeck_chart(r)
+if map_clustered:
+    expander_map.caption(f"{len(map_frame)} clusters of colleges are shown (colored by their most common category). Choose a state to see the individual colleges.")
+perf_timer.lap('map')
 
 sliders = {}
 
-expander_filt = st.expander(f"Hide/show criteria for filtering {st.session_state.df_filt.shape[0]} colleges", expanded=True)
+expander_filt = st.expander(f"Hide/show criteria for filtering {len(filt_positions)} colleges", expanded=True)
 expander_filt.button('Reset All', key = 'reset_all', on_click = update_reset)
 col1, col2, col3 = expander_filt.columns([1, 1, 3])
 with col1:
@@ -198,21 +339,36 @@ with col3:
 col1, col2, col3 = expander_filt.columns([2, 2, 2],gap="small")
 slider_keys = sorted(slider_dict)
 with col1:
-    multi_states = col1.multiselect("**States**", st.session_state.uniq_vals['state'], default=st.session_state.uniq_vals['state'], key = "multi_states", on_change = update_filter)
+    multi_states = col1.multiselect("**States**", st.session_state.uniq_vals['state'], default=st.session_state.uniq_vals['state'], key = "multi_states", on_change = update_filter, args = ("multi_states",))
 with col2:
     for i in range((len(slider_keys)+1)//2):
         col2.slider(cgs.qts[slider_dict[slider_keys[i]][0]], 
                     min_value=slider_dict[slider_keys[i]][1], 
                     max_value=slider_dict[slider_keys[i]][2], 
                     value=(slider_dict[slider_keys[i]][1], slider_dict[slider_keys[i]][2]), 
-                    key = slider_keys[i], on_change = update_filter)
+                    key = slider_keys[i], on_change = update_filter, args = (slider_keys[i],))
 with col3:
     for i in range((len(slider_keys)+1)//2,len(slider_keys)):
         col3.slider(cgs.qts[slider_dict[slider_keys[i]][0]], 
                     min_value=slider_dict[slider_keys[i]][1], 
                     max_value=slider_dict[slider_keys[i]][2], 
                     value=(slider_dict[slider_keys[i]][1], slider_dict[slider_keys[i]][2]), 
-                    key = slider_keys[i], on_change = update_filter)
+                    key = slider_keys[i], on_change = update_filter, args = (slider_keys[i],))
+
+## an additional range criterion on any numeric field of the data dictionary
+with col1:
+    extra_field = col1.selectbox("**More criteria**", extra_fields, format_func=lambda x: field_labels[x], index=None,
+                                 placeholder="Choose a field from the College Scorecard data dictionary",
+                                 key = "extra_field", on_change = update_filter, args = ("extra_field",))
+    if extra_field is not None:
+        extra_range = get_extra_field_range(extra_field)
+        if extra_range is None:
+            col1.caption("No range of values is available for this field.")
+        else:
+            col1.slider(field_labels[extra_field], min_value=extra_range[0], max_value=extra_range[1], value=extra_range,
+                        key = "extra_range__" + extra_field, on_change = update_filter, args = ("extra_field",))
+
+perf_timer.lap('widgets')
 
 def foo(widget_instance, payload):
     print(f"{widget_instance} clicked with payload {payload}")
@@ -220,34 +376,99 @@ def foo(widget_instance, payload):
 expander_chart = st.expander(f"Hide/show chart", expanded=True)
 col1, col2, col3 = expander_chart.columns(3)
 with col1:
-    xaxis = col1.selectbox("X-axis", cgs.qts.keys(), format_func=lambda x: cgs.qts[x], index=0)
+    xaxis = col1.selectbox("X-axis", field_labels.keys(), format_func=lambda x: field_labels[x], index=0)
 with col2:
-    yaxis = col2.selectbox("Y-axis", cgs.qts.keys(), format_func=lambda x: cgs.qts[x], index=1)
+    yaxis = col2.selectbox("Y-axis", field_labels.keys(), format_func=lambda x: field_labels[x], index=1)
 with col3:
     group = col3.selectbox("Group", cgs.cats.keys(), format_func=lambda x: cgs.cats[x], index=3)
-chart = alt.Chart(df_wide).mark_circle().encode(
-    x = alt.X(xaxis, axis=alt.Axis(title=cgs.qts[xaxis])),
-    y = alt.Y(yaxis, axis=alt.Axis(title=cgs.qts[yaxis])),
-    opacity = alt.value(0.1),
-    color = alt.value("gray"),
-    tooltip=[alt.Tooltip('name', title='College Name')])
-df_filt_rename = st.session_state.df_filt
-chart_change = alt.Chart(df_filt_rename).mark_point().encode(
-    x = alt.X(xaxis, axis=alt.Axis(title=cgs.qts[xaxis])),
-    y = alt.Y(yaxis, axis=alt.Axis(title=cgs.qts[yaxis])),
+## background layer: all colleges, as 2D bins when there are too many points to draw
+if len(df_wide) > cgs.chart_density_threshold:
+    chart = alt.Chart(cgs.load_density_bins(data_version, xaxis, yaxis)).mark_rect().encode(
+        x = alt.X('x', bin='binned', axis=alt.Axis(title=field_labels[xaxis])),
+        x2 = 'x2',
+        y = alt.Y('y', bin='binned', axis=alt.Axis(title=field_labels[yaxis])),
+        y2 = 'y2',
+        opacity = alt.Opacity('count', scale=alt.Scale(range=[0.05, 0.5]), legend=None),
+        color = alt.value("gray"),
+        tooltip=[alt.Tooltip('count', title='Number of Colleges')])
+else:
+    chart = alt.Chart(cgs.get_chart_frame(df_wide, [xaxis, yaxis, 'name'])).mark_circle().encode(
+        x = alt.X(xaxis, axis=alt.Axis(title=field_labels[xaxis])),
+        y = alt.Y(yaxis, axis=alt.Axis(title=field_labels[yaxis])),
+        opacity = alt.value(0.1),
+        color = alt.value("gray"),
+        tooltip=[alt.Tooltip('name', title='College Name')])
+df_filt_chart = filter_cache.get(('chart', filter_criteria, xaxis, yaxis, group),
+    lambda: cgs.get_chart_frame(df_wide, [xaxis, yaxis, group] + list(cgs.filter_chart_tooltips), filt_positions))
+chart_change = alt.Chart(df_filt_chart).mark_point().encode(
+    x = alt.X(xaxis, axis=alt.Axis(title=field_labels[xaxis])),
+    y = alt.Y(yaxis, axis=alt.Axis(title=field_labels[yaxis])),
     color = alt.Color(group, legend=alt.Legend(title=cgs.cats[group],labelLimit=500)),
-    tooltip = [alt.Tooltip('name', title='College Name'),
-                alt.Tooltip('admissions__sat_scores__average__overall', title='Average SAT'),
-                alt.Tooltip('tier_name', title='College Tier'),
-                alt.Tooltip('admissions__admission_rate__overall', title='Acceptance Rate'),
-                alt.Tooltip('school__tuition_revenue_per_fte', title='Tuition Revenue per Student'),
-                alt.Tooltip('earnings__10_yrs_after_entry__median', title='Median Earnings 10 years after Entry')
-              ]
+    tooltip = [alt.Tooltip(x, title=cgs.filter_chart_tooltips[x]) for x in cgs.filter_chart_tooltips]
 )
 
-expander_chart.altair_chart(alt.layer(chart,chart_change).interactive(), theme="streamlit", use_container_width=True)
+chart_layers = alt.layer(chart,chart_change).interactive()
+perf_timer.payload('chart', chart_layers)
+expander_chart.altair_chart(chart_layers, theme="streamlit", use_container_width=True)
+perf_timer.lap('chart')
+
+# Display the statistics of the selected colleges per group (from the presorted groups, shared across sessions)
+group_stats = cgs.load_group_stats(data_version)
+stats_labels = {'colleges': 'Colleges', 'metric': 'Metric', 'count': 'Reporting',
+                **{f"p{100 * q:g}": "Median" if q == 0.5 else f"{100 * q:g}th percentile" for q in cgs.group_stats_quantiles}}
+
+expander_stats = st.expander(f"Hide/show statistics by group", expanded=True)
+col1, col2 = expander_stats.columns([1, 3])
+with col1:
+    stats_group = col1.selectbox("Group by", cgs.cats.keys(), format_func=lambda x: cgs.cats[x], index=list(cgs.cats).index('region'), key='stats_group')
+with col2:
+    stats_metrics = col2.multiselect("Metrics", cgs.qts.keys(), default=cgs.group_stats_metrics, format_func=lambda x: cgs.qts[x], key='stats_metrics')
+df_stats = filter_cache.get(('stats', filter_criteria, stats_group, tuple(stats_metrics)),
+    lambda: group_stats.get_stats(cgs.unpack_mask(st.session_state.filter_selection, len(df_wide)), stats_group, stats_metrics))
+df_stats = df_stats.assign(metric=df_stats['metric'].map(cgs.qts)).rename(columns={'group': cgs.cats[stats_group], **stats_labels})
+
+perf_timer.payload('stats', df_stats)
+expander_stats.dataframe(df_stats, hide_index=True)
+expander_stats.caption("Reporting is the number of selected colleges of the group with a value of the metric.")
+perf_timer.lap('stats')
+
+# Display the table of universities (one page of rows at a time, sorted on the server)
+table_labels = {**cgs.oths, **cgs.cats, **field_labels}
+table_default_columns = ['name', 'school__city', 'school__state', 'barrons', 'tier_name', 'student__size',
+                         'admissions__sat_scores__average__overall', 'admissions__admission_rate__overall',
+                         'cost__tuition__out_of_state', 'earnings__10_yrs_after_entry__median']
+table_sorter = cgs.load_table_sorter(data_version)
 
-# Display the table of universities
 expander_table = st.expander(f"Hide/show table", expanded=True)
 expander_table.markdown("### Full List of Selected Colleges")
-expander_table.dataframe(st.session_state.df_filt)
\ No newline at end of file
+col1, col2, col3, col4 = expander_table.columns([4, 2, 1, 1])
+with col1:
+    table_columns = col1.multiselect("Columns", list(table_labels), default=table_default_columns,
+                                     format_func=lambda x: table_labels[x], key='table_columns')
+with col2:
+    sort_column = col2.selectbox("Sort by", list(table_labels), format_func=lambda x: table_labels[x], key='table_sort_column')
+with col3:
+    sort_ascending = col3.radio("Order", [True, False], format_func=lambda x: "Ascending" if x else "Descending", key='table_sort_ascending')
+with col4:
+    page_size = col4.selectbox("Rows per page", [25, 50, 100, 250], key='table_page_size')
+
+sorted_positions = filter_cache.get(('table', filter_criteria, sort_column, sort_ascending),
+    lambda: table_sorter.get_sorted_positions(cgs.unpack_mask(st.session_state.filter_selection, len(df_wide)), sort_column, sort_ascending))
+num_pages = max(1, math.ceil(len(sorted_positions) / page_size))
+if st.session_state.get('table_page', 1) > num_pages:
+    st.session_state.table_page = num_pages
+table_page = expander_table.number_input(f"Page (of {num_pages})", min_value=1, max_value=num_pages, step=1, key='table_page')
+page_positions = sorted_positions[(table_page - 1) * page_size : table_page * page_size]
+df_table = cgs.to_display_frame(df_wide.iloc[page_positions][table_columns]).rename(columns=table_labels)
+
+perf_timer.payload('table', df_table)
+expander_table.dataframe(df_table, hide_index=True)
+expander_table.caption(f"Showing colleges {(table_page - 1) * page_size + min(1, len(page_positions))}-{(table_page - 1) * page_size + len(page_positions)} of {len(sorted_positions)}")
+perf_timer.lap('table')
+## memory held by this session's selection, compared with a copy of the selected rows (shown when debugging)
+perf_timer.session([st.session_state.filter_selection, st.session_state.filter_masks],
+                   reference=lambda: cgs.get_session_bytes(df_wide.iloc[filt_positions]))
+if cgs.is_perf_debug():
+    cache_stats = filter_cache.get_stats()
+    st.sidebar.caption(f"Filter cache: {cache_stats['entries']} entries ({cache_stats['bytes'] / 1e6:.1f} MB), {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+perf_timer.finish()
@@ -1,25 +1,51 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import pydeck as pdk
-import yaml
 import altair as alt
 import os, sys, math
 import college_guide_shared as cgs
 pd.options.mode.chained_assignment = None
 
 st.set_page_config(layout="wide") # Set the page layout to wide
+perf_timer = cgs.PerfTimer('view')
 
-## load the data just once across the app
-df_wide, df_wide_pct, df_tall = cgs.load_data()
+## load the data just once across the app (per published data version)
+data_version = cgs.get_data_version()
+df_wide, df_tall = cgs.load_data(data_version)
+## percentiles are computed on demand for the displayed metrics
+percentiles = cgs.load_percentiles(data_version)
+## server-side search, so that only the top matches are sent to the browser
+search_index = cgs.load_search_index(data_version)
+## dense (college x metric x year) values of the charts
+metric_cube = cgs.load_metric_cube(data_version)
+## nearest neighbors over the standardized metrics
+similarity_index = cgs.load_similarity_index(data_version)
+## prepared metrics and chart frames of the recently viewed colleges (shared across sessions)
+view_cache = cgs.load_view_cache(data_version)
+perf_timer.lap('load_data')
 
 ## change the session variables when the college is selected
+@cgs.timed_callback('view')
 def update_college():
-    idx = df_wide[df_wide['name'] == st.session_state.select_college].index[0]
+    idx = st.session_state.select_college
+    if idx is None:
+        return
+    st.session_state.selected_position = idx
     st.session_state.selected_wide = df_wide.iloc[idx]
-    st.session_state.selected_pct = df_wide_pct.iloc[idx]
     st.session_state.selected_id = st.session_state.selected_wide['id']
-    st.session_state.selected_tall = df_tall[df_tall['INSTID'] == st.session_state.selected_id]
+
+## when a new data version is published, show the selected college from the new data
+## (it is looked up by id: a refresh keeps the positions, but regenerated source files may not)
+if st.session_state.get('view_data_version', data_version) != data_version and 'selected_id' in st.session_state:
+    position = cgs.load_query_engine(data_version).get_positions(st.session_state.selected_id)[0]
+    if position >= 0:
+        st.session_state.selected_position = int(position)
+        st.session_state.selected_wide = df_wide.iloc[position]
+    else:
+        for key in ['selected_position', 'selected_wide', 'selected_id']:
+            del st.session_state[key]
+    st.session_state.pop('select_college', None)
+st.session_state.view_data_version = data_version
 
 # Title of the application
 st.title(f"{cgs.app_name} - View")
@@ -31,81 +57,142 @@ with col1:
     col1.markdown("#### Select or enter college name.")
 with col2:
     expander = col2.expander("See explanation")
-    expander.markdown("* Enter a college name in the dropdown menu below.")
-    expander.markdown("* Or select a college from the dropdown menu.")
+    expander.markdown("* Search for a college by its name, acronym (e.g. MIT) or city/state.")
+    expander.markdown("* Then select the college from the dropdown menu.")
     expander.markdown("* Once a college is selected, the information will be displayed below.")
 
-select_college = st.selectbox('Select/Enter a University Name', df_wide['name'].unique(), key = 'select_college', on_change = update_college)
+search_college = st.text_input('Search for a University', key = 'search_college')
+select_college = st.selectbox('Select a University', search_index.search(search_college), format_func = search_index.get_label,
+                              index = None, key = 'select_college', on_change = update_college)
+
+def get_pct(df, name):
+    return percentiles.get_percentile(name, df[name])
 
 def get_metric_str(df, name, frac2percent=False):
     if np.isnan(df[name]):
         return "unavailable"
     elif frac2percent:
-        return f"{100*df[name]:,.1f}% ( {st.session_state.selected_pct[name]:.1f} percentile )"
+        return f"{100*df[name]:,.1f}% ( {get_pct(df, name):.1f} percentile )"
     else:
-        return f"{df[name]:,.0f} ( {st.session_state.selected_pct[name]:.1f} percentile )"
+        return f"{df[name]:,.0f} ( {get_pct(df, name):.1f} percentile )"
+
+## metrics shown in the key information, and whether they are fractions (shown as percentages)
+view_metrics = {
+    'student__size': False,
+    'admissions__sat_scores__average__overall': False,
+    'admissions__act_scores__midpoint__cumulative': False,
+    'admissions__admission_rate__overall': True,
+    'cost__tuition__in_state': False,
+    'cost__tuition__out_of_state': False,
+    'school__tuition_revenue_per_fte': False,
+    'school__instructional_expenditure_per_fte': False,
+    'aid__pell_grant_rate': True,
+    'par_median': False,
+    'student__demographics__race_ethnicity__white': True,
+    'student__demographics__race_ethnicity__black': True,
+    'student__demographics__race_ethnicity__hispanic': True,
+    'student__demographics__race_ethnicity__asian': True,
+    'student__demographics__race_ethnicity__non_resident_alien': True,
+    'female': True,
+    'completion__rate_suppressed__four_year': True,
+    'earnings__10_yrs_after_entry__median': False,
+}
+
+## formatted metrics (with their percentiles) of a college
+def build_view_metrics(position):
+    row = df_wide.iloc[position]
+    metric_strs = {name: get_metric_str(row, name, frac2percent) for name, frac2percent in view_metrics.items()}
+    for name in ['par_top1pc', 'mr_kq5_pq1']:
+        metric_strs[name] = f"{row[name]:,.1f}% ( {get_pct(row, name):.1f} percentile )"
+    return metric_strs
+
+## chart frames of a college, one per chart group
+def build_view_charts(position, peer_group):
+    return {key: cgs.get_view_chart_frame(metric_cube, position, colnames, peer_group)
+            for key, colnames in cgs.view_chart_groups.items()}
 
 if 'selected_wide' in st.session_state:
     cur_wide = st.session_state.selected_wide
-    cur_tall = st.session_state.selected_tall
+    cur_position = st.session_state.selected_position
+    metric_strs = view_cache.get(('metrics', cur_position), lambda: build_view_metrics(cur_position))
 
-    st.markdown(f"#### You selected : {st.session_state.select_college}")
-    ex_key = st.expander(f"Hide/Show Key Information of {st.session_state.select_college}", expanded=True)
+    st.markdown(f"#### You selected : {cur_wide['name']}")
+    ex_key = st.expander(f"Hide/Show Key Information of {cur_wide['name']}", expanded=True)
     col1, col2 = ex_key.columns([1, 1])
     with col1:
         col1.markdown(f"##### Basic Information")
         col1.markdown(f"* ***{cur_wide['tier_name']}*** college")
         col1.markdown(f"* Located in ***{cur_wide['school__city']}, {cur_wide['school__state']}***")
         col1.markdown(f"* Offers a ***{cur_wide['iclevel']}*** program.")
-        col1.markdown(f"* The number of enrolled student is ***{get_metric_str(cur_wide, 'student__size')}***")
+        col1.markdown(f"* The number of enrolled student is ***{metric_strs['student__size']}***")
         col1.markdown("")
         col1.markdown(f"##### Selectivity")
         col1.markdown(f"* Classified as '***{cur_wide['barrons']}***' by the Barron's Selectivity index")
-        col1.markdown(f"* Average SAT-equivalent score is ***{get_metric_str(cur_wide,'admissions__sat_scores__average__overall')}***.")
-        col1.markdown(f"* Median ACT score is ***{get_metric_str(cur_wide,'admissions__act_scores__midpoint__cumulative')}***.")
-        col1.markdown(f"* Admission rate is ***{get_metric_str(cur_wide,'admissions__admission_rate__overall',frac2percent=True)}***.")
+        col1.markdown(f"* Average SAT-equivalent score is ***{metric_strs['admissions__sat_scores__average__overall']}***.")
+        col1.markdown(f"* Median ACT score is ***{metric_strs['admissions__act_scores__midpoint__cumulative']}***.")
+        col1.markdown(f"* Admission rate is ***{metric_strs['admissions__admission_rate__overall']}***.")
         col1.markdown("")
         col1.markdown(f"##### Financial Aspects")
-        col1.markdown(f"* In-state tution & fee is ***${get_metric_str(cur_wide,'cost__tuition__in_state')}***.")
-        col1.markdown(f"* Out-of-state tution & fee is ***${get_metric_str(cur_wide,'cost__tuition__out_of_state')}***.")
-        col1.markdown(f"* Net tuition revenue per student is ***${get_metric_str(cur_wide,'school__tuition_revenue_per_fte')}***.")
-        col1.markdown(f"* Instructional expenditure per student is ***${get_metric_str(cur_wide,'school__instructional_expenditure_per_fte')}***.")
-        col1.markdown(f"* About ***{get_metric_str(cur_wide,'aid__pell_grant_rate',frac2percent=True)}*** of students receive Pell Grant.")  
-        col1.markdown(f"* The median parent household income is ***${get_metric_str(cur_wide,'par_median')}***.")
-        col1.markdown(f"* About ***{cur_wide['par_top1pc']:,.1f}% ( {st.session_state.selected_pct['par_top1pc']:.1f} percentile )*** are from households with top 1% income.")
+        col1.markdown(f"* In-state tution & fee is ***${metric_strs['cost__tuition__in_state']}***.")
+        col1.markdown(f"* Out-of-state tution & fee is ***${metric_strs['cost__tuition__out_of_state']}***.")
+        col1.markdown(f"* Net tuition revenue per student is ***${metric_strs['school__tuition_revenue_per_fte']}***.")
+        col1.markdown(f"* Instructional expenditure per student is ***${metric_strs['school__instructional_expenditure_per_fte']}***.")
+        col1.markdown(f"* About ***{metric_strs['aid__pell_grant_rate']}*** of students receive Pell Grant.")  
+        col1.markdown(f"* The median parent household income is ***${metric_strs['par_median']}***.")
+        col1.markdown(f"* About ***{metric_strs['par_top1pc']}*** are from households with top 1% income.")
     with col2:
         col2.markdown(f"##### Demographic Distribution")
-        col2.markdown(f"* About ***{get_metric_str(cur_wide,'student__demographics__race_ethnicity__white',frac2percent=True)}*** are White.")  
-        col2.markdown(f"* About ***{get_metric_str(cur_wide,'student__demographics__race_ethnicity__black',frac2percent=True)}*** are Black.")  
-        col2.markdown(f"* About ***{get_metric_str(cur_wide,'student__demographics__race_ethnicity__hispanic',frac2percent=True)}*** are Hispanics.")  
-        col2.markdown(f"* About ***{get_metric_str(cur_wide,'student__demographics__race_ethnicity__asian',frac2percent=True)}*** are Asians.")  
-        col2.markdown(f"* About ***{get_metric_str(cur_wide,'student__demographics__race_ethnicity__non_resident_alien',frac2percent=True)}*** are international students.") 
-        col2.markdown(f"* About ***{get_metric_str(cur_wide,'female',frac2percent=True)}*** are females.")  
+        col2.markdown(f"* About ***{metric_strs['student__demographics__race_ethnicity__white']}*** are White.")  
+        col2.markdown(f"* About ***{metric_strs['student__demographics__race_ethnicity__black']}*** are Black.")  
+        col2.markdown(f"* About ***{metric_strs['student__demographics__race_ethnicity__hispanic']}*** are Hispanics.")  
+        col2.markdown(f"* About ***{metric_strs['student__demographics__race_ethnicity__asian']}*** are Asians.")  
+        col2.markdown(f"* About ***{metric_strs['student__demographics__race_ethnicity__non_resident_alien']}*** are international students.") 
+        col2.markdown(f"* About ***{metric_strs['female']}*** are females.")  
         col2.markdown("")
         col2.markdown(f"##### Expected Outcome")
-        col2.markdown(f"* Graduation rate (within 6 years) is ***{get_metric_str(cur_wide,'completion__rate_suppressed__four_year',frac2percent=True)}***.")
-        col2.markdown(f"* Median income after 10 years of entry is ***${get_metric_str(cur_wide,'earnings__10_yrs_after_entry__median')}***.")
-        col2.markdown(f"* Mobility rate is ***{cur_wide['mr_kq5_pq1']:,.1f}% ( {st.session_state.selected_pct['mr_kq5_pq1']:.1f} percentile )*** (i.e. student reach top 20% income given parents had bottom 20% income).")
-
-    chart_groups = {
-        "SAT Scores": ['SATCM25','SATCM75','SATCMMID'],
-        "ACT Scores": ['ACTCM25','ACTCM75','ACTCMMID'],
-        "Tuition and Fees": ['TUITIONFEE_IN','TUITIONFEE_OUT','TUITFTE'],
-        "Degree Distribution": ['PCIP01','PCIP04','PCIP11','PCIP13','PCIP14','PCIP26','PCIP27','PCIP45','PCIP50','PCIP51','PCIP52'],
-        "Demographic Distribution": ['UGDS_WHITE','UGDS_BLACK','UGDS_HISP','UGDS_ASIAN','UGDS_AIAN','UGDS_NHPI','UGDS_2MOR','UGDS_NRA','UGDS_UNKN'],
-        "Median Income": ['MD_EARN_WNE_P10','MD_EARN_WNE_P8','MD_EARN_WNE_P6'],
-    }
-
-    ex_chart = st.expander(f"Hide/Show Charts of {st.session_state.select_college}", expanded=True)
+        col2.markdown(f"* Graduation rate (within 6 years) is ***{metric_strs['completion__rate_suppressed__four_year']}***.")
+        col2.markdown(f"* Median income after 10 years of entry is ***${metric_strs['earnings__10_yrs_after_entry__median']}***.")
+        col2.markdown(f"* Mobility rate is ***{metric_strs['mr_kq5_pq1']}*** (i.e. student reach top 20% income given parents had bottom 20% income).")
+
+    perf_timer.lap('key_info')
+
+    chart_groups = cgs.view_chart_groups
+
+    ex_chart = st.expander(f"Hide/Show Charts of {cur_wide['name']}", expanded=True)
+    peer_group = ex_chart.selectbox("Compare with the median of", cgs.peer_groups, format_func=lambda x: cgs.cats[x],
+                                    index=None, placeholder="No peer group", key='view_peer_group')
+    chart_frames = view_cache.get(('charts', cur_position, peer_group), lambda: build_view_charts(cur_position, peer_group))
     for key in chart_groups.keys():
-        colnames = chart_groups[key]
-        chart = alt.Chart(
-                cur_tall[cur_tall.COLUMN.isin(colnames)].replace(
-                    {'COLUMN' : {x:cgs.lts[x] for x in colnames} }
-                )
-            ).mark_line(point=True).encode(
+        chart = alt.Chart(chart_frames[key]).mark_line(point=True).encode(
             x = alt.X('YEAR', axis=alt.Axis(format='d')),
             y = alt.Y('VALUE', axis=alt.Axis(title=key)),
             color = alt.Color('COLUMN', legend=alt.Legend(title='Types',labelLimit=500)),
+            strokeDash = alt.StrokeDash('SERIES', legend=alt.Legend(title='Series',labelLimit=500)),
         )
-        ex_chart.altair_chart(alt.layer(chart).interactive(), theme="streamlit", use_container_width=True)
\ No newline at end of file
+        perf_timer.payload('chart', chart)
+        ex_chart.altair_chart(alt.layer(chart).interactive(), theme="streamlit", use_container_width=True)
+    perf_timer.lap('charts')
+
+    ## colleges nearest to the selected one, with user-adjustable weights of the metrics
+    ex_similar = st.expander(f"Hide/Show Colleges Similar to {cur_wide['name']}", expanded=True)
+    col1, col2 = ex_similar.columns([3, 1])
+    col1.markdown("Colleges with the closest metrics (standardized, skipping the metrics a college does not report). Set a weight to 0 to ignore a metric.")
+    num_similar = col2.selectbox("Number of colleges", [5, 10, 20, 50], index=1, key='similar_k')
+    popover_weights = ex_similar.popover("Adjust the weights of the metrics")
+    weight_cols = popover_weights.columns(3)
+    similar_weights = []
+    for i, colname in enumerate(similarity_index.features):
+        similar_weights.append(weight_cols[i % 3].slider(cgs.qts[colname], min_value=0.0, max_value=3.0, value=1.0, step=0.5,
+                                                         key='similar_weight__' + colname))
+    similar_positions, similar_dists = similarity_index.get_similar(cur_position, similar_weights, num_similar)
+    df_similar = cgs.to_display_frame(df_wide.iloc[similar_positions][['name', 'school__city', 'school__state', 'tier_name', 'barrons']])
+    df_similar['distance'] = similar_dists.round(3)
+    df_similar = df_similar.rename(columns={**cgs.oths, **cgs.cats, 'distance': 'Distance'})
+    perf_timer.payload('similar', df_similar)
+    ex_similar.dataframe(df_similar, hide_index=True)
+    perf_timer.lap('similar')
+
+if cgs.is_perf_debug():
+    cache_stats = view_cache.get_stats()
+    st.sidebar.caption(f"View cache: {cache_stats['entries']} entries ({cache_stats['bytes'] / 2**20:.1f} MB), {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+perf_timer.finish()
@@ -1,8 +1,5 @@
 import streamlit as st
 import pandas as pd
-import numpy as np
-import pydeck as pdk
-import yaml
 import altair as alt
 import os, sys, math
 import college_guide_shared as cgs
@@ -10,23 +7,46 @@ import college_guide_shared as cgs
 pd.options.mode.chained_assignment = None
 
 st.set_page_config(layout="wide") # Set the page layout to wide
+perf_timer = cgs.PerfTimer('compare')
 
-## load the data just onces
-df_wide, df_wide_pct, df_tall = cgs.load_data()
+## load the data just onces (per published data version)
+data_version = cgs.get_data_version()
+df_wide, df_tall = cgs.load_data(data_version)
+## server-side search, so that only the top matches are sent to the browser
+search_index = cgs.load_search_index(data_version)
+## dense (college x metric x year) values of the chart
+metric_cube = cgs.load_metric_cube(data_version)
+perf_timer.lap('load_data')
 
+## positions (in df_wide) of the selected colleges, kept while the search results change
+if 'multiselected_positions' not in st.session_state:
+    st.session_state.multiselected_positions = []
+
+@cgs.timed_callback('compare')
 def update_multi_college():
-    indices = df_wide[df_wide['name'].isin(st.session_state.multiselect_college)].index
-    st.session_state.multiselected_wide = df_wide.iloc[indices]
-    st.session_state.multiselected_ids = st.session_state.multiselected_wide['id']
-    st.session_state.multiselected_tall = df_tall[df_tall['INSTID'].isin(st.session_state.multiselected_ids)]
+    st.session_state.multiselected_positions = list(st.session_state.multiselect_college)
+    st.session_state.multiselected_wide = df_wide.iloc[st.session_state.multiselected_positions]
+    st.session_state.multiselected_ids = st.session_state.multiselected_wide['id'].to_numpy()
     update_metric()
 
 metrics = list(cgs.lts.keys())
 metric_descs = list(cgs.lts.values())
+@cgs.timed_callback('compare')
 def update_metric():
     idx = metric_descs.index(st.session_state.select_metric_desc)
     st.session_state.select_metric = metrics[idx]
 
+## when a new data version is published, show the selected colleges from the new data
+## (they are looked up by id: a refresh keeps the positions, but regenerated source files may not)
+if st.session_state.get('compare_data_version', data_version) != data_version and 'multiselected_ids' in st.session_state:
+    positions = cgs.load_query_engine(data_version).get_positions(st.session_state.multiselected_ids)
+    st.session_state.multiselected_positions = [int(x) for x in positions if x >= 0]
+    st.session_state.multiselected_wide = df_wide.iloc[st.session_state.multiselected_positions]
+    st.session_state.multiselected_ids = st.session_state.multiselected_wide['id'].to_numpy()
+    ## the multiselect is created again from the new positions
+    st.session_state.pop('multiselect_college', None)
+st.session_state.compare_data_version = data_version
+
 # Title of the application
 st.title(f"{cgs.app_name} - Compare")
 
@@ -36,35 +56,46 @@ with col1:
     col1.markdown("#### Select multiple colleges to compare.")
 with col2:
     expander = col2.expander("See explanation")
-    expander.markdown("* Select multiple college names in the dropdown menu below.")
+    expander.markdown("* Search for colleges by name, acronym (e.g. MIT) or city/state, and select them in the dropdown menu below.")
     expander.markdown("* Next, select the metric to compare between the colleges.")
     expander.markdown("* Chart will show the comparison between selected colleges on the selected metric.")
 
-multiselect_college = st.multiselect('Select/Enter a University Name', df_wide['name'].unique(), key = 'multiselect_college', on_change = update_multi_college)
+search_college = st.text_input('Search for a University', key = 'search_college')
+college_options = list(dict.fromkeys(st.session_state.multiselected_positions + search_index.search(search_college).tolist()))
+multiselect_college = st.multiselect('Select Universities', college_options, format_func = search_index.get_label,
+                                     default = st.session_state.multiselected_positions,
+                                     key = 'multiselect_college', on_change = update_multi_college)
 
 st.markdown("#### Select the metric you want to compare between the selected colleges.")
 select_metric = st.selectbox('Select a metric', metric_descs, key = 'select_metric_desc', on_change=update_metric)
+peer_group = st.selectbox("Also show the median of the colleges' peer groups by", cgs.peer_groups, format_func=lambda x: cgs.cats[x],
+                          index=None, placeholder="No peer group", key='compare_peer_group')
 
 if 'multiselected_wide' in st.session_state and 'select_metric' in st.session_state:
     cur_wide = st.session_state.multiselected_wide
-    cur_tall = st.session_state.multiselected_tall
 
     ex_comp = st.expander(f"Hide/show Chart", expanded=True)
 
     ex_comp.markdown(f"#### Comparison between the selected colleges for: {st.session_state.select_metric_desc}")
-    instid2name = dict(zip(cur_wide['id'], cur_wide['name']))
-    df_compare = cur_tall[cur_tall.COLUMN == st.session_state.select_metric].replace(
-                {'INSTID': instid2name}
-            )
+    df_compare = cgs.get_compare_chart_frame(metric_cube, st.session_state.multiselected_positions,
+                                             st.session_state.select_metric,
+                                             [search_index.get_label(x) for x in st.session_state.multiselected_positions], peer_group)
     chart_compare = alt.Chart(
             df_compare
         ).mark_line(point=True).encode(
         x = alt.X('YEAR', axis=alt.Axis(format='d')),
         y = alt.Y('VALUE', axis=alt.Axis(title=st.session_state.select_metric)),
-        color = alt.Color('INSTID', 
+        color = alt.Color('LABEL',
                             legend=alt.Legend(
                                 title='University',
                                 labelLimit=500
                             )),
+        detail = 'INSTID',
+        strokeDash = alt.StrokeDash('KIND', legend=None),
     )
+    perf_timer.payload('chart', chart_compare)
     ex_comp.altair_chart(alt.layer(chart_compare).interactive(), theme="streamlit", use_container_width=True)
+    perf_timer.lap('chart')
+
+perf_timer.finish()
+
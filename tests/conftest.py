@@ -0,0 +1,125 @@
+import os, sys
+import gzip
+import numpy as np
+import pandas as pd
+import pytest
+
+## make the app modules (college_guide_shared, ...) importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import college_guide_shared as cgs
+
+## values of the categorical columns of the synthetic colleges
+category_values = {
+    'tier_name': ['Ivy Plus', 'Highly selective private', 'Selective public', 'Nonselective four-year public'],
+    'type': ['public', 'private non-profit', 'for-profit'],
+    'public': ['public', 'private'],
+    'barrons': ['1 - Elite', '2 - Highly Selective', '3 - Selective', '999 - Non-selective'],
+    'region': ['Midwest', 'Northeast', 'South', 'West'],
+    'czname': ['Boston', 'Chicago', 'Houston', 'San Jose'],
+    'state': ['CA', 'IL', 'MA', 'NY', 'TX'],
+    'iclevel': ['1-year', '2-year', '4-year'],
+}
+
+## synthetic df_wide with the columns and dtypes of the prepared data (about 10% of the metrics are missing)
+def build_wide(num_rows=200, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'id': np.arange(1000, 1000 + num_rows),
+        'name': [f"College {i}" for i in range(num_rows)],
+        'school__name': [f"College {i}" for i in range(num_rows)],
+        'school__city': rng.choice(['Springfield', 'Riverside', 'Franklin'], num_rows),
+    })
+    for colname, values in category_values.items():
+        df[colname] = rng.choice(values, num_rows)
+    df['school__state'] = df['state']
+    df['lon'] = rng.uniform(-122, -71, num_rows)
+    df['lat'] = rng.uniform(26, 48, num_rows)
+    for colname in cgs.qts:
+        values = rng.uniform(0, 1, num_rows)
+        values[rng.random(num_rows) < 0.1] = np.nan
+        df[colname] = values
+    df['admissions__sat_scores__average__overall'] = np.round(df['admissions__sat_scores__average__overall'] * 800 + 800)
+    df['student__size'] = np.round(df['student__size'] * 20000)
+    return df.astype({x: cgs.wide_dtypes[x] for x in df.columns if x in cgs.wide_dtypes})
+
+## synthetic df_tall with every (institution, metric, year), sorted like cgs.parse_data() does
+def build_tall(ids, metrics=('ADM_RATE', 'SAT_AVG'), years=(2019, 2020)):
+    rows = [(instid, metric, year, float(instid % 97 + year)) for instid in ids for metric in sorted(metrics) for year in years]
+    df = pd.DataFrame(rows, columns=['INSTID', 'COLUMN', 'YEAR', 'VALUE'])
+    return df.astype(dict(cgs.tall_dtypes, COLUMN=pd.CategoricalDtype(sorted(metrics))))
+
+@pytest.fixture
+def make_wide():
+    return build_wide
+
+@pytest.fixture
+def make_tall():
+    return build_tall
+
+## a minimal data dictionary: measures, a code field and the null codes
+data_dictionary = """\
+version: test
+null_value:
+- 'NULL'
+- PrivacySuppressed
+dictionary:
+  id:
+    source: UNITID
+    type: integer
+    description: Unit ID for institution
+  school.faculty_salary:
+    source: AVGFACSAL
+    type: integer
+    description: Average faculty salary
+  school.state_fips:
+    source: ST_FIPS
+    type: integer
+    description: FIPS code for state
+  school.men_only:
+    source: MENONLY
+    type: integer
+    description: Flag for men-only college
+    index: tinyint
+  school.degrees_awarded.highest:
+    source: HIGHDEG
+    type: integer
+    description: |-
+      Highest degree awarded
+       0 Non-degree-granting
+       4 Graduate degree
+  school.school_url:
+    source: INSTURL
+    description: URL for institution's homepage
+"""
+
+## write a wide-formatted file with the column names of the source file (e.g. location.lat, student.size)
+def write_wide_file(fname, df):
+    df = df.rename(columns={'lat': 'location.lat', 'lon': 'location.lon'})
+    df.columns = [x.replace("__", ".") for x in df.columns]
+    df.to_csv(fname, sep="\t", index=False)
+
+## write a gzipped tall-formatted file
+def write_tall_file(fname, df):
+    with gzip.open(fname, 'wt') as fh:
+        df.to_csv(fh, sep="\t", index=False)
+
+## point the app to synthetic source files, data dictionary, field catalog and snapshot directory in a temporary directory
+## (returns the directory and the frames written to the source files)
+@pytest.fixture
+def source_files(tmp_path, monkeypatch):
+    df_wide = build_wide(50)
+    df_wide['school__faculty_salary'] = np.arange(len(df_wide)) * 1000.0
+    df_wide['school__state_fips'] = 6
+    df_tall = build_tall(df_wide['id'], metrics=('ADM_RATE', 'SAT_AVG', 'UGDS_WHITE'), years=(2009, 2015, 2020))
+    write_wide_file(tmp_path / "wide.tsv", df_wide)
+    write_tall_file(tmp_path / "tall.tsv.gz", df_tall)
+    (tmp_path / "data.yaml").write_text(data_dictionary)
+    monkeypatch.setattr(cgs, 'widef', str(tmp_path / "wide.tsv"))
+    monkeypatch.setattr(cgs, 'tallf', str(tmp_path / "tall.tsv.gz"))
+    monkeypatch.setattr(cgs, 'dictf', str(tmp_path / "data.yaml"))
+    monkeypatch.setattr(cgs, 'catalog_file', str(tmp_path / "catalog.pickle"))
+    monkeypatch.setattr(cgs, 'loaded_catalogs', {})
+    monkeypatch.setattr(cgs, 'snapshot_dir', str(tmp_path / "snapshot"))
+    monkeypatch.setattr(cgs, 'tall_metrics', ['ADM_RATE', 'SAT_AVG', 'UGDS_WHITE'])
+    os.makedirs(cgs.snapshot_dir)
+    return tmp_path, df_wide, df_tall
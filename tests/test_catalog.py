@@ -0,0 +1,40 @@
+import os
+import college_guide_shared as cgs
+
+## the catalog looks up fields by name, column name or source, and keeps identifiers and codes out of the numeric fields
+def test_compile_field_catalog(source_files):
+    catalog = cgs.FieldCatalog(cgs.load_catalog_data())
+    assert catalog.version == 'test' and catalog.null_values == ['NULL', 'PrivacySuppressed']
+    assert catalog.get_field('school__faculty_salary')['label'] == 'Average faculty salary'
+    assert catalog.get_field('AVGFACSAL')['name'] == 'school.faculty_salary'
+    assert catalog.get_label('school__degrees_awarded__highest') == 'Highest degree awarded'
+    assert catalog.get_label('no_such_field') == 'no_such_field' and catalog.get_field('no_such_field') is None
+    assert catalog.is_numeric('school__faculty_salary')
+    for name in ['id', 'school__state_fips', 'school__men_only', 'school__degrees_awarded__highest', 'school__school_url']:
+        assert not catalog.is_numeric(name), name
+
+## the code fields are not loaded with the other numeric fields of the wide-formatted file
+def test_code_fields_are_not_loaded(source_files):
+    df_wide = cgs.parse_wide_data(cgs.widef)
+    assert 'school__faculty_salary' in df_wide.columns
+    assert 'school__state_fips' not in df_wide.columns
+
+## the compiled catalog is reused (from the process, then from the file) until the data dictionary changes
+def test_catalog_reload(source_files, monkeypatch):
+    tmp_path = source_files[0]
+    catalog = cgs.load_catalog_data()
+    assert os.path.exists(cgs.catalog_file)
+    compile_field_catalog = cgs.compile_field_catalog
+    compiled = []
+    monkeypatch.setattr(cgs, 'compile_field_catalog', lambda fname: compiled.append(fname) or compile_field_catalog(fname))
+    assert cgs.load_catalog_data() is catalog
+    cgs.loaded_catalogs.clear()
+    assert cgs.load_catalog_data() == catalog and compiled == []
+    ## the data dictionary is not read again while it is unchanged
+    with monkeypatch.context() as m:
+        m.setattr(cgs, 'hashlib', None)
+        assert cgs.get_catalog_fingerprint() == catalog['fingerprint']
+    with open(tmp_path / "data.yaml", 'a') as fh:
+        fh.write("  school.new_field:\n    source: NEWFIELD\n    type: float\n    description: New field\n")
+    assert cgs.FieldCatalog(cgs.load_catalog_data()).is_numeric('school__new_field')
+    assert compiled == [cgs.dictf]
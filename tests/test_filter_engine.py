@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import college_guide_shared as cgs
+
+## the boolean filter of the Filter page before the filter engine (checkboxes and states with isin, then the sliders)
+def filter_frame(df, selected, sliders):
+    df_filt = df[df['region'].isin(selected['region']) & df['type'].isin(selected['type']) &
+                 df['barrons'].isin(selected['barrons']) & df['state'].isin(selected['state'])]
+    for key, (lo, hi) in sliders.items():
+        colname, minval, maxval = cgs.slider_dict[key]
+        if lo > minval or hi < maxval:
+            if minval == 0 and maxval == 100:
+                lo, hi = lo/100, hi/100
+            df_filt = df_filt[(df_filt[colname] >= lo) & (df_filt[colname] <= hi)]
+    return df_filt
+
+## the combined masks of random widget states select the same rows as the boolean filter
+@pytest.mark.parametrize('seed', range(5))
+def test_masks_match_boolean_filter(make_wide, seed):
+    df = make_wide(300, seed=seed)
+    df['admissions__admission_rate__overall'] = df['admissions__admission_rate__overall'].round(2)
+    engine = cgs.FilterEngine(df, cgs.filter_cat_columns, cgs.filter_range_columns)
+    rng = np.random.default_rng(seed)
+    selected = {x: [v for v in df[x].cat.categories if rng.random() < 0.7] for x in cgs.filter_cat_columns}
+    sliders = {}
+    for key in rng.choice(sorted(cgs.slider_dict), 3, replace=False):
+        colname, minval, maxval = cgs.slider_dict[key]
+        lo, hi = np.sort(rng.integers(minval, maxval + 1, 2))
+        sliders[key] = (int(lo), int(hi))
+    ## a bound on a value of the column
+    sliders['a2_slider_admit_rate'] = (29, 100)
+
+    masks = [engine.get_value_mask(x, selected[x]) for x in cgs.filter_cat_columns]
+    for key, (lo, hi) in sliders.items():
+        colname, minval, maxval = cgs.slider_dict[key]
+        if minval == 0 and maxval == 100:
+            lo, hi = lo/100, hi/100
+        masks.append(engine.get_range_mask(colname, lo, hi))
+    ## packed masks, as kept in the session state, and None for the widgets at their defaults
+    masks = [cgs.pack_mask(x) for x in masks] + [None]
+    mask = engine.combine_masks(masks)
+    np.testing.assert_array_equal(np.flatnonzero(mask), filter_frame(df, selected, sliders).index.to_numpy())
+
+## missing values never match a range, and unknown values select nothing
+def test_missing_and_unknown_values(make_wide):
+    df = make_wide(100)
+    engine = cgs.FilterEngine(df, ('region',), ())
+    colname = 'student__demographics__race_ethnicity__white'
+    mask = engine.get_range_mask(colname, -np.inf, np.inf)
+    np.testing.assert_array_equal(mask, df[colname].notna().to_numpy())
+    assert not engine.get_value_mask('region', ['Atlantis']).any()
+    assert engine.get_value_mask('region', list(df['region'].cat.categories)).all()
+
+def test_pack_mask_round_trip():
+    mask = np.random.default_rng(0).random(37) < 0.5
+    packed = cgs.pack_mask(mask)
+    assert packed.nbytes == 5
+    np.testing.assert_array_equal(cgs.unpack_mask(packed, len(mask)), mask)
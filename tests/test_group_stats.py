@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import college_guide_shared as cgs
+
+## GroupStats.get_stats() gives the counts of each group and the quantiles of np.quantile, for any selection
+@pytest.mark.parametrize('fraction', [1.0, 0.5, 0.05, 0.0])
+def test_group_stats_match_np_quantile(make_wide, fraction):
+    df = make_wide(500, seed=1)
+    group_stats = cgs.GroupStats(df)
+    mask = np.random.default_rng(2).random(len(df)) < fraction
+    metrics = ['admissions__sat_scores__average__overall', 'admissions__admission_rate__overall']
+    quantiles = (0.1, 0.25, 0.5, 0.75, 1.0)
+    stats = group_stats.get_stats(mask, 'region', metrics, quantiles)
+    selected = df[mask]
+    assert set(stats['group']) == set(selected['region'].unique())
+    for row in stats.itertuples(index=False):
+        rows = selected[selected['region'] == row.group]
+        values = rows[row.metric].dropna().to_numpy(dtype=float)
+        assert row.colleges == len(rows)
+        assert row.count == len(values)
+        expected = np.quantile(values, quantiles) if len(values) else np.full(len(quantiles), np.nan)
+        np.testing.assert_allclose([getattr(row, f"p{100 * q:g}") for q in quantiles], expected)
+
+## colleges without a group are left out, and the default quantiles are those of the Filter page
+def test_group_stats_defaults(make_wide):
+    df = make_wide(100, seed=3)
+    df.loc[:9, 'barrons'] = np.nan
+    stats = cgs.GroupStats(df).get_stats(np.ones(len(df), dtype=bool), 'barrons', cgs.group_stats_metrics)
+    assert stats.groupby('group', observed=True)['colleges'].first().sum() == 90
+    assert list(dict.fromkeys(stats['metric'])) == list(cgs.group_stats_metrics)
+    assert [x for x in stats.columns if x.startswith('p')] == [f"p{100 * q:g}" for q in cgs.group_stats_quantiles]
@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import college_guide_shared as cgs
+
+## the map frame has the positions, radius and tooltip of every college, and the colors of each scheme
+def test_build_map_data(make_wide):
+    df = make_wide(40)
+    df.loc[2, 'student__size'] = np.nan
+    df.loc[3, 'barrons'] = np.nan
+    df.loc[4, 'name'] = "A & B <College>"
+    df_map, row_colors = cgs.build_map_data(df)
+    assert list(df_map.columns) == ['lon', 'lat', 'radius', 'tooltip']
+    ## colleges without a size have radius 0
+    np.testing.assert_allclose(df_map['radius'], np.nan_to_num(np.sqrt(df['student__size'].to_numpy(dtype=float)) * 125))
+    assert df_map['radius'].iloc[2] == 0
+    ## the tooltip of a college, with its values formatted and escaped
+    row = df.iloc[4]
+    assert df_map['tooltip'].iloc[4].startswith(f"<b>Name:</b> A &amp; B &lt;College&gt; ({row['school__city']}, {row['school__state']})")
+    assert f"<b>Student Size:</b> {int(row['student__size'])}<br/>" in df_map['tooltip'].iloc[4]
+    for color_key in cgs.color_maps:
+        expected = [cgs.color_maps[color_key].get(x, cgs.color_missing) for x in df[color_key].astype(object)]
+        np.testing.assert_array_equal(row_colors[color_key], np.array(expected, dtype=np.uint8))
+
+## the frame of the selected rows, colored by the chosen scheme
+def test_get_map_frame(make_wide):
+    df = make_wide(40)
+    map_data = cgs.build_map_data(df)
+    positions = np.array([5, 1, 30])
+    frame = cgs.get_map_frame(positions, 'region', map_data)
+    np.testing.assert_array_equal(frame['lon'], df['lon'].to_numpy(dtype=float)[positions].astype(np.float32).astype(str).astype(float))
+    colors = [cgs.color_maps['region'][x] for x in df['region'].iloc[positions]]
+    np.testing.assert_array_equal(frame[['col_r', 'col_g', 'col_b', 'col_a']].to_numpy(), colors)
+
+## the layer of the nationwide view has a point per selected college in view, while they are at most map_point_limit
+def test_layer_frame_points_under_limit(make_wide):
+    df = make_wide(300)
+    map_index, map_data = cgs.MapIndex(df), cgs.build_map_data(df)
+    positions = np.arange(0, 300, 2)
+    frame, clustered = map_index.get_layer_frame(positions, 'region', map_index.get_view(), map_data)
+    assert not clustered
+    np.testing.assert_array_equal(frame.index, positions)
+
+## beyond map_point_limit colleges in view, the layer has clusters holding every college in view, colored by
+## their dominant category (a cluster of one college keeps its tooltip)
+def test_layer_frame_clusters_over_limit(make_wide, monkeypatch):
+    monkeypatch.setattr(cgs, 'map_point_limit', 50)
+    df = make_wide(300)
+    map_index, map_data = cgs.MapIndex(df), cgs.build_map_data(df)
+    view = map_index.get_view()
+    frame, clustered = map_index.get_layer_frame(np.arange(300), 'region', view, map_data)
+    assert clustered and len(frame) < 300
+    counts = [1 if x.startswith("<b>Name:") else int(x.split(" colleges")[0][3:].replace(",", "")) for x in frame['tooltip']]
+    assert sum(counts) == len(map_index.cull(np.arange(300), view))
+    palette = {tuple(x) for x in cgs.color_maps['region'].values()}
+    assert all(tuple(x) in palette for x in frame[['col_r', 'col_g', 'col_b', 'col_a']].to_numpy())
+    ## zoomed in, the colleges are points again
+    frame, clustered = map_index.get_layer_frame(np.arange(300), 'region', dict(view, zoom=cgs.map_cluster_max_zoom), map_data)
+    assert not clustered
+
+## a state view is fitted to the colleges of the state, and culls the colleges outside the viewport
+def test_state_view_and_cull(make_wide):
+    df = make_wide(300)
+    df.loc[df['state'] == 'MA', ['lat', 'lon']] = [42.36, -71.06]
+    df.loc[0, ['state', 'lat', 'lon']] = ['MA', 42.5, -71.3]
+    map_index = cgs.MapIndex(df)
+    view = map_index.get_view('MA')
+    assert view['zoom'] == 10 and abs(view['latitude'] - 42.43) < 0.1 and abs(view['longitude'] + 71.18) < 0.1
+    assert map_index.get_view() == cgs.map_initial_view and map_index.get_view('ZZ') == cgs.map_initial_view
+    culled = map_index.cull(np.arange(300), view)
+    assert set(culled) == set(np.flatnonzero(df['state'] == 'MA'))
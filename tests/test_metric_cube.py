@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import college_guide_shared as cgs
+
+metrics = ['ADM_RATE', 'SAT_AVG', 'UGDS_WHITE']
+
+def make_cube(make_wide, make_tall, num_rows=60):
+    df_wide = make_wide(num_rows)
+    df_tall = make_tall(df_wide['id'], metrics=metrics, years=(2009, 2015, 2020))
+    ## drop some rows, so that the cube has missing values
+    df_tall = df_tall[np.random.default_rng(3).random(len(df_tall)) > 0.2].reset_index(drop=True)
+    return df_wide, df_tall, cgs.MetricCube(df_wide, df_tall, metrics)
+
+## the cube holds the tall values at (row of df_wide, metric, year), and NaN where the tall data has no row
+def test_cube_matches_tall_rows(make_wide, make_tall):
+    df_wide, df_tall, cube = make_cube(make_wide, make_tall)
+    assert cube.years.tolist() == list(range(2009, 2021))
+    values = cube.fetch(np.arange(len(df_wide)), metrics)
+    assert np.count_nonzero(~np.isnan(values)) == len(df_tall)
+    rows = df_tall.set_index(['INSTID', 'COLUMN', 'YEAR'])['VALUE']
+    for position in [0, 17, 59]:
+        for (instid, metric, year), value in rows[rows.index.get_level_values(0) == df_wide['id'][position]].items():
+            assert values[position, metrics.index(metric), year - 2009] == value
+
+## the peer medians are the per-year medians of the metric over the colleges of each group
+def test_peer_medians_match_pandas(make_wide, make_tall):
+    df_wide, df_tall, cube = make_cube(make_wide, make_tall)
+    groups, medians = cube.get_peer_medians('tier_name', [0, 1, 2], ['SAT_AVG'])
+    assert groups == list(dict.fromkeys(df_wide['tier_name'][:3]))
+    df = df_tall[df_tall['COLUMN'] == 'SAT_AVG'].merge(df_wide[['id', 'tier_name']], left_on='INSTID', right_on='id')
+    expected = df.groupby(['tier_name', 'YEAR'], observed=True)['VALUE'].median()
+    for group, values in zip(groups, medians[:, 0]):
+        for year in [2009, 2015, 2020]:
+            np.testing.assert_allclose(values[year - 2009], expected[(group, year)], rtol=1e-6)
+        assert np.isnan(values[2010 - 2009])
+
+## the cube written next to a snapshot is read back memory-mapped, unless it no longer matches the rows or metrics
+def test_cube_snapshot_round_trip(tmp_path, make_wide, make_tall):
+    df_wide, df_tall, cube = make_cube(make_wide, make_tall)
+    cgs.write_metric_cube(cube, str(tmp_path))
+    stored = cgs.read_metric_cube(str(tmp_path), len(df_wide), metrics)
+    assert isinstance(stored[0], np.memmap)
+    loaded = cgs.MetricCube(df_wide, None, metrics, stored=stored)
+    np.testing.assert_array_equal(loaded.data, cube.data)
+    np.testing.assert_array_equal(loaded.years, cube.years)
+    assert cgs.read_metric_cube(str(tmp_path), len(df_wide) + 1, metrics) is None
+    assert cgs.read_metric_cube(str(tmp_path), len(df_wide), metrics[:2]) is None
+    assert cgs.read_metric_cube(str(tmp_path / "missing"), len(df_wide), metrics) is None
+
+## the Compare chart keys its series by college id, so that colleges of the same name stay apart
+def test_compare_chart_keys_series_by_id(make_wide, make_tall):
+    df_wide, df_tall, cube = make_cube(make_wide, make_tall)
+    df_wide['name'] = "Same College"
+    labels = ["Same College (Springfield, CA)", "Same College (Franklin, TX)"]
+    df = cgs.get_compare_chart_frame(cube, [4, 5], 'SAT_AVG', labels, 'tier_name')
+    selected = df[df['KIND'] == 'Selected college']
+    assert set(selected['INSTID']) == {str(df_wide['id'][4]), str(df_wide['id'][5])}
+    assert (selected['LABEL'] == selected['INSTID'].map({str(df_wide['id'][4]): labels[0], str(df_wide['id'][5]): labels[1]})).all()
+    assert len(selected) == np.count_nonzero(~np.isnan(cube.fetch([4, 5], ['SAT_AVG'])))
+    medians = df[df['KIND'] == 'Peer-group median']
+    assert set(medians['LABEL']) == {f"Median: {x}" for x in df_wide['tier_name'][[4, 5]]}
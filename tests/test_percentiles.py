@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+import college_guide_shared as cgs
+
+## the percentiles match rank(pct=True) * 100 of the column, with ties and missing values
+def test_percentiles_match_rank(make_wide):
+    df = make_wide(300)
+    colnames = ['admissions__sat_scores__average__overall', 'par_median', 'female']
+    ## ties
+    df['female'] = df['female'].round(1)
+    service = cgs.PercentileService(df)
+    rows = np.arange(0, len(df), 3)
+    expected = (df[colnames].rank(pct=True) * 100).iloc[rows]
+    pd.testing.assert_frame_equal(service.get_percentiles(rows, colnames), expected, check_dtype=False)
+    ## a single value, a missing value, and a value above those of the column
+    value = df['par_median'].iloc[5]
+    assert service.get_percentile('par_median', value) == df['par_median'].rank(pct=True).iloc[5] * 100
+    assert np.isnan(service.get_percentile('par_median', np.nan))
+    assert service.get_percentile('par_median', 2.0) == 100 * (1 + 0.5 / df['par_median'].count())
+
+## only the columns that are used are sorted
+def test_percentiles_are_lazy(make_wide):
+    service = cgs.PercentileService(make_wide(20))
+    service.get_percentile('female', 0.5)
+    assert list(service.sorted_values) == ['female']
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+import college_guide_shared as cgs
+
+@pytest.fixture
+def perf_stats(monkeypatch):
+    stats = cgs.PerfStats(window=10)
+    monkeypatch.setattr(cgs, 'get_perf_stats', lambda: stats)
+    return stats
+
+## a timed callback called by another one is only timed as part of the outer callback
+def test_nested_callbacks_are_recorded_once(perf_stats):
+    @cgs.timed_callback('page')
+    def inner():
+        return 1
+
+    @cgs.timed_callback('page')
+    def outer():
+        return inner() + 1
+
+    assert outer() == 2
+    assert list(perf_stats.samples) == [('page', 'callback.outer', 'ms')]
+    assert inner() == 1
+    assert len(perf_stats.samples[('page', 'callback.inner', 'ms')]) == 1
+
+## a failing callback is recorded, and does not keep the next callbacks from being recorded
+def test_failing_callback(perf_stats):
+    @cgs.timed_callback('page')
+    def fail():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        fail()
+    with pytest.raises(ValueError):
+        fail()
+    assert len(perf_stats.samples[('page', 'callback.fail', 'ms')]) == 2
+
+## the summary keeps the last samples of each (page, stage, metric)
+def test_perf_summary(perf_stats):
+    for i in range(25):
+        perf_stats.record('page', 'rerun', 'ms', float(i))
+    perf_stats.record('other', 'rerun', 'ms', 1.0)
+    summary = perf_stats.get_summary('page')
+    assert len(summary) == 1
+    row = summary.iloc[0]
+    assert row['count'] == 10 and row['max'] == 24 and row['p50'] == np.percentile(np.arange(15, 25), 50)
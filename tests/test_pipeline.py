@@ -0,0 +1,51 @@
+import threading, time
+import pytest
+import college_guide_shared as cgs
+
+## each stage gets the results of its deps, independent stages run concurrently, and every stage is timed
+def test_run_pipeline_results_and_timings():
+    barrier = threading.Barrier(2, timeout=5)
+    finished = []
+    stages = [
+        ('a', lambda: [barrier.wait(), 1][1], []),
+        ('b', lambda: [barrier.wait(), 2][1], []),
+        ('c', lambda a, b: a + b, ['a', 'b']),
+        ('d', lambda c, a: c * 10 + a, ['c', 'a']),
+    ]
+    results, timings = cgs.run_pipeline(stages, max_workers=2, on_stage=lambda name, seconds: finished.append(name))
+    assert results == {'a': 1, 'b': 2, 'c': 3, 'd': 31}
+    assert set(timings) == {'a', 'b', 'c', 'd'} and all(x >= 0 for x in timings.values())
+    assert sorted(finished[:2]) == ['a', 'b'] and finished[2:] == ['c', 'd']
+
+## the error of a stage is raised by run_pipeline(), and the stages depending on it never run
+def test_run_pipeline_error_propagation():
+    ran = []
+    def fail():
+        raise KeyError('missing column')
+    stages = [
+        ('fail', fail, []),
+        ('slow', lambda: time.sleep(0.05) or ran.append('slow'), []),
+        ('dependent', lambda x: ran.append('dependent'), ['fail']),
+    ]
+    with pytest.raises(KeyError, match='missing column'):
+        cgs.run_pipeline(stages, max_workers=2)
+    assert 'dependent' not in ran
+
+## stages with unknown or circular dependencies are reported instead of waiting forever
+@pytest.mark.parametrize('stages', [
+    [('a', lambda x: x, ['missing'])],
+    [('a', lambda b: b, ['b']), ('b', lambda a: a, ['a'])],
+])
+def test_run_pipeline_invalid_dependencies(stages):
+    with pytest.raises(ValueError, match='unknown or circular'):
+        cgs.run_pipeline(stages)
+
+## parse_data() records the timings of its stages
+def test_parse_data_timings(source_files):
+    tmp_path, df_wide, df_tall = source_files
+    cgs.load_timings.clear()
+    parsed_wide, parsed_tall = cgs.parse_data()
+    assert set(cgs.load_timings) == {'parse_wide', 'parse_tall', 'sort_tall'}
+    assert len(parsed_wide) == len(df_wide)
+    keys = parsed_tall[['INSTID', 'COLUMN', 'YEAR']].astype({'COLUMN': str})
+    assert keys.equals(keys.sort_values(['INSTID', 'COLUMN', 'YEAR'], kind='stable'))
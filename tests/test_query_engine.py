@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+import pytest
+import college_guide_shared as cgs
+
+## query_batch() evaluates each spec like query() and like a plain pandas filter
+def test_query_batch_matches_query(make_wide):
+    df = make_wide()
+    engine = cgs.QueryEngine(df)
+    specs = [
+        {},
+        {'region': ['South', 'West']},
+        {'region': 'Midwest', 'admissions__sat_scores__average__overall': [1200, None]},
+        {'barrons': ['1 - Elite'], 'admissions__admission_rate__overall': [None, 0.3]},
+        {'admissions__sat_scores__average__overall': [1000, 1400], 'admissions__admission_rate__overall': [0.13, 0.29]},
+        {'region': []},
+    ]
+    batch = engine.query_batch(specs)
+    for spec, ids in zip(specs, batch):
+        np.testing.assert_array_equal(ids, engine.query(spec))
+        mask = np.ones(len(df), dtype=bool)
+        for colname, cond in spec.items():
+            if colname in ('region', 'barrons'):
+                mask &= df[colname].isin([cond] if isinstance(cond, str) else cond).to_numpy()
+            else:
+                lo, hi = cond
+                values = df[colname].to_numpy()
+                mask &= ~np.isnan(values)
+                if lo is not None:
+                    mask &= values >= np.float32(lo)
+                if hi is not None:
+                    mask &= values <= np.float32(hi)
+        np.testing.assert_array_equal(ids, df['id'].to_numpy()[mask])
+
+@pytest.mark.parametrize('spec', [
+    {'admissions__sat_scores__average__overall': 1200},
+    {'admissions__sat_scores__average__overall': [1200]},
+    {'no_such_column': ['x']},
+])
+def test_invalid_specs_raise_value_error(make_wide, spec):
+    with pytest.raises(ValueError):
+        cgs.QueryEngine(make_wide()).query(spec)
+
+## colleges and their tall rows are looked up by id, in the order asked (unknown ids are skipped)
+def test_lookups_by_id(make_wide, make_tall):
+    df_wide = make_wide(20)
+    ## ids that are not sorted like the rows
+    df_wide['id'] = df_wide['id'].to_numpy()[::-1]
+    engine = cgs.QueryEngine(df_wide, make_tall(df_wide['id'].sort_values()))
+    np.testing.assert_array_equal(engine.get_positions([1019, 5, 1000]), [0, -1, 19])
+    assert engine.get_colleges([1000, 5, 1019], ['id'])['id'].tolist() == [1000, 1019]
+    rows = engine.get_tall([1005, 1002], ['SAT_AVG'])
+    assert rows['INSTID'].tolist() == [1005, 1005, 1002, 1002] and set(rows['COLUMN']) == {'SAT_AVG'}
+
+## the query engine of the app is built on the loaded data of a version
+def test_load_query_engine(source_files):
+    tmp_path, df_wide, df_tall = source_files
+    engine = cgs.load_query_engine.__wrapped__(cgs.get_source_fingerprint())
+    np.testing.assert_array_equal(engine.query({'region': ['South']}), df_wide.loc[df_wide['region'] == 'South', 'id'])
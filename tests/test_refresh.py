@@ -0,0 +1,102 @@
+import os, json
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+import college_guide_shared as cgs
+from conftest import write_wide_file, write_tall_file
+
+## merge_data(): rows of the delta replace the rows with the same id in place (columns missing from the delta keep
+## their values), new colleges are appended, and tall rows replace the same (INSTID, COLUMN, YEAR)
+def test_merge_data_updates_and_appends(make_wide, make_tall):
+    df_wide = make_wide(10)
+    df_tall = make_tall(df_wide['id'].to_numpy())
+    delta_wide = pd.DataFrame({'id': np.array([1003, 2000], dtype=df_wide['id'].dtype),
+                               'admissions__sat_scores__average__overall': np.array([1555, 1111], dtype=np.float32)})
+    delta_tall = make_tall([1003, 2000], metrics=('SAT_AVG',), years=(2020, 2021))
+    delta_tall['VALUE'] = np.float32(-1)
+    merged_wide, merged_tall = cgs.merge_data(df_wide, df_tall, delta_wide, delta_tall)
+
+    assert len(merged_wide) == len(df_wide) + 1
+    assert (merged_wide.dtypes == df_wide.dtypes).all()
+    ## the existing colleges keep their positions, and the missing columns their values
+    np.testing.assert_array_equal(merged_wide['id'].to_numpy()[:len(df_wide)], df_wide['id'].to_numpy())
+    assert merged_wide.loc[3, 'admissions__sat_scores__average__overall'] == 1555
+    assert merged_wide.loc[3, 'name'] == df_wide.loc[3, 'name']
+    assert merged_wide.loc[3, 'region'] == df_wide.loc[3, 'region']
+    pd.testing.assert_frame_equal(merged_wide.drop(index=[3, 10]), df_wide.drop(index=3))
+    ## the new college is appended, with missing values in the columns the delta does not have
+    assert merged_wide.loc[10, 'id'] == 2000
+    assert merged_wide.loc[10, 'admissions__sat_scores__average__overall'] == 1111
+    assert pd.isna(merged_wide.loc[10, 'name'])
+
+    ## tall rows: (1003, SAT_AVG, 2020) replaced, (1003, SAT_AVG, 2021) and the rows of 2000 added
+    assert len(merged_tall) == len(df_tall) + 3
+    assert not merged_tall.duplicated(['INSTID', 'COLUMN', 'YEAR']).any()
+    keys = merged_tall[['INSTID', 'COLUMN', 'YEAR']].astype({'COLUMN': str})
+    assert keys.equals(keys.sort_values(['INSTID', 'COLUMN', 'YEAR'], kind='stable'))
+    rows = merged_tall.set_index(['INSTID', 'COLUMN', 'YEAR'])['VALUE']
+    assert rows[(1003, 'SAT_AVG', 2020)] == -1
+    assert rows[(1003, 'SAT_AVG', 2019)] == df_tall.set_index(['INSTID', 'COLUMN', 'YEAR'])['VALUE'][(1003, 'SAT_AVG', 2019)]
+    assert rows[(2000, 'SAT_AVG', 2021)] == -1
+
+## a partial delta: one changed college and two new ones, with only a few columns (no categories)
+def write_delta_files(tmp_path, make_wide, make_tall, name="delta"):
+    delta_wide = make_wide(52, seed=5).iloc[[10, 50, 51]][['id', 'name', 'admissions__sat_scores__average__overall']]
+    write_wide_file(tmp_path / f"{name}.tsv", delta_wide)
+    write_tall_file(tmp_path / f"{name}_tall.tsv.gz", make_tall(delta_wide['id'], metrics=('SAT_AVG',), years=(2021,)))
+    return str(tmp_path / f"{name}.tsv"), str(tmp_path / f"{name}_tall.tsv.gz")
+
+def read_current(tmp_path):
+    with open(tmp_path / "snapshot" / cgs.data_version_file) as fh:
+        return json.load(fh)
+
+## refresh_data() merges the delta into the published data and publishes the result in current.json
+def test_refresh_publishes_new_version(source_files, make_wide, make_tall):
+    tmp_path, df_wide, df_tall = source_files
+    base = cgs.get_source_fingerprint()
+    base_wide, base_tall = cgs.load_prepared_data()
+    info = cgs.refresh_data(*write_delta_files(tmp_path, make_wide, make_tall))
+    assert (info['previous'], info['wide_updated'], info['wide_added'], info['tall_added']) == (base, 1, 2, 3)
+    current = read_current(tmp_path)
+    assert (current['version'], current['base'], current['history']) == (info['version'], base, [info['version']])
+    assert cgs.read_data_version() == info['version']
+    merged_wide, merged_tall = cgs.load_prepared_data()
+    assert len(merged_wide) == 52 and len(merged_tall) == len(base_tall) + 3
+    ## regenerating the source files supersedes the refresh
+    with open(tmp_path / "wide.tsv", 'a') as fh:
+        fh.write("\n")
+    assert cgs.read_data_version() == cgs.get_source_fingerprint() != base
+
+## refreshes in a row keep the snapshot of the source files and of the last published versions
+def test_refreshes_in_a_row_keep_served_versions(source_files, make_wide, make_tall, monkeypatch):
+    tmp_path = source_files[0]
+    monkeypatch.setattr(cgs, 'data_version_keep', 2)
+    base = cgs.get_source_fingerprint()
+    cgs.load_prepared_data()
+    versions = []
+    for i in range(3):
+        versions.append(cgs.refresh_data(*write_delta_files(tmp_path, make_wide, make_tall, f"delta{i}"))['version'])
+        assert cgs.read_data_version() == versions[-1]
+        snapshots = sorted(x for x in os.listdir(cgs.snapshot_dir) if cgs.snapshot_name_re.fullmatch(x))
+        assert snapshots == sorted([base] + versions[-2:])
+        assert read_current(tmp_path)['history'] == versions[-2:]
+    assert len(set(versions)) == 3
+
+## after a partial delta adds colleges without categories, the Filter page offers only the actual values,
+## and selects the new colleges while every value is selected
+def test_filter_page_after_partial_refresh(source_files, make_wide, make_tall):
+    tmp_path, df_wide, df_tall = source_files
+    cgs.refresh_data(*write_delta_files(tmp_path, make_wide, make_tall))
+    merged_wide = cgs.load_prepared_data()[0]
+    assert merged_wide['region'].isna().sum() == 2
+    options = cgs.get_filter_options(merged_wide)
+    for key in cgs.filter_option_columns:
+        assert options[key] == sorted(df_wide[key].unique()), key
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    app = AppTest.from_file(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pages", "1_filter.py"),
+                            default_timeout=60)
+    app.run()
+    assert not app.exception
+    assert app.markdown[0].value == "#### Currently, 52 colleges are selected."
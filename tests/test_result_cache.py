@@ -0,0 +1,56 @@
+import numpy as np
+import college_guide_shared as cgs
+
+## the cache returns the stored result of a key, and evicts the least recently used entries beyond max_entries
+def test_entry_eviction():
+    cache = cgs.ResultCache(max_entries=2)
+    calls = []
+    compute = lambda x: lambda: calls.append(x) or x * 10
+    assert cache.get('a', compute(1)) == 10 and cache.get('b', compute(2)) == 20
+    assert cache.get('a', compute(1)) == 10 and calls == [1, 2]
+    cache.get('c', compute(3))
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.get('b', compute(2)) == 20 and calls == [1, 2, 3, 2]
+    assert cache.get_stats() == {'entries': 2, 'bytes': 0, 'hits': 1, 'misses': 4}
+
+## with a byte budget, the least recently used entries are evicted until the results fit in max_bytes
+## (a single result larger than the budget is still kept, until the next one)
+def test_byte_eviction():
+    cache = cgs.ResultCache(max_entries=100, max_bytes=3000)
+    for key in ['a', 'b', 'c']:
+        cache.get(key, lambda: np.zeros(1000, dtype=np.uint8))
+    assert list(cache.entries) == ['a', 'b', 'c'] and cache.get_stats()['bytes'] == 3000
+    cache.get('a', lambda: None)
+    cache.get('d', lambda: np.zeros(1500, dtype=np.uint8))
+    assert list(cache.entries) == ['a', 'd'] and cache.get_stats()['bytes'] == 2500
+    cache.get('e', lambda: np.zeros(5000, dtype=np.uint8))
+    assert list(cache.entries) == ['e'] and cache.get_stats()['bytes'] == 5000
+
+## the Filter page cache is bounded by both its number of entries and its bytes
+def test_filter_cache_budget(monkeypatch):
+    monkeypatch.setattr(cgs, 'filter_cache_bytes', 2000)
+    cache = cgs.load_filter_cache.__wrapped__("0123456789abcdef")
+    assert (cache.max_entries, cache.max_bytes) == (cgs.filter_cache_entries, 2000)
+    for key in range(3):
+        cache.get(key, lambda: np.zeros(1000, dtype=np.uint8))
+    assert list(cache.entries) == [1, 2]
+
+## the View page cache keeps the prepared chart frames of the recently viewed colleges within view_cache_bytes,
+## whatever their number, evicting the least recently viewed colleges first
+def test_view_cache_byte_eviction(make_wide, make_tall, monkeypatch):
+    df_wide = make_wide(20)
+    cube = cgs.MetricCube(df_wide, make_tall(df_wide['id'], metrics=('SAT_AVG', 'ADM_RATE'), years=range(2000, 2020)),
+                          metrics=['SAT_AVG', 'ADM_RATE'])
+    build = lambda position: lambda: cgs.get_view_chart_frame(cube, position, ['SAT_AVG', 'ADM_RATE'])
+    size = cgs.get_session_bytes(build(0)())
+    monkeypatch.setattr(cgs, 'view_cache_bytes', int(size * 3.5))
+    cache = cgs.load_view_cache.__wrapped__("0123456789abcdef")
+    assert cache.max_entries is None
+    for position in range(5):
+        cache.get(('charts', position, None), build(position))
+        assert cache.get_stats()['bytes'] <= cgs.view_cache_bytes
+    assert list(cache.entries) == [('charts', x, None) for x in [2, 3, 4]]
+    frame = cache.get(('charts', 2, None), lambda: None)
+    assert len(frame) == 40 and cache.get_stats()['hits'] == 1
+    cache.get(('charts', 5, None), build(5))
+    assert list(cache.entries) == [('charts', x, None) for x in [4, 2, 5]]
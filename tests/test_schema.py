@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+import college_guide_shared as cgs
+
+## the parsed frames have the compact dtypes
+def test_parsed_dtypes(source_files):
+    df_wide = cgs.parse_wide_data(cgs.widef)
+    assert df_wide['id'].dtype == np.int32
+    assert df_wide['lat'].dtype == np.float32 and df_wide['student__size'].dtype == np.float32
+    assert all(isinstance(df_wide[x].dtype, pd.CategoricalDtype) for x in cgs.cats)
+    df_tall = cgs.read_tall_data(cgs.tallf, cgs.tall_metrics)
+    assert df_tall.dtypes.astype(str).to_dict() == {'INSTID': 'int32', 'COLUMN': 'category', 'YEAR': 'int16', 'VALUE': 'float32'}
+
+## a float32 value equal to a bound matches, although it is below the float64 bound (0.29 -> 0.28999999)
+def test_range_bounds_match_float32_values(make_wide):
+    df = make_wide()
+    df['admissions__admission_rate__overall'] = np.float32(0.29)
+    engine = cgs.QueryEngine(df)
+    assert len(engine.query({'admissions__admission_rate__overall': [0.29, 0.29]})) == len(df)
+    filter_engine = cgs.FilterEngine(df, (), ('admissions__admission_rate__overall',))
+    assert filter_engine.get_range_mask('admissions__admission_rate__overall', 0.29, 0.29).all()
+
+## loading fails when the frames exceed the memory budget, unless the budget is only a warning
+def test_memory_budget(make_wide, capsys):
+    report = cgs.get_memory_report({'df_wide': make_wide(100)})
+    total_mb = report['df_wide']['total'] / 1e6
+    assert cgs.check_memory_budget(report, 0) == total_mb
+    assert cgs.check_memory_budget(report, total_mb * 2) == total_mb
+    with pytest.raises(MemoryError, match="over the budget"):
+        cgs.check_memory_budget(report, total_mb / 2)
+    assert cgs.check_memory_budget(report, total_mb / 2, warn_only=True) == total_mb
+    assert "over the budget" in capsys.readouterr().err
+
+def test_load_data_checks_memory_budget(source_files, monkeypatch):
+    monkeypatch.setattr(cgs, 'memory_budget_mb', 1e-3)
+    with pytest.raises(MemoryError):
+        cgs.load_data.__wrapped__(cgs.get_source_fingerprint())
+    monkeypatch.setattr(cgs, 'memory_budget_warn_only', True)
+    df_wide, df_tall = cgs.load_data.__wrapped__(cgs.get_source_fingerprint())
+    assert len(df_wide) == 50
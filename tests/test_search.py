@@ -0,0 +1,43 @@
+import numpy as np
+import pandas as pd
+import college_guide_shared as cgs
+
+def make_colleges():
+    return pd.DataFrame({
+        'name': ['Massachusetts Institute of Technology', 'Boston University', 'Saint Louis University',
+                 'University of Texas at Austin', 'Texas A&M University', 'Boston College'],
+        'school__name': ['Massachusetts Institute of Technology', 'Boston University', 'Saint Louis University',
+                         'The University of Texas at Austin', 'Texas A & M University-College Station', np.nan],
+        'school__city': ['Cambridge', 'Boston', 'Saint Louis', 'Austin', 'College Station', 'Chestnut Hill'],
+        'school__state': ['MA', 'MA', 'MO', 'TX', 'TX', 'MA'],
+        'student__size': [4500, 18000, 7000, 41000, 57000, np.nan],
+    })
+
+## prefix matches: the start of a name first, then the start of another word, ranked by enrollment
+def test_prefix_matches():
+    index = cgs.SearchIndex(make_colleges())
+    assert index.search("bost").tolist() == [1, 5]
+    assert index.search("university").tolist() == [3, 4, 1, 2]
+    assert index.search("texas").tolist() == [4, 3]
+    assert index.search("Texas A&M").tolist()[:1] == [4]
+    assert index.get_label(0) == "Massachusetts Institute of Technology (Cambridge, MA)"
+
+## aliases: acronyms, the saint/st spelling, and the city/state
+def test_aliases():
+    index = cgs.SearchIndex(make_colleges())
+    assert index.search("MIT")[:1].tolist() == [0]
+    assert index.search("st louis")[:1].tolist() == [2]
+    assert index.search("chestnut hill")[:1].tolist() == [5]
+    assert 3 in index.search("austin tx")
+
+## fuzzy matches by trigrams: a typo still finds the college, unrelated text finds nothing
+def test_trigram_matches():
+    index = cgs.SearchIndex(make_colleges())
+    assert index.search("masachusets")[:1].tolist() == [0]
+    assert len(index.search("zzzz")) == 0
+
+## an empty query lists the largest colleges, and k bounds the number of matches
+def test_default_order_and_top_k():
+    index = cgs.SearchIndex(make_colleges())
+    assert index.search("").tolist() == [4, 3, 1, 2, 0, 5]
+    assert len(index.search("", k=2)) == 2 and len(index.search("university", k=2)) == 2
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+import college_guide_shared as cgs
+
+## brute-force weighted RMS distances over the standardized features both colleges have (None below the overlap)
+def brute_force_distances(df, features, position, weights, min_overlap):
+    values = df[features].to_numpy(dtype=float)
+    std = np.nanstd(values, axis=0)
+    std[~(std > 0)] = 1.0
+    z = (values - np.nanmean(values, axis=0)) / std
+    total = np.sum(weights[~np.isnan(z[position])])
+    dists = []
+    for i in range(len(df)):
+        both = ~np.isnan(z[position]) & ~np.isnan(z[i])
+        if i == position or np.sum(weights[both]) < min_overlap * total:
+            dists.append(None)
+        else:
+            dists.append(np.sqrt(np.sum(weights[both] * (z[i, both] - z[position, both]) ** 2) / np.sum(weights[both])))
+    return dists
+
+## the nearest colleges and distances match the brute force, with missing values skipped rather than imputed
+def test_get_similar_matches_brute_force(make_wide):
+    df = make_wide(150, seed=4)
+    features = list(cgs.qts.keys())[:6]
+    index = cgs.SimilarityIndex(df, features)
+    weights = np.array([1, 2, 0.5, 1, 0, 3], dtype=float)
+    for position in [0, 7, 42]:
+        dists = brute_force_distances(df, features, position, weights * ~np.isnan(df[features].to_numpy(dtype=float)[position]), 0.5)
+        nearest, dist = index.get_similar(position, weights, k=10)
+        expected = sorted((d, i) for i, d in enumerate(dists) if d is not None)[:10]
+        np.testing.assert_allclose(dist, [d for d, i in expected], rtol=1e-4, atol=1e-5)
+        assert position not in nearest
+        assert np.all(np.diff(dist) >= 0)
+
+## colleges that share too few of the query's features are left out, and a college without any features finds nothing
+def test_get_similar_min_overlap():
+    df = pd.DataFrame({'a': [0.0, 1.0, 2.0, np.nan, 5.0], 'b': [0.0, 1.0, np.nan, np.nan, 5.0], 'c': [0.0, np.nan, np.nan, np.nan, 5.0]})
+    index = cgs.SimilarityIndex(df, ['a', 'b', 'c'])
+    nearest, dist = index.get_similar(0, min_overlap=0.6)
+    assert sorted(nearest.tolist()) == [1, 4]
+    nearest, dist = index.get_similar(0, min_overlap=0.3)
+    assert sorted(nearest.tolist()) == [1, 2, 4]
+    assert len(index.get_similar(3)[0]) == 0
+    assert np.all(np.isfinite(dist))
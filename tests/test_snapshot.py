@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import college_guide_shared as cgs
+
+## the column store gives back the frames with their values and dtypes (categoricals, strings and missing values included)
+def test_column_store_round_trip(tmp_path, make_wide, make_tall):
+    df_wide = make_wide(30)
+    df_wide.loc[3, 'region'] = np.nan
+    df_wide.loc[4, 'school__city'] = np.nan
+    df_tall = make_tall(df_wide['id'])
+    cgs.write_column_store({'df_wide': df_wide, 'df_tall': df_tall}, str(tmp_path / "store"))
+    frames = cgs.read_column_store(str(tmp_path / "store"))
+    pd.testing.assert_frame_equal(frames['df_wide'], df_wide)
+    pd.testing.assert_frame_equal(frames['df_tall'], df_tall)
+
+## the fingerprint changes with the contents of the source files and the snapshot version, not with their names
+def test_source_fingerprint(source_files, monkeypatch):
+    tmp_path, df_wide, df_tall = source_files
+    fingerprint = cgs.get_source_fingerprint()
+    assert len(fingerprint) == 16 and fingerprint == cgs.get_source_fingerprint()
+    monkeypatch.setattr(cgs, 'snapshot_version', cgs.snapshot_version + 1)
+    assert cgs.hash_source_files((cgs.widef, cgs.tallf, cgs.dictf)) != fingerprint
+    monkeypatch.undo()
+    with open(tmp_path / "data.yaml", 'a') as fh:
+        fh.write("# changed\n")
+    assert cgs.get_source_fingerprint() != fingerprint
+
+## the source files are parsed once; the next loads read the snapshot, until the sources change
+def test_load_prepared_data_reuses_snapshot(source_files, monkeypatch):
+    tmp_path, df_wide, df_tall = source_files
+    parse_data = cgs.parse_data
+    calls = []
+    monkeypatch.setattr(cgs, 'parse_data', lambda: calls.append(1) or parse_data())
+    parsed_wide, parsed_tall = cgs.load_prepared_data()
+    assert len(calls) == 1 and os.path.isdir(os.path.join(cgs.snapshot_dir, cgs.get_source_fingerprint()))
+    np.testing.assert_array_equal(parsed_wide['id'], df_wide['id'])
+    loaded_wide, loaded_tall = cgs.load_prepared_data()
+    assert len(calls) == 1 and 'read_snapshot' in cgs.load_timings
+    pd.testing.assert_frame_equal(loaded_wide, parsed_wide)
+    pd.testing.assert_frame_equal(loaded_tall, parsed_tall)
+    with open(tmp_path / "wide.tsv", 'a') as fh:
+        fh.write("\n")
+    cgs.load_prepared_data()
+    assert len(calls) == 2
+
+## the snapshot columns are read-only memory maps of the files of the store
+def test_snapshot_is_memory_mapped(tmp_path, make_wide, make_tall, monkeypatch):
+    monkeypatch.setattr(cgs, 'snapshot_dir', str(tmp_path))
+    df_wide = make_wide(20)
+    cgs.write_snapshot((df_wide, make_tall(df_wide['id'])), "0123456789abcdef")
+    df_wide, df_tall = cgs.read_snapshot("0123456789abcdef")
+    for values in [df_wide['lat'].to_numpy(), df_tall['VALUE'].to_numpy(), df_wide['region'].cat.codes.to_numpy()]:
+        assert not values.flags.writeable
+    base = df_wide['lat'].to_numpy()
+    while isinstance(base, np.ndarray) and not isinstance(base, np.memmap):
+        base = base.base
+    assert isinstance(base, np.memmap)
+    assert cgs.read_snapshot("fedcba9876543210") is None
+
+## writing a snapshot drops the stale snapshots, except those kept, and leaves the other entries of the directory alone
+def test_write_snapshot_drops_stale_snapshots(tmp_path, make_wide, make_tall, monkeypatch):
+    monkeypatch.setattr(cgs, 'snapshot_dir', str(tmp_path))
+    df_wide = make_wide(20)
+    frames = (df_wide, make_tall(df_wide['id']))
+    for name in ["1111111111111111", "2222222222222222", "other_data", "3333333333333333x"]:
+        os.makedirs(tmp_path / name)
+    (tmp_path / "notes.txt").write_text("kept")
+    cgs.write_snapshot(frames, "0123456789abcdef", keep=("2222222222222222",))
+    assert sorted(os.listdir(tmp_path)) == ["0123456789abcdef", "2222222222222222", "3333333333333333x", "notes.txt", "other_data"]
+    ## writing the same snapshot again keeps the published one
+    cgs.write_snapshot(frames, "0123456789abcdef")
+    assert sorted(os.listdir(tmp_path)) == ["0123456789abcdef", "3333333333333333x", "notes.txt", "other_data"]
+    pd.testing.assert_frame_equal(cgs.read_snapshot("0123456789abcdef")[0], df_wide)
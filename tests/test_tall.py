@@ -0,0 +1,49 @@
+import gzip
+import numpy as np
+import pandas as pd
+import college_guide_shared as cgs
+
+## the tall index returns the rows of the institutions (and metrics) in the order asked, skipping unknown keys
+def test_get_tall_rows(make_tall):
+    df_tall = make_tall([1, 2, 3], metrics=('ADM_RATE', 'SAT_AVG', 'UGDS'))
+    tall_index = cgs.build_tall_index(df_tall)
+    rows = cgs.get_tall_rows(df_tall, tall_index, [3, 99, 1])
+    assert rows['INSTID'].tolist() == [3] * 6 + [1] * 6
+    rows = cgs.get_tall_rows(df_tall, tall_index, 2, ['SAT_AVG', 'NONE'])
+    assert rows['COLUMN'].tolist() == ['SAT_AVG'] * 2 and rows['INSTID'].tolist() == [2, 2]
+    assert len(cgs.get_tall_rows(df_tall, tall_index, [99])) == 0
+
+## the offsets match a boolean filter of the frame, for any set of institutions and metrics
+def test_get_tall_rows_match_boolean_filter(make_tall):
+    df_tall = make_tall(np.arange(1, 40), metrics=('ADM_RATE', 'SAT_AVG', 'UGDS', 'PCIP01'), years=(2018, 2019, 2020))
+    ## drop some rows, so that the blocks have different sizes
+    df_tall = df_tall[np.random.default_rng(0).random(len(df_tall)) < 0.7].reset_index(drop=True)
+    tall_index = cgs.build_tall_index(df_tall)
+    for instids, columns in [([5], None), ([7, 2, 30], None), ([7, 2, 30], ['UGDS', 'ADM_RATE']), ([1, 39], ['PCIP01'])]:
+        rows = cgs.get_tall_rows(df_tall, tall_index, instids, columns)
+        if columns is None:
+            expected = pd.concat([df_tall[df_tall['INSTID'] == x] for x in instids])
+        else:
+            expected = pd.concat([df_tall[(df_tall['INSTID'] == x) & (df_tall['COLUMN'] == c)] for x in instids for c in columns])
+        pd.testing.assert_frame_equal(rows, expected)
+
+## streaming the tall file keeps only the given metrics and years, whatever the chunk size
+def test_read_tall_data_pushdown(tmp_path, make_tall):
+    df = make_tall([1, 2, 3], metrics=('ADM_RATE', 'UGDS_WHITE', 'UNUSED'), years=(2009, 2011, 2015, 2020))
+    fname = tmp_path / "tall.tsv.gz"
+    with gzip.open(fname, 'wt') as fh:
+        df.to_csv(fh, sep="\t", index=False)
+    for chunksize in [5, 1000]:
+        rows = cgs.read_tall_data(fname, ['UGDS_WHITE', 'ADM_RATE'], chunksize=chunksize)
+        assert set(rows['COLUMN']) == {'ADM_RATE', 'UGDS_WHITE'} and len(rows) == 3 * 2 * 4
+        assert list(rows['COLUMN'].cat.categories) == ['ADM_RATE', 'UGDS_WHITE']
+        ## the first year kept for each metric prefix
+        rows = cgs.read_tall_data(fname, ['UGDS_WHITE', 'ADM_RATE'], year_rules={'UGDS_': 2011}, chunksize=chunksize)
+        assert rows.loc[rows['COLUMN'] == 'UGDS_WHITE', 'YEAR'].min() == 2011
+        assert rows.loc[rows['COLUMN'] == 'ADM_RATE', 'YEAR'].min() == 2009
+        ## and the given years only
+        rows = cgs.read_tall_data(fname, ['ADM_RATE'], years=[2015, 2020], chunksize=chunksize)
+        assert sorted(set(rows['YEAR'])) == [2015, 2020] and len(rows) == 3 * 2
+    expected = df[df['COLUMN'] == 'ADM_RATE'].reset_index(drop=True)
+    rows = cgs.read_tall_data(fname, ['ADM_RATE'], chunksize=5)
+    np.testing.assert_array_equal(rows['VALUE'], expected['VALUE'])